@@ -1,65 +1,98 @@
 # alerts.py
 
+import operator
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from profiling import timed
+
+# -------------------------------
+# Risk Rule Set
+# -------------------------------
+# Each rule flags a row when `column <op> threshold`. Missing or non-numeric
+# values never trigger a rule.
+RISK_RULES = [
+    {"issue": "Negative profit", "column": "profit_margin", "op": "<", "threshold": 0},
+    {"issue": "High yield gap", "column": "yield_gap", "op": ">", "threshold": 10},
+    {"issue": "Heavy rainfall", "column": "rt_rainfall", "op": ">", "threshold": 50},
+]
+
+_OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+# -------------------------------
+# Evaluate Rules
+# -------------------------------
+@timed("alerts.evaluate_risks")
+def evaluate_risks(df: pd.DataFrame, rules: list = None):
+    """
+    Evaluates every rule as a boolean mask over whole columns. Returns a
+    DataFrame aligned to df with one bool column per issue; pass it to the
+    detect/export helpers to avoid re-evaluating the rules.
+    """
+    rules = RISK_RULES if rules is None else rules
+    masks = {}
+    for rule in rules:
+        if rule["column"] in df.columns:
+            values = pd.to_numeric(df[rule["column"]], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+            with np.errstate(invalid="ignore"):
+                masks[rule["issue"]] = _OPERATORS[rule["op"]](values, rule["threshold"])
+        else:
+            masks[rule["issue"]] = np.zeros(len(df), dtype=bool)
+    return pd.DataFrame(masks, index=df.index, columns=[rule["issue"] for rule in rules])
+
+def _issue_lists(risks: pd.DataFrame):
+    """
+    Returns (flagged row mask, list of issue lists for flagged rows). Rows are
+    encoded as a bit pattern so each distinct combination is built only once.
+    """
+    flags = risks.to_numpy(dtype=bool)
+    codes = flags.astype(np.int64) @ (1 << np.arange(flags.shape[1], dtype=np.int64))
+    flagged = codes > 0
+    issues = list(risks.columns)
+    lookup = {
+        code: [issue for bit, issue in enumerate(issues) if code & (1 << bit)]
+        for code in np.unique(codes[flagged]).tolist()
+    }
+    return flagged, [lookup[code] for code in codes[flagged].tolist()]
 
 # -------------------------------
 # Detect Risk Alerts (List Format)
 # -------------------------------
-def detect_risks_alert(df: pd.DataFrame):
-    alerts = []
-    for _, row in df.iterrows():
-        issues = []
-        if pd.to_numeric(row.get("profit_margin", 0), errors="coerce") < 0:
-            issues.append("Negative profit")
-        if pd.to_numeric(row.get("yield_gap", 0), errors="coerce") > 10:
-            issues.append("High yield gap")
-        if pd.to_numeric(row.get("rt_rainfall", 0), errors="coerce") > 50:
-            issues.append("Heavy rainfall")
-        if issues:
-            alerts.append({
-                "plot_id": row["plot_id"],
-                "owner": row["owner"],
-                "location": row["farm_location"],
-                "issues": issues
-            })
-    return alerts
+@timed("alerts.detect_risks_alert")
+def detect_risks_alert(df: pd.DataFrame, risks: pd.DataFrame = None):
+    risks = evaluate_risks(df) if risks is None else risks
+    flagged, issue_lists = _issue_lists(risks)
+    hits = df.loc[flagged, ["plot_id", "owner", "farm_location"]]
+    return [
+        {"plot_id": plot_id, "owner": owner, "location": location, "issues": issues}
+        for (plot_id, owner, location), issues in zip(hits.itertuples(index=False, name=None), issue_lists)
+    ]
 
 # -------------------------------
 # Detect Risk Alerts (Map Format)
 # -------------------------------
-def detect_risks_map(df: pd.DataFrame):
-    alert_map = {}
-    for _, row in df.iterrows():
-        issues = []
-        if pd.to_numeric(row.get("profit_margin", 0), errors="coerce") < 0:
-            issues.append("Negative profit")
-        if pd.to_numeric(row.get("yield_gap", 0), errors="coerce") > 10:
-            issues.append("High yield gap")
-        if pd.to_numeric(row.get("rt_rainfall", 0), errors="coerce") > 50:
-            issues.append("Heavy rainfall")
-        if issues:
-            alert_map[row["plot_id"]] = issues
-    return alert_map
+@timed("alerts.detect_risks_map")
+def detect_risks_map(df: pd.DataFrame, risks: pd.DataFrame = None):
+    risks = evaluate_risks(df) if risks is None else risks
+    flagged, issue_lists = _issue_lists(risks)
+    return dict(zip(df.loc[flagged, "plot_id"].tolist(), issue_lists))
 
 # -------------------------------
 # Export Alert List to CSV
 # -------------------------------
+@timed("alerts.generate_alert_export")
 def generate_alert_export(df: pd.DataFrame, plot_alerts: dict):
     export_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    alert_df = pd.DataFrame([
-        {
-            "Plot ID": row["plot_id"],
-            "Owner": row["owner"],
-            "Location": row["farm_location"],
-            "Cycle ID": row["cycle_id"],
-            "Crop": row["crop_name"],
-            "Profit Margin (%)": row["profit_margin"],
-            "Alert Issues": ", ".join(issues),
-            "Exported At": export_time
-        }
-        for _, row in df.iterrows()
-        if row["plot_id"] in plot_alerts
-        for issues in [plot_alerts[row["plot_id"]]]
-    ])
-    return alert_df
\ No newline at end of file
+    issue_text = pd.Series({plot_id: ", ".join(issues) for plot_id, issues in plot_alerts.items()}, dtype=object)
+    hits = df[df["plot_id"].isin(issue_text.index)]
+    alert_df = pd.DataFrame({
+        "Plot ID": hits["plot_id"],
+        "Owner": hits["owner"],
+        "Location": hits["farm_location"],
+        "Cycle ID": hits["cycle_id"],
+        "Crop": hits["crop_name"],
+        "Profit Margin (%)": hits["profit_margin"],
+        "Alert Issues": hits["plot_id"].map(issue_text),
+        "Exported At": export_time
+    }).reset_index(drop=True)
+    return alert_df
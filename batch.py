@@ -0,0 +1,144 @@
+# batch.py
+
+import argparse
+import gzip
+import io
+import os
+import time
+import zipfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from data import stream_master_data, enrich_df_with_realtime_weather, MASTER_STREAM_CHUNK_ROWS
+from alerts import evaluate_risks, detect_risks_map, generate_alert_export
+from utils import clear_geometry_cache
+
+# -------------------------------
+# Incremental File Writers
+# -------------------------------
+def _stable_type(field: pa.Field):
+    # Per-chunk dtypes depend on the values in that chunk (category codes,
+    # float32 vs float64, int32 ids that turn float when a chunk has gaps),
+    # so the file schema is widened once from the first chunk.
+    kind = field.type
+    if pa.types.is_dictionary(kind):
+        kind = kind.value_type
+    if pa.types.is_null(kind) or pa.types.is_large_string(kind):
+        return pa.string()
+    if pa.types.is_floating(kind):
+        return pa.int64() if field.name in ("location_id", "cycle_id", "Cycle ID") else pa.float64()
+    if pa.types.is_integer(kind):
+        return pa.int64()
+    return kind
+
+class ChunkWriter:
+    """
+    Appends DataFrame chunks to a CSV (optionally .gz, or a .zip holding one
+    CSV) or Parquet file as they arrive. Parquet chunks become row groups
+    under the schema of the first chunk.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self.rows = 0
+        self._handle = None
+        self._archive = None
+        self._writer = None
+        self._schema = None
+
+    def _open_text(self):
+        if self.path.endswith(".zip"):
+            self._archive = zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED)
+            member = self._archive.open(os.path.basename(self.path)[:-len(".zip")] + ".csv", "w", force_zip64=True)
+            return io.TextIOWrapper(member, encoding="utf-8", newline="")
+        opener = gzip.open if self.path.endswith(".gz") else open
+        return opener(self.path, "wt", newline="", encoding="utf-8")
+
+    def write(self, frame):
+        if self.parquet:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._schema = pa.schema([pa.field(f.name, _stable_type(f)) for f in table.schema])
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            self._writer.write_table(table.cast(self._schema))
+        else:
+            if self._handle is None:
+                self._handle = self._open_text()
+                frame.to_csv(self._handle, index=False)
+            else:
+                frame.to_csv(self._handle, index=False, header=False)
+        self.rows += len(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._handle is not None:
+            self._handle.close()
+        if self._archive is not None:
+            self._archive.close()
+
+# -------------------------------
+# Batch Export
+# -------------------------------
+def run_batch(data_path: str = None, alerts_path: str = None, owners=None, seasons=None, locations=None,
+              only_alerts: bool = False, realtime_weather: bool = False,
+              chunk_rows: int = MASTER_STREAM_CHUNK_ROWS):
+    """
+    Streams the filtered master data and writes the farm dataset and/or the
+    alert export chunk by chunk, applying the same steps as the dashboard:
+    filters, optional real-time weather, risk detection, then the optional
+    alerts-only filter. Memory stays proportional to `chunk_rows`.
+    Returns row counts.
+    """
+    writers = {name: ChunkWriter(path) for name, path in (("data", data_path), ("alerts", alerts_path)) if path}
+    totals = {"chunks": 0, "rows": 0, "alert_plots": 0}
+    try:
+        for chunk in stream_master_data(owners, seasons, locations, chunk_rows):
+            if realtime_weather:
+                chunk = enrich_df_with_realtime_weather(chunk, fetch_missing=True)
+            # Chunks hold whole plots, so per-plot alerts are final here.
+            plot_alerts = detect_risks_map(chunk, evaluate_risks(chunk))
+            if only_alerts:
+                chunk = chunk[chunk["plot_id"].isin(plot_alerts.keys())]
+            if "data" in writers and not chunk.empty:
+                writers["data"].write(chunk)
+            if "alerts" in writers and plot_alerts:
+                writers["alerts"].write(generate_alert_export(chunk, plot_alerts))
+            # Each plot appears in one chunk only; don't keep its geometry.
+            clear_geometry_cache()
+            totals["chunks"] += 1
+            totals["rows"] += len(chunk)
+            totals["alert_plots"] += len(plot_alerts)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    totals.update({f"{name}_rows": writer.rows for name, writer in writers.items()})
+    return totals
+
+# -------------------------------
+# Command Line Entry Point
+# -------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export farm data and risk alerts without the dashboard")
+    parser.add_argument("--data-out", help="farm dataset output (.csv, .csv.gz, .zip or .parquet)")
+    parser.add_argument("--alerts-out", help="alert list output (.csv, .csv.gz, .zip or .parquet)")
+    parser.add_argument("--owner", action="append", default=[], help="repeat to select several owners")
+    parser.add_argument("--season", action="append", default=[], help="repeat to select several seasons")
+    parser.add_argument("--location", action="append", default=[], help="repeat to select several farm locations")
+    parser.add_argument("--only-alerts", action="store_true", help="keep only plots with alerts")
+    parser.add_argument("--realtime-weather", action="store_true",
+                        help="add real-time weather from the local store, fetching coordinates it "
+                             "has never seen within the API quota (needed for the heavy rainfall rule)")
+    parser.add_argument("--chunk-rows", type=int, default=MASTER_STREAM_CHUNK_ROWS)
+    args = parser.parse_args()
+    if not (args.data_out or args.alerts_out):
+        parser.error("nothing to do: pass --data-out and/or --alerts-out")
+
+    start = time.perf_counter()
+    totals = run_batch(args.data_out, args.alerts_out, args.owner, args.season, args.location,
+                       only_alerts=args.only_alerts, realtime_weather=args.realtime_weather,
+                       chunk_rows=args.chunk_rows)
+    print(f"Exported {totals['rows']} rows in {totals['chunks']} chunks "
+          f"({totals['alert_plots']} plots with alerts) in {time.perf_counter() - start:.1f}s")
+    for path in (args.data_out, args.alerts_out):
+        if path and os.path.exists(path):
+            print(f"  {path}: {os.path.getsize(path):,} bytes")
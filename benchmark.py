@@ -0,0 +1,564 @@
+# benchmark.py
+
+import argparse
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+import data
+import weather_store
+from data import fetch_weather_history, fetch_weather_history_batch
+from alerts import evaluate_risks, detect_risks_alert, detect_risks_map, generate_alert_export
+from map import render_farm_map
+from weather import build_weather_figure, render_weather_overlay
+from utils import prepare_geometry
+
+# -------------------------------
+# Timing Helper
+# -------------------------------
+def time_call(fn, *args, repeats: int = 3, **kwargs):
+    """
+    Runs fn `repeats` times and returns the best wall time in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# -------------------------------
+# Synthetic Master Frame
+# -------------------------------
+def synthetic_master_frame(n_rows: int, seed: int = 0, polygon_share: float = 0.3):
+    """
+    Builds a frame shaped like fetch_master_data() output, with plots scattered
+    over Ghana. A `polygon_share` of plots use JSON polygon geometry.
+    """
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(4.8, 11.0, n_rows)
+    lon = rng.uniform(-3.2, 1.1, n_rows)
+    is_polygon = rng.random(n_rows) < polygon_share
+    geometry = [
+        f"[[{la:.5f}, {lo:.5f}], [{la + 0.004:.5f}, {lo:.5f}], [{la + 0.004:.5f}, {lo + 0.004:.5f}], [{la:.5f}, {lo + 0.004:.5f}]]"
+        if poly else f"POINT ({lo:.5f} {la:.5f})"
+        for la, lo, poly in zip(lat, lon, is_polygon)
+    ]
+    revenue = rng.gamma(2.0, 50.0, n_rows)
+    expense = rng.gamma(2.0, 45.0, n_rows)
+    expected = rng.uniform(5, 40, n_rows)
+    actual = np.clip(expected + rng.normal(0, 8, n_rows), 0, None)
+    return pd.DataFrame({
+        "plot_id": [f"P{i:07d}" for i in range(n_rows)],
+        "farm_location": rng.choice(["Ashanti", "Volta", "Northern", "Central", "Eastern"], n_rows),
+        "owner": rng.choice([f"Owner {i}" for i in range(50)], n_rows),
+        "size_ha": rng.uniform(0.5, 20, n_rows).round(2),
+        "location_id": np.arange(n_rows),
+        "location_geometry": geometry,
+        "cycle_id": np.arange(n_rows),
+        "planting_date": pd.Timestamp("2024-03-01") + pd.to_timedelta(rng.integers(0, 60, n_rows), unit="D"),
+        "actual_harvest_date": pd.Timestamp("2024-08-01") + pd.to_timedelta(rng.integers(0, 60, n_rows), unit="D"),
+        "crop_name": rng.choice(["Maize", "Cassava", "Yam", "Cocoa", "Sweet Potato"], n_rows),
+        "season": rng.choice(["Major", "Minor"], n_rows),
+        "expected_yield": expected.round(2),
+        "actual_yield": actual.round(2),
+        "yield_gap": (actual - expected).round(2),
+        "total_input_cost": rng.gamma(2.0, 20.0, n_rows).round(2),
+        "total_revenue": revenue.round(2),
+        "total_expense": expense.round(2),
+        "profit": (revenue - expense).round(2),
+        "profit_margin": ((revenue - expense) * 100 / revenue).round(2),
+        "rt_temperature": rng.uniform(22, 35, n_rows).round(1),
+        "rt_humidity": rng.uniform(40, 95, n_rows).round(0),
+        "rt_rainfall": rng.exponential(8, n_rows).round(1),
+    })
+
+# -------------------------------
+# Weather History: Per-Plot vs Batch
+# -------------------------------
+def bench_weather_history(df: pd.DataFrame, plot_counts=(1, 5, 10, 30, 60), repeats: int = 3):
+    """
+    Compares one query per plot against fetch_weather_history_batch for a
+    growing number of selected plots. Returns one row per plot count.
+    """
+    windows = df.dropna(subset=["planting_date", "actual_harvest_date"]).drop_duplicates(subset="plot_id")
+    windows = windows[["plot_id", "planting_date", "actual_harvest_date"]]
+
+    def per_plot(sample):
+        for row in sample.itertuples(index=False):
+            fetch_weather_history(row.plot_id, row.planting_date, row.actual_harvest_date)
+
+    results = []
+    for n in plot_counts:
+        sample = windows.head(n)
+        results.append({
+            "plots": len(sample),
+            "per_plot_s": time_call(per_plot, sample, repeats=repeats),
+            "batch_s": time_call(fetch_weather_history_batch, sample, repeats=repeats)
+        })
+    result_df = pd.DataFrame(results)
+    result_df["speedup"] = result_df["per_plot_s"] / result_df["batch_s"]
+    return result_df
+
+# -------------------------------
+# Map Rendering: Per-Feature vs GeoJSON
+# -------------------------------
+def bench_map_render(row_counts=(100, 1000, 5000), metric: str = "Profit Margin"):
+    """
+    Renders the farm map to HTML in both modes on synthetic data and reports
+    wall time and payload size.
+    """
+    results = []
+    for n in row_counts:
+        df = prepare_geometry(synthetic_master_frame(n))
+        plot_alerts = detect_risks_map(df)
+        for mode in ("features", "geojson"):
+            start = time.perf_counter()
+            html = render_farm_map(df, plot_alerts, metric, mode=mode).get_root().render()
+            results.append({
+                "rows": n,
+                "mode": mode,
+                "seconds": time.perf_counter() - start,
+                "html_mb": len(html.encode("utf-8")) / 1e6
+            })
+    return pd.DataFrame(results)
+
+# -------------------------------
+# Weather Chart: Full SVG vs Downsampled WebGL
+# -------------------------------
+def synthetic_weather_frame(n_plots: int, years: int = 10, seed: int = 0):
+    """
+    Daily weather for `n_plots` plots over `years` years, in the long format
+    that build_weather_figure expects.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2015-01-01", periods=365 * years, freq="D")
+    day = np.arange(len(dates))
+    frames = []
+    for i in range(n_plots):
+        season = np.sin(2 * np.pi * day / 365.25 + rng.uniform(0, 2 * np.pi))
+        frames.append(pd.DataFrame({
+            "record_date": dates,
+            "temperature_c": 27 + 4 * season + rng.normal(0, 1.2, len(dates)),
+            "rainfall_mm": rng.exponential(4, len(dates)) * (season > 0),
+            "humidity": 70 + 15 * season + rng.normal(0, 5, len(dates)),
+            "Plot ID": f"P{i:04d}",
+            "Owner": f"Owner {i % 5}",
+            "Crop": "Maize",
+            "Yield (tons)": rng.uniform(5, 40),
+            "Profit Margin (%)": rng.uniform(-20, 60),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+def bench_weather_chart(plot_counts=(5, 20, 50), years: int = 10, point_budget: int = 400):
+    """
+    Times figure construction and serialization for the full SVG overlay and
+    the downsampled WebGL overlay, reporting points plotted and JSON size.
+    """
+    results = []
+    for n in plot_counts:
+        frame = synthetic_weather_frame(n, years)
+        for label, budget, webgl in (("full_svg", None, False), ("lttb_webgl", point_budget, True)):
+            start = time.perf_counter()
+            fig = build_weather_figure(frame, point_budget=budget, webgl=webgl)
+            payload = fig.to_json()
+            results.append({
+                "plots": n,
+                "mode": label,
+                "seconds": time.perf_counter() - start,
+                "points": sum(len(trace.x) for trace in fig.data if trace.x is not None),
+                "json_mb": len(payload) / 1e6
+            })
+    return pd.DataFrame(results)
+
+# -------------------------------
+# Synthetic Farm Database
+# -------------------------------
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+SCHEMA_SQL = """
+CREATE TABLE FarmPlot (plot_id TEXT PRIMARY KEY, farm_location TEXT, owner TEXT, size_ha REAL);
+CREATE TABLE Bearings (location_id INTEGER PRIMARY KEY, plot_id TEXT, location_geometry TEXT);
+CREATE TABLE CropCycle (cycle_id INTEGER PRIMARY KEY, plot_id TEXT, planting_date TEXT,
+                        actual_harvest_date TEXT, season TEXT);
+CREATE TABLE Crop (crop_id INTEGER PRIMARY KEY, cycle_id INTEGER, crop_name TEXT);
+CREATE TABLE YieldRecord (yield_id INTEGER PRIMARY KEY, cycle_id INTEGER, expected_yield REAL, actual_yield REAL);
+CREATE TABLE InputRecord (input_id INTEGER PRIMARY KEY, cycle_id INTEGER, input_type TEXT,
+                          quantity_used REAL, cost REAL);
+CREATE TABLE FinanceRecord (finance_id INTEGER PRIMARY KEY, cycle_id INTEGER, transaction_type TEXT, amount_10k REAL);
+CREATE TABLE WeatherRecord (weather_id INTEGER PRIMARY KEY, plot_id TEXT, record_date TEXT,
+                            rainfall_mm REAL, temperature_c REAL, humidity REAL);
+CREATE INDEX idx_bearings_plot ON Bearings (plot_id);
+CREATE INDEX idx_cycle_plot ON CropCycle (plot_id);
+CREATE INDEX idx_crop_cycle ON Crop (cycle_id);
+CREATE INDEX idx_yield_cycle ON YieldRecord (cycle_id);
+CREATE INDEX idx_input_cycle ON InputRecord (cycle_id);
+CREATE INDEX idx_finance_cycle ON FinanceRecord (cycle_id);
+CREATE INDEX idx_weather_plot_date ON WeatherRecord (plot_id, record_date);
+"""
+
+def _insert(conn, table: str, frame: pd.DataFrame):
+    placeholders = ", ".join(["?"] * len(frame.columns))
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(frame.columns)}) VALUES ({placeholders})",
+        frame.itertuples(index=False, name=None)
+    )
+
+def generate_synthetic_database(path: str, n_plots: int, seed: int = 0, cycles_per_plot: int = 2,
+                                inputs_per_cycle: int = 4, weather_step_days: int = 14,
+                                polygon_share: float = 0.3, chunk_plots: int = 50_000):
+    """
+    Writes a SQLite database with the FarmPlot, Bearings, CropCycle, Crop,
+    YieldRecord, InputRecord, FinanceRecord and WeatherRecord tables used by
+    fetch_master_data. Plots are generated `chunk_plots` at a time so memory
+    stays bounded at the 1M scale. Returns the row count per table.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;")
+    conn.executescript(SCHEMA_SQL)
+
+    owners = np.array([f"Owner {i}" for i in range(max(50, n_plots // 20))])
+    locations = np.array(["Ashanti", "Volta", "Northern", "Central", "Eastern", "Western", "Bono", "Oti"])
+    crops = np.array(["Maize", "Cassava", "Yam", "Cocoa", "Sweet Potato", "Rice"])
+    input_types = np.array(["Vines", "Fertilizer", "Pesticide", "Traction", "Irrigation", "Other"])
+    weather_days = pd.date_range("2022-01-01", "2025-06-30", freq=f"{weather_step_days}D")
+    counts = dict.fromkeys(["FarmPlot", "Bearings", "CropCycle", "Crop", "YieldRecord",
+                            "InputRecord", "FinanceRecord", "WeatherRecord"], 0)
+
+    for first in range(0, n_plots, chunk_plots):
+        n = min(chunk_plots, n_plots - first)
+        plot_ids = np.array([f"P{i:07d}" for i in range(first, first + n)])
+        lat = rng.uniform(4.8, 11.0, n)
+        lon = rng.uniform(-3.2, 1.1, n)
+        is_polygon = rng.random(n) < polygon_share
+        geometry = [
+            f"[[{la:.5f}, {lo:.5f}], [{la + 0.004:.5f}, {lo:.5f}], [{la + 0.004:.5f}, {lo + 0.004:.5f}]]"
+            if poly else f"POINT ({lo:.5f} {la:.5f})"
+            for la, lo, poly in zip(lat, lon, is_polygon)
+        ]
+        _insert(conn, "FarmPlot", pd.DataFrame({
+            "plot_id": plot_ids,
+            "farm_location": rng.choice(locations, n),
+            "owner": rng.choice(owners, n),
+            "size_ha": rng.uniform(0.5, 20, n).round(2),
+        }))
+        _insert(conn, "Bearings", pd.DataFrame({
+            "location_id": np.arange(first, first + n) + 1,
+            "plot_id": plot_ids,
+            "location_geometry": geometry,
+        }))
+
+        n_cycles = n * cycles_per_plot
+        cycle_ids = np.arange(first * cycles_per_plot, first * cycles_per_plot + n_cycles) + 1
+        planting = pd.Timestamp("2022-02-01") + pd.to_timedelta(rng.integers(0, 900, n_cycles), unit="D")
+        harvest = planting + pd.to_timedelta(rng.integers(90, 180, n_cycles), unit="D")
+        _insert(conn, "CropCycle", pd.DataFrame({
+            "cycle_id": cycle_ids,
+            "plot_id": np.repeat(plot_ids, cycles_per_plot),
+            "planting_date": planting.strftime("%Y-%m-%d"),
+            "actual_harvest_date": harvest.strftime("%Y-%m-%d"),
+            "season": rng.choice(["Major", "Minor"], n_cycles),
+        }))
+        _insert(conn, "Crop", pd.DataFrame({
+            "crop_id": cycle_ids, "cycle_id": cycle_ids, "crop_name": rng.choice(crops, n_cycles),
+        }))
+        expected = rng.uniform(5, 40, n_cycles)
+        _insert(conn, "YieldRecord", pd.DataFrame({
+            "yield_id": cycle_ids,
+            "cycle_id": cycle_ids,
+            "expected_yield": expected.round(2),
+            "actual_yield": np.clip(expected + rng.normal(0, 8, n_cycles), 0, None).round(2),
+        }))
+        n_inputs = n_cycles * inputs_per_cycle
+        _insert(conn, "InputRecord", pd.DataFrame({
+            "input_id": np.arange(counts["InputRecord"], counts["InputRecord"] + n_inputs) + 1,
+            "cycle_id": np.repeat(cycle_ids, inputs_per_cycle),
+            "input_type": rng.choice(input_types, n_inputs),
+            "quantity_used": rng.uniform(1, 50, n_inputs).round(2),
+            "cost": rng.gamma(2.0, 10.0, n_inputs).round(2),
+        }))
+        # One revenue and two expense entries per cycle.
+        n_finance = n_cycles * 3
+        _insert(conn, "FinanceRecord", pd.DataFrame({
+            "finance_id": np.arange(counts["FinanceRecord"], counts["FinanceRecord"] + n_finance) + 1,
+            "cycle_id": np.repeat(cycle_ids, 3),
+            "transaction_type": np.tile(["Revenue", "Expense", "Expense"], n_cycles),
+            "amount_10k": rng.gamma(2.0, 30.0, n_finance).round(2),
+        }))
+        n_weather = n * len(weather_days)
+        season = np.sin(2 * np.pi * weather_days.dayofyear.to_numpy() / 365.25)
+        _insert(conn, "WeatherRecord", pd.DataFrame({
+            "weather_id": np.arange(counts["WeatherRecord"], counts["WeatherRecord"] + n_weather) + 1,
+            "plot_id": np.repeat(plot_ids, len(weather_days)),
+            "record_date": np.tile(weather_days.strftime("%Y-%m-%d"), n),
+            "rainfall_mm": (rng.exponential(6, n_weather) * (np.tile(season, n) > 0)).round(1),
+            "temperature_c": (27 + 4 * np.tile(season, n) + rng.normal(0, 1.5, n_weather)).round(1),
+            "humidity": (70 + 15 * np.tile(season, n) + rng.normal(0, 5, n_weather)).round(0),
+        }))
+        conn.commit()
+        for table, added in [("FarmPlot", n), ("Bearings", n), ("CropCycle", n_cycles), ("Crop", n_cycles),
+                             ("YieldRecord", n_cycles), ("InputRecord", n_inputs),
+                             ("FinanceRecord", n_finance), ("WeatherRecord", n_weather)]:
+            counts[table] += added
+    conn.execute("ANALYZE")
+    conn.close()
+    return counts
+
+# -------------------------------
+# Stub Weather API
+# -------------------------------
+class _StubWeatherHandler(BaseHTTPRequestHandler):
+    calls = 0
+    status = 200
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        lat = float(query.get("lat", [0])[0])
+        lon = float(query.get("lon", [0])[0])
+        type(self).calls += 1
+        if self.status != 200:
+            self.send_response(self.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({
+            "main": {"temp": round(24 + (lat * 7 + lon * 3) % 10, 1), "humidity": int(55 + (lat * 13) % 40)},
+            "rain": {"1h": round((lon * 17) % 60, 1)},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_weather_server(delay_s: float = 0.0):
+    """
+    Serves OpenWeather-shaped responses on a local port in a daemon thread.
+    Returns (server, url); server.RequestHandlerClass.calls counts requests
+    and setting its `status` (e.g. 429) makes every request fail.
+    """
+    handler = type("StubWeatherHandler", (_StubWeatherHandler,), {"calls": 0})
+    if delay_s:
+        base_get = handler.do_GET
+        handler.do_GET = lambda self: (time.sleep(delay_s), base_get(self))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/data/2.5/weather"
+
+# -------------------------------
+# End-to-End Pipeline Benchmark
+# -------------------------------
+def _measure(stage: str, rows_fn, fn, *args, **kwargs):
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    rows = rows_fn(result)
+    return result, {
+        "stage": stage,
+        "seconds": seconds,
+        "rows": rows,
+        "rows_per_s": rows / seconds if seconds > 0 else float("inf"),
+        "peak_mb": peak / 1e6,
+    }
+
+def run_pipeline_benchmark(db_path: str, weather_url: str, map_rows: int = 20_000, chart_plots: int = 30):
+    """
+    Runs each dashboard stage once against the SQLite database at db_path and
+    the weather API at weather_url. Returns one row per stage with wall time,
+    rows processed, throughput and peak traced memory.
+    """
+    data.DB_BACKEND, data.DB_SQLITE_PATH = "sqlite", db_path
+    data.WEATHER_API_KEY, data.WEATHER_API_URL = data.WEATHER_API_KEY or "benchmark", weather_url
+    # A fresh weather store next to the database; the stub API has no quota.
+    weather_store.WEATHER_STORE_PATH = f"{os.path.splitext(db_path)[0]}_weather.sqlite"
+    weather_store.WEATHER_QUOTA_PER_MIN = 1_000_000
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(weather_store.WEATHER_STORE_PATH + suffix):
+            os.remove(weather_store.WEATHER_STORE_PATH + suffix)
+
+    stages = []
+    tracemalloc.start()
+    try:
+        # Builds WeatherRollup on a fresh database; a no-op with --reuse-db.
+        _, row = _measure("weather_rollup", lambda folded: folded, data.update_weather_rollup)
+        stages.append(row)
+        df, row = _measure("query", len, data.fetch_master_data)
+        stages.append(row)
+        # Fills the empty store from the API, then the dashboard's local join.
+        df, row = _measure("weather_refresh", len, data.enrich_df_with_realtime_weather, df, fetch_missing=True)
+        stages.append(row)
+        df, row = _measure("enrichment", len, data.enrich_df_with_realtime_weather, df, fetch_missing=True)
+        stages.append(row)
+
+        def detect(frame):
+            risks = evaluate_risks(frame)
+            return detect_risks_alert(frame, risks), detect_risks_map(frame, risks)
+        (risk_alerts, plot_alerts), row = _measure("risk_detection", lambda _: len(df), detect, df)
+        stages.append(row)
+
+        map_df = df.head(map_rows)
+        _, row = _measure("map_build", lambda _: len(map_df),
+                          lambda: render_farm_map(map_df, plot_alerts, "Profit Margin").get_root().render())
+        stages.append(row)
+
+        chart_plots_ids = df["plot_id"].drop_duplicates().head(chart_plots).tolist()
+        _, row = _measure("chart_build", lambda fig: 0 if fig is None else sum(len(t.x) for t in fig.data),
+                          render_weather_overlay, df, chart_plots_ids)
+        stages.append(row)
+
+        def export():
+            buffer = io.StringIO()
+            df.to_csv(buffer, index=False)
+            generate_alert_export(df, plot_alerts).to_csv(io.StringIO(), index=False)
+            return buffer.tell()
+        _, row = _measure("csv_export", lambda _: len(df), export)
+        stages.append(row)
+    finally:
+        tracemalloc.stop()
+    return pd.DataFrame(stages)
+
+# -------------------------------
+# Concurrent Session Load Test
+# -------------------------------
+def run_load_test(db_path: str, weather_url: str, sessions: int = 12):
+    """
+    Opens `sessions` dashboard sessions at the same moment in one cold
+    process (empty loader cache, no snapshot) and waits for each first
+    render. Returns the DB queries issued, weather API loads and the p50/p95/
+    max time to first render.
+    """
+    from streamlit.testing.v1 import AppTest
+    import cache
+    import snapshot
+
+    data.DB_BACKEND, data.DB_SQLITE_PATH = "sqlite", db_path
+    data.WEATHER_API_KEY, data.WEATHER_API_URL = data.WEATHER_API_KEY or "benchmark", weather_url
+    weather_store.WEATHER_STORE_PATH = f"{os.path.splitext(db_path)[0]}_weather.sqlite"
+    snapshot.SNAPSHOT_DIR = tempfile.mkdtemp(prefix="load_test_snapshot_")
+    cache.clear_cache()
+    data.reset_query_stats()
+
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    start_together = threading.Barrier(sessions)
+    seconds, errors = [None] * sessions, []
+
+    def open_session(i):
+        app = AppTest.from_file(main_path, default_timeout=600)
+        start_together.wait()
+        start = time.perf_counter()
+        app.run()
+        seconds[i] = time.perf_counter() - start
+        if app.exception:
+            errors.append(app.exception)
+
+    threads = [threading.Thread(target=open_session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    query_stats = data.get_query_stats()
+    cache_stats = cache.get_cache_stats()
+    return {
+        "sessions": sessions,
+        "errors": len(errors),
+        "db_queries": sum(stats["calls"] for stats in query_stats.values()),
+        "master_queries": sum(stats["calls"] for name, stats in query_stats.items() if name.startswith("master_data")),
+        "enriched_loads": cache_stats.get("enriched_data", {}).get("misses", 0),
+        "p50_s": float(np.percentile(seconds, 50)),
+        "p95_s": float(np.percentile(seconds, 95)),
+        "max_s": float(max(seconds)),
+    }
+
+def compare_to_baseline(results: pd.DataFrame, baseline: dict, tolerance: float = 0.2):
+    """
+    Adds baseline_s, change and regression columns. A stage regresses when it
+    is more than `tolerance` slower than its saved baseline time.
+    """
+    out = results.copy()
+    out["baseline_s"] = out["stage"].map(baseline)
+    out["change"] = out["seconds"] / out["baseline_s"] - 1
+    out["regression"] = out["change"] > tolerance
+    return out
+
+# -------------------------------
+# Command Line Entry Point
+# -------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Farm dashboard benchmarks")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="1k",
+                        help="number of synthetic plots for the pipeline benchmark")
+    parser.add_argument("--db", default=None, help="SQLite path for the synthetic database")
+    parser.add_argument("--reuse-db", action="store_true", help="skip generation if --db already exists")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--weather-step-days", type=int, default=14)
+    parser.add_argument("--map-rows", type=int, default=20_000, help="rows drawn in the map_build stage")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--micro", action="store_true", help="also run the map and chart micro-benchmarks")
+    parser.add_argument("--load-test", type=int, default=0, metavar="N",
+                        help="also open N dashboard sessions at once and report DB queries and p95 first render")
+    parser.add_argument("--live-db", action="store_true",
+                        help="also compare per-plot and batched weather history on the configured database")
+    args = parser.parse_args()
+
+    db_path = args.db or f"benchmark_{args.scale}.sqlite"
+    if not (args.reuse_db and os.path.exists(db_path)):
+        start = time.perf_counter()
+        counts = generate_synthetic_database(db_path, SCALES[args.scale], seed=args.seed,
+                                             weather_step_days=args.weather_step_days)
+        print(f"Generated {db_path} in {time.perf_counter() - start:.1f}s: {counts}")
+
+    server, url = start_stub_weather_server()
+    results = run_pipeline_benchmark(db_path, url, map_rows=args.map_rows)
+    print(f"Weather API calls: {server.RequestHandlerClass.calls}")
+    if args.load_test:
+        load = run_load_test(db_path, url, sessions=args.load_test)
+        print("Concurrent sessions: " + ", ".join(
+            f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in load.items()))
+    server.shutdown()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.scale in baselines:
+        results = compare_to_baseline(results, baselines[args.scale], args.tolerance)
+    print(results.to_string(index=False))
+    if "regression" in results and results["regression"].any():
+        print("Regressions: " + ", ".join(results.loc[results["regression"], "stage"]))
+
+    if args.save_baseline:
+        baselines[args.scale] = dict(zip(results["stage"], results["seconds"]))
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2)
+        print(f"Saved baseline for {args.scale} to {args.baseline}")
+
+    if args.micro:
+        print("Weather chart build time and size (10-year daily series)")
+        print(bench_weather_chart().to_string(index=False))
+        print("Map render time and size by mode")
+        print(bench_map_render().to_string(index=False))
+
+    if args.live_db:
+        data.DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+        master_df = data.fetch_master_data()
+        print("Weather history latency vs selected plots")
+        print(bench_weather_history(master_df).to_string(index=False))
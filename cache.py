@@ -0,0 +1,102 @@
+# cache.py
+
+import functools
+import os
+import threading
+import time
+
+DATA_CACHE_TTL = int(os.getenv("DATA_CACHE_TTL", "3600"))
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", "600"))
+WATERMARK_TTL = int(os.getenv("WATERMARK_TTL", "30"))
+
+# -------------------------------
+# Process-Wide Loader Cache
+# -------------------------------
+# Entries live at module level, so they survive Streamlit reruns and are
+# shared by every session served from this process. Each cached loader keeps
+# only its most recent result: a new key (e.g. a new DB watermark) replaces it.
+# Loads are single-flight: sessions that miss while the same load is already
+# running wait for it instead of starting their own.
+_entries = {}
+_inflight = {}
+_stats = {}
+_lock = threading.Lock()
+
+def cached(name: str, ttl: float):
+    """
+    Caches a loader's result under `name` for `ttl` seconds, keyed by its
+    positional arguments. Concurrent calls with the same arguments share one
+    load (and its exception, if it fails). Cached values are shared between
+    sessions without copying and must be treated as read-only by callers.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            now = time.monotonic()
+            with _lock:
+                entry = _entries.get(name)
+                stats = _stats.setdefault(name, {"hits": 0, "misses": 0, "joined": 0, "saved_s": 0.0,
+                                                 "last_load_s": 0.0})
+                if entry is not None and entry["key"] == args and entry["expires"] > now:
+                    stats["hits"] += 1
+                    stats["saved_s"] += entry["load_s"]
+                    return entry["value"]
+                flight = _inflight.get(name)
+                leader = flight is None or flight["key"] != args
+                if leader:
+                    flight = {"key": args, "done": threading.Event(), "value": None, "error": None}
+                    _inflight[name] = flight
+
+            if not leader:
+                flight["done"].wait()
+                with _lock:
+                    stats["joined"] += 1
+                if flight["error"] is not None:
+                    raise flight["error"]
+                return flight["value"]
+
+            start = time.perf_counter()
+            try:
+                flight["value"] = fn(*args)
+            except BaseException as e:
+                # Nothing is cached. Waiting sessions get the same exception,
+                # or a RuntimeError for an interrupt (KeyboardInterrupt,
+                # SystemExit), which belongs to this thread only.
+                if isinstance(e, Exception):
+                    flight["error"] = e
+                else:
+                    flight["error"] = RuntimeError(f"Load of {name} was interrupted ({type(e).__name__})")
+                    flight["error"].__cause__ = e
+                raise
+            else:
+                load_s = time.perf_counter() - start
+                with _lock:
+                    _entries[name] = {"key": args, "value": flight["value"],
+                                      "expires": time.monotonic() + ttl, "load_s": load_s}
+                    stats["misses"] += 1
+                    stats["last_load_s"] = load_s
+            finally:
+                with _lock:
+                    if _inflight.get(name) is flight:
+                        del _inflight[name]
+                flight["done"].set()
+            return flight["value"]
+        return wrapper
+    return decorator
+
+def get_cache_stats():
+    """Returns hits, misses, joined (calls served by another call's load), seconds saved and last load time."""
+    with _lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
+
+def has_entry(name: str):
+    """True once the loader has produced a value in this process, even if it has since expired."""
+    with _lock:
+        return name in _entries
+
+def clear_cache(name: str = None):
+    with _lock:
+        if name is None:
+            _entries.clear()
+        else:
+            _entries.pop(name, None)
@@ -1,11 +1,18 @@
 # data.py
 
 import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
-import mysql.connector
 import requests
+from mysql.connector import pooling
 from dotenv import load_dotenv
-from shapely import wkt
+from utils import prepare_geometry
+from profiling import timed
+from weather_store import register_coordinates, read_current_weather, refresh_due, start_weather_refresher
 
 # Load environment variables
 load_dotenv()
@@ -13,126 +20,1008 @@ DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
 DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "Khemikal1234")
 DB_NAME = os.getenv("DB_NAME", "farm_management_database")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# "sqlite" runs every query against a local SQLite file with the same schema,
+# e.g. a test fixture or the benchmark database.
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+DB_SQLITE_PATH = os.getenv("DB_SQLITE_PATH", "farm_management.sqlite")
+MASTER_FULL_RELOAD_S = int(os.getenv("MASTER_FULL_RELOAD_S", "21600"))
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "http://api.openweathermap.org/data/2.5/weather")
+WEATHER_GRID_DECIMALS = int(os.getenv("WEATHER_GRID_DECIMALS", "2"))
+WEATHER_HISTORY_BATCH_SIZE = int(os.getenv("WEATHER_HISTORY_BATCH_SIZE", "200"))
+WEATHER_ROLLUP_BATCH_ROWS = int(os.getenv("WEATHER_ROLLUP_BATCH_ROWS", "200000"))
+# How often the background maintainer folds new weather rows into the
+# rollup; 0 disables it (run update_weather_rollup() from a scheduled job).
+WEATHER_ROLLUP_INTERVAL_S = int(os.getenv("WEATHER_ROLLUP_INTERVAL_S", "60"))
+# How long an update waits for another process's rollup update to finish.
+WEATHER_ROLLUP_LOCK_TIMEOUT_S = int(os.getenv("WEATHER_ROLLUP_LOCK_TIMEOUT_S", "600"))
 
 # -------------------------------
-# MySQL Connection
+# MySQL Connection Pool
 # -------------------------------
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+
+_query_stats = {}
+_stats_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="farm_dashboard",
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    host=DB_HOST,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    database=DB_NAME
+                )
+    return _pool
+
 def get_connection():
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME
+    """
+    Borrows a connection from the shared pool. Calling close() on it hands it
+    back to the pool instead of tearing it down. With DB_BACKEND=sqlite a new
+    connection to DB_SQLITE_PATH is opened instead.
+    """
+    if DB_BACKEND == "sqlite":
+        return sqlite3.connect(DB_SQLITE_PATH)
+    return _get_pool().get_connection()
+
+def _sql_value(value):
+    # Drivers only accept builtin types; numpy scalars and pandas timestamps
+    # come out of typed frames, so convert them on the way in.
+    if isinstance(value, pd.Timestamp):
+        return value.date() if value == value.normalize() else value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def run_query(name: str, query: str, params=None, session_statements=()):
+    """
+    Executes a parameterized query (%s placeholders) as a prepared statement on
+    a pooled connection and returns the result as a DataFrame. Blocks for up to
+    DB_POOL_TIMEOUT seconds when every pooled connection is in use.
+    `session_statements` are run first on the same connection (MySQL only).
+    """
+    params = tuple(_sql_value(value) for value in (params or ()))
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise TimeoutError(f"No database connection available after {DB_POOL_TIMEOUT}s")
+    start = time.perf_counter()
+    try:
+        conn = get_connection()
+        try:
+            if DB_BACKEND == "sqlite":
+                cursor = conn.cursor()
+                cursor.execute(query.replace("%s", "?"), params)
+            else:
+                cursor = conn.cursor(prepared=True)
+                for statement in session_statements:
+                    cursor.execute(statement)
+                cursor.execute(query, params)
+            columns = [col[0] for col in cursor.description]
+            df = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+            cursor.close()
+        finally:
+            conn.close()
+    finally:
+        _pool_slots.release()
+    _record_query(name, time.perf_counter() - start, len(df))
+    return df
+
+def stream_query(name: str, query: str, params=None, chunk_rows: int = 50_000):
+    """
+    Like run_query(), but yields the result as DataFrames of up to
+    `chunk_rows` rows while the cursor is read, so only one chunk is held in
+    memory. The connection stays checked out until the generator finishes.
+    """
+    params = tuple(_sql_value(value) for value in (params or ()))
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise TimeoutError(f"No database connection available after {DB_POOL_TIMEOUT}s")
+    start = time.perf_counter()
+    rows = 0
+    try:
+        conn = get_connection()
+        try:
+            if DB_BACKEND == "sqlite":
+                cursor = conn.cursor()
+                cursor.execute(query.replace("%s", "?"), params)
+            else:
+                cursor = conn.cursor(prepared=True)
+                cursor.execute(query, params)
+            columns = [col[0] for col in cursor.description]
+            while True:
+                records = cursor.fetchmany(chunk_rows)
+                if not records:
+                    break
+                rows += len(records)
+                yield pd.DataFrame.from_records(records, columns=columns)
+            cursor.close()
+        finally:
+            conn.close()
+    finally:
+        _pool_slots.release()
+        _record_query(name, time.perf_counter() - start, rows)
+
+def _record_query(name: str, elapsed: float, rows: int):
+    with _stats_lock:
+        stats = _query_stats.setdefault(name, {"calls": 0, "rows": 0, "total_s": 0.0, "max_s": 0.0})
+        stats["calls"] += 1
+        stats["rows"] += rows
+        stats["total_s"] += elapsed
+        stats["max_s"] = max(stats["max_s"], elapsed)
+
+def get_query_stats():
+    """Returns per-query counters: calls, rows, total_s, max_s and avg_s."""
+    with _stats_lock:
+        return {
+            name: dict(stats, avg_s=stats["total_s"] / stats["calls"])
+            for name, stats in _query_stats.items()
+        }
+
+def reset_query_stats():
+    with _stats_lock:
+        _query_stats.clear()
+
+# -------------------------------
+# Weather Rollups
+# -------------------------------
+# Per-plot sums and counts of the daily WeatherRecord rows by day, week
+# (starting Monday) and calendar month. Sums and counts add up, so the mean
+# over any window is combined from the cells covering it. The table is
+# brought up to date by folding in rows above a weather_id high-water mark.
+# Page loads never maintain it: they read whatever rollup is current while
+# a background maintainer (or a scheduled job) folds new rows and rebuilds.
+WEATHER_ROLLUP_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        plot_id VARCHAR(64) NOT NULL,
+        grain VARCHAR(8) NOT NULL,
+        period_start DATE NOT NULL,
+        rainfall_sum DOUBLE NOT NULL DEFAULT 0,
+        rainfall_count INT NOT NULL DEFAULT 0,
+        temperature_sum DOUBLE NOT NULL DEFAULT 0,
+        temperature_count INT NOT NULL DEFAULT 0,
+        humidity_sum DOUBLE NOT NULL DEFAULT 0,
+        humidity_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (plot_id, grain, period_start)
+    )
+"""
+WEATHER_ROLLUP_DDL = [
+    WEATHER_ROLLUP_TABLE_DDL.format(table="WeatherRollup"),
+    """
+    CREATE TABLE IF NOT EXISTS WeatherRollupState (
+        source VARCHAR(32) NOT NULL PRIMARY KEY,
+        last_weather_id BIGINT NOT NULL,
+        row_count BIGINT NOT NULL
     )
+    """,
+]
+WEATHER_ROLLUP_GRAINS = ["day", "week", "month"]
+WEATHER_ROLLUP_MEASURES = {"rainfall": "rainfall_mm", "temperature": "temperature_c", "humidity": "humidity"}
+_ROLLUP_COLUMNS = ["plot_id", "grain", "period_start"] + [
+    f"{name}_{part}" for name in WEATHER_ROLLUP_MEASURES for part in ("sum", "count")
+]
+_rollup_lock = threading.Lock()
+_rollup_ready = set()
+
+def _weather_rollup_upsert(table: str = "WeatherRollup"):
+    # Adds to an existing cell instead of replacing it.
+    columns = ", ".join(_ROLLUP_COLUMNS)
+    placeholders = ", ".join(["%s"] * len(_ROLLUP_COLUMNS))
+    measures = _ROLLUP_COLUMNS[3:]
+    if DB_BACKEND == "sqlite":
+        updates = ", ".join(f"{col} = {col} + excluded.{col}" for col in measures)
+        return (f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT (plot_id, grain, period_start) DO UPDATE SET {updates}")
+    updates = ", ".join(f"{col} = {col} + VALUES({col})" for col in measures)
+    return f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {updates}"
+
+def aggregate_weather_rows(records: pd.DataFrame):
+    """
+    Turns raw WeatherRecord rows (plot_id, record_date, rainfall_mm,
+    temperature_c, humidity) into rollup cells, one row per plot, grain and
+    period_start with a sum and a non-null count per measure.
+    """
+    dates = pd.to_datetime(records["record_date"]).dt.normalize()
+    starts = {
+        "day": dates,
+        "week": dates - pd.to_timedelta(dates.dt.weekday, unit="D"),
+        "month": dates.dt.to_period("M").dt.start_time,
+    }
+    aggregations = {}
+    for name, column in WEATHER_ROLLUP_MEASURES.items():
+        aggregations[f"{name}_sum"] = (column, "sum")
+        aggregations[f"{name}_count"] = (column, "count")
+    values = records[["plot_id"]].assign(**{
+        column: pd.to_numeric(records[column], errors="coerce") for column in WEATHER_ROLLUP_MEASURES.values()
+    })
+    cells = [
+        values.assign(period_start=start).groupby(["plot_id", "period_start"], sort=False).agg(**aggregations)
+        .reset_index().assign(grain=grain)
+        for grain, start in starts.items()
+    ]
+    return pd.concat(cells, ignore_index=True)[_ROLLUP_COLUMNS]
+
+def _rollup_target():
+    return DB_SQLITE_PATH if DB_BACKEND == "sqlite" else (DB_HOST, DB_NAME)
+
+def ensure_weather_rollup():
+    """Creates the rollup tables once per process and database; cheap enough to call on every load."""
+    target = _rollup_target()
+    if target not in _rollup_ready:
+        sqlite = DB_BACKEND == "sqlite"
+        if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise TimeoutError(f"No database connection available after {DB_POOL_TIMEOUT}s")
+        try:
+            conn = get_connection()
+            try:
+                cursor = conn.cursor()
+                for statement in WEATHER_ROLLUP_DDL:
+                    cursor.execute(statement)
+                cursor.execute(("INSERT OR IGNORE" if sqlite else "INSERT IGNORE") +
+                               " INTO WeatherRollupState VALUES ('WeatherRecord', -1, 0)")
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        finally:
+            _pool_slots.release()
+        _rollup_ready.add(target)
+
+@contextmanager
+def _weather_rollup_db_lock(cursor, execute):
+    # Serializes rollup updates across processes (dashboard replicas,
+    # batch.py), not just threads. MySQL has named locks, which survive the
+    # batch commits and RENAME TABLE; SQLite has none, so an exclusive
+    # transaction on a lock file next to the database stands in for one
+    # without blocking the farm database itself.
+    if DB_BACKEND == "sqlite":
+        lock = sqlite3.connect(DB_SQLITE_PATH + "-rollup-lock", timeout=WEATHER_ROLLUP_LOCK_TIMEOUT_S,
+                               isolation_level=None)
+        try:
+            lock.execute("BEGIN EXCLUSIVE")
+            yield
+        finally:
+            lock.close()
+        return
+    name = f"{DB_NAME}.weather_rollup"
+    execute(cursor, "SELECT GET_LOCK(%s, %s)", (name, WEATHER_ROLLUP_LOCK_TIMEOUT_S))
+    if cursor.fetchone()[0] != 1:
+        raise TimeoutError(f"Weather rollup lock not acquired after {WEATHER_ROLLUP_LOCK_TIMEOUT_S}s")
+    try:
+        yield
+    finally:
+        execute(cursor, "SELECT RELEASE_LOCK(%s)", (name,))
+        cursor.fetchone()
+
+def _fold_batch(cursor, execute, table: str, last_id, batch_rows: int):
+    # Folds up to batch_rows weather rows above last_id into `table`.
+    # Returns (rows folded, new last_id); the caller commits.
+    execute(cursor, """
+        SELECT weather_id, plot_id, record_date, rainfall_mm, temperature_c, humidity
+        FROM WeatherRecord WHERE weather_id > %s ORDER BY weather_id LIMIT %s
+    """, (last_id, batch_rows))
+    records = pd.DataFrame.from_records(cursor.fetchall(), columns=[c[0] for c in cursor.description])
+    if records.empty:
+        return 0, last_id
+    cells = aggregate_weather_rows(records)
+    cells["period_start"] = cells["period_start"].dt.strftime("%Y-%m-%d")
+    # Column-wise tolist() yields builtin values far faster than _sql_value per cell.
+    rows = list(zip(*(cells[col].tolist() for col in _ROLLUP_COLUMNS)))
+    upsert = _weather_rollup_upsert(table)
+    cursor.executemany(upsert.replace("%s", "?") if DB_BACKEND == "sqlite" else upsert, rows)
+    return len(records), _sql_value(records["weather_id"].max())
+
+def _rebuild_weather_rollup(conn, cursor, execute, batch_rows: int):
+    # Builds a fresh rollup in WeatherRollupBuild, committing batch by batch,
+    # and swaps it in with the matching high-water mark at the end. Readers
+    # keep seeing the previous rollup until the swap. The caller holds the
+    # rollup lock, so no other process is using the build table.
+    sqlite = DB_BACKEND == "sqlite"
+    execute(cursor, "DROP TABLE IF EXISTS WeatherRollupBuild")
+    execute(cursor, WEATHER_ROLLUP_TABLE_DDL.format(table="WeatherRollupBuild"))
+    conn.commit()
+    last_id, row_count = -1, 0
+    while True:
+        folded, last_id = _fold_batch(cursor, execute, "WeatherRollupBuild", last_id, batch_rows)
+        row_count += folded
+        conn.commit()
+        if folded < batch_rows:
+            break
+    if sqlite:
+        execute(cursor, "BEGIN IMMEDIATE")
+        execute(cursor, "DROP TABLE WeatherRollup")
+        execute(cursor, "ALTER TABLE WeatherRollupBuild RENAME TO WeatherRollup")
+    else:
+        # RENAME TABLE swaps both names atomically (and commits implicitly).
+        execute(cursor, "RENAME TABLE WeatherRollup TO WeatherRollupOld, WeatherRollupBuild TO WeatherRollup")
+        execute(cursor, "DROP TABLE WeatherRollupOld")
+    execute(cursor, "UPDATE WeatherRollupState SET last_weather_id = %s, row_count = %s "
+                    "WHERE source = 'WeatherRecord'", (last_id, row_count))
+    conn.commit()
+    return row_count
+
+@timed("data.update_weather_rollup")
+def update_weather_rollup(rebuild: bool = False, check_deletes: bool = True,
+                          batch_rows: int = WEATHER_ROLLUP_BATCH_ROWS):
+    """
+    Folds WeatherRecord rows added since the last call into WeatherRollup,
+    `batch_rows` at a time, each batch committed together with the new
+    high-water mark. The rollup is built from scratch on the first call,
+    when rebuild=True, or when rows at or below the mark were deleted or
+    inserted (the count no longer matches); such builds go to a side table
+    that replaces the live one when complete. That count is skipped when
+    check_deletes=False and no rows were added; in-place edits always need
+    rebuild=True. Updates from other processes wait on a database-level
+    lock (up to WEATHER_ROLLUP_LOCK_TIMEOUT_S). Returns the number of
+    weather rows folded in.
+    """
+    sqlite = DB_BACKEND == "sqlite"
+
+    def execute(cursor, statement, params=()):
+        cursor.execute(statement.replace("%s", "?") if sqlite else statement, params)
+
+    ensure_weather_rollup()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise TimeoutError(f"No database connection available after {DB_POOL_TIMEOUT}s")
+    start = time.perf_counter()
+    folded = 0
+    try:
+        with _rollup_lock:
+            conn = get_connection()
+            try:
+                cursor = conn.cursor()
+                with _weather_rollup_db_lock(cursor, execute):
+                    execute(cursor, "SELECT last_weather_id, row_count FROM WeatherRollupState "
+                                    "WHERE source = 'WeatherRecord'")
+                    last_id, row_count = cursor.fetchone()
+                    # MAX() is an index lookup; the COUNT() scan only runs when
+                    # the mark moved or the caller asks for it.
+                    execute(cursor, "SELECT MAX(weather_id) FROM WeatherRecord")
+                    newest = cursor.fetchone()[0]
+                    stale = rebuild
+                    if not stale and (check_deletes or (newest if newest is not None else -1) != last_id):
+                        execute(cursor, "SELECT COUNT(*) FROM WeatherRecord WHERE weather_id <= %s", (last_id,))
+                        stale = cursor.fetchone()[0] != row_count
+                    conn.commit()
+                    # The first build also goes through the side table, so pages
+                    # never read a half-built rollup.
+                    if stale or (last_id == -1 and newest is not None):
+                        folded += _rebuild_weather_rollup(conn, cursor, execute, batch_rows)
+                    while True:
+                        # Each batch and its high-water mark commit together.
+                        if sqlite:
+                            execute(cursor, "BEGIN IMMEDIATE")
+                        execute(cursor, "SELECT last_weather_id, row_count FROM WeatherRollupState "
+                                        "WHERE source = 'WeatherRecord'" + ("" if sqlite else " FOR UPDATE"))
+                        last_id, row_count = cursor.fetchone()
+                        batch, last_id = _fold_batch(cursor, execute, "WeatherRollup", last_id, batch_rows)
+                        execute(cursor, "UPDATE WeatherRollupState SET last_weather_id = %s, row_count = %s "
+                                        "WHERE source = 'WeatherRecord'", (last_id, row_count + batch))
+                        conn.commit()
+                        folded += batch
+                        if batch < batch_rows:
+                            break
+                cursor.close()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+    finally:
+        _pool_slots.release()
+    _record_query("weather_rollup_update", time.perf_counter() - start, folded)
+    return folded
+
+# One maintainer per process keeps the rollup current for every session.
+_rollup_worker = {"thread": None, "stop": None, "last_run_at": None, "folded": 0, "error": None}
+_rollup_worker_lock = threading.Lock()
+
+def _run_rollup_worker(stop):
+    while not stop.is_set():
+        error, folded = None, 0
+        try:
+            folded = update_weather_rollup()
+        except Exception as e:
+            error = e
+            print(f"Weather rollup update error: {e}")
+        with _rollup_worker_lock:
+            _rollup_worker.update(last_run_at=time.time(), folded=_rollup_worker["folded"] + folded, error=error)
+        stop.wait(WEATHER_ROLLUP_INTERVAL_S)
+
+def start_weather_rollup_maintainer():
+    """
+    Starts the background rollup maintainer unless it is running or
+    WEATHER_ROLLUP_INTERVAL_S is 0. Returns True if it started.
+    """
+    with _rollup_worker_lock:
+        running = _rollup_worker["thread"] is not None and _rollup_worker["thread"].is_alive()
+        if running or WEATHER_ROLLUP_INTERVAL_S <= 0:
+            return False
+        stop = threading.Event()
+        thread = threading.Thread(target=_run_rollup_worker, args=(stop,), daemon=True,
+                                  name="weather-rollup")
+        _rollup_worker.update(thread=thread, stop=stop)
+        thread.start()
+        return True
+
+def stop_weather_rollup_maintainer(timeout: float = None):
+    with _rollup_worker_lock:
+        thread, stop = _rollup_worker["thread"], _rollup_worker["stop"]
+    if thread is not None:
+        stop.set()
+        thread.join(timeout)
 
 # -------------------------------
 # Master Farm Data Query
 # -------------------------------
-def fetch_master_data():
-    conn = get_connection()
-    query = """ 
-    SELECT 
+MASTER_QUERY_TEMPLATE = """
+    WITH wcc AS (
+        SELECT cycle_id, plot_id, planting_date, actual_harvest_date,
+               {months_from} AS months_from, {months_to} AS months_to
+        FROM CropCycle
+        {weather_filter}
+    )
+    SELECT
         fp.plot_id, fp.farm_location, fp.owner, fp.size_ha,
         b.location_id, b.location_geometry,
         cc.cycle_id, cc.planting_date, cc.actual_harvest_date, c.crop_name, cc.season,
         yr.expected_yield, yr.actual_yield,
         (yr.actual_yield - yr.expected_yield) AS yield_gap,
-        SUM(CASE WHEN ir.input_type = 'Vines' THEN ir.quantity_used ELSE 0 END) AS vines_used,
-        SUM(CASE WHEN ir.input_type = 'Fertilizer' THEN ir.quantity_used ELSE 0 END) AS fertilizer_used,
-        SUM(CASE WHEN ir.input_type = 'Pesticide' THEN ir.quantity_used ELSE 0 END) AS pesticide_used,
-        SUM(CASE WHEN ir.input_type = 'Traction' THEN ir.quantity_used ELSE 0 END) AS traction_used,
-        SUM(CASE WHEN ir.input_type = 'Irrigation' THEN ir.quantity_used ELSE 0 END) AS irrigation_used,
-        SUM(CASE WHEN ir.input_type = 'Other' THEN ir.quantity_used ELSE 0 END) AS other_inputs_used,
-        SUM(ir.cost) AS total_input_cost,
-        SUM(CASE WHEN fr.transaction_type = 'Revenue' THEN fr.amount_10k ELSE 0 END) AS total_revenue,
-        SUM(CASE WHEN fr.transaction_type = 'Expense' THEN fr.amount_10k ELSE 0 END) AS total_expense,
-        (SUM(CASE WHEN fr.transaction_type = 'Revenue' THEN fr.amount_10k ELSE 0 END) -
-         SUM(CASE WHEN fr.transaction_type = 'Expense' THEN fr.amount_10k ELSE 0 END)) AS profit,
-        CASE 
-            WHEN SUM(CASE WHEN fr.transaction_type = 'Revenue' THEN fr.amount_10k ELSE 0 END) > 0
-            THEN ROUND((
-                (SUM(CASE WHEN fr.transaction_type = 'Revenue' THEN fr.amount_10k ELSE 0 END) -
-                 SUM(CASE WHEN fr.transaction_type = 'Expense' THEN fr.amount_10k ELSE 0 END))
-                /
-                SUM(CASE WHEN fr.transaction_type = 'Revenue' THEN fr.amount_10k ELSE 0 END)
-            ) * 100, 2)
+        COALESCE(inp.vines_used, 0) AS vines_used,
+        COALESCE(inp.fertilizer_used, 0) AS fertilizer_used,
+        COALESCE(inp.pesticide_used, 0) AS pesticide_used,
+        COALESCE(inp.traction_used, 0) AS traction_used,
+        COALESCE(inp.irrigation_used, 0) AS irrigation_used,
+        COALESCE(inp.other_inputs_used, 0) AS other_inputs_used,
+        inp.total_input_cost,
+        COALESCE(fin.total_revenue, 0) AS total_revenue,
+        COALESCE(fin.total_expense, 0) AS total_expense,
+        (COALESCE(fin.total_revenue, 0) - COALESCE(fin.total_expense, 0)) AS profit,
+        CASE
+            WHEN fin.total_revenue > 0
+            THEN ROUND((fin.total_revenue - fin.total_expense) * 100.0 / fin.total_revenue, 2)
             ELSE NULL
         END AS profit_margin,
-        AVG(wr.rainfall_mm) AS avg_rainfall,
-        AVG(wr.temperature_c) AS avg_temperature,
-        AVG(wr.humidity) AS avg_humidity
+        wx.avg_rainfall,
+        wx.avg_temperature,
+        wx.avg_humidity
     FROM FarmPlot fp
     LEFT JOIN Bearings b ON fp.plot_id = b.plot_id
     LEFT JOIN CropCycle cc ON fp.plot_id = cc.plot_id
     LEFT JOIN Crop c ON cc.cycle_id = c.cycle_id
-    LEFT JOIN YieldRecord yr ON cc.cycle_id = yr.cycle_id
-    LEFT JOIN InputRecord ir ON cc.cycle_id = ir.cycle_id
-    LEFT JOIN FinanceRecord fr ON cc.cycle_id = fr.cycle_id
-    LEFT JOIN WeatherRecord wr ON fp.plot_id = wr.plot_id
-       AND wr.record_date BETWEEN cc.planting_date AND cc.actual_harvest_date
-    GROUP BY 
-        fp.plot_id, fp.farm_location, fp.owner, fp.size_ha,
-        b.location_id, b.location_geometry,
-        cc.cycle_id, cc.season, cc.planting_date, cc.actual_harvest_date, c.crop_name,
-        yr.expected_yield, yr.actual_yield;
-    """ 
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df
+    LEFT JOIN (
+        SELECT cycle_id,
+               SUM(expected_yield) AS expected_yield,
+               SUM(actual_yield) AS actual_yield
+        FROM YieldRecord
+        {child_filter}
+        GROUP BY cycle_id
+    ) yr ON cc.cycle_id = yr.cycle_id
+    LEFT JOIN (
+        SELECT cycle_id,
+               SUM(CASE WHEN input_type = 'Vines' THEN quantity_used ELSE 0 END) AS vines_used,
+               SUM(CASE WHEN input_type = 'Fertilizer' THEN quantity_used ELSE 0 END) AS fertilizer_used,
+               SUM(CASE WHEN input_type = 'Pesticide' THEN quantity_used ELSE 0 END) AS pesticide_used,
+               SUM(CASE WHEN input_type = 'Traction' THEN quantity_used ELSE 0 END) AS traction_used,
+               SUM(CASE WHEN input_type = 'Irrigation' THEN quantity_used ELSE 0 END) AS irrigation_used,
+               SUM(CASE WHEN input_type = 'Other' THEN quantity_used ELSE 0 END) AS other_inputs_used,
+               SUM(cost) AS total_input_cost
+        FROM InputRecord
+        {child_filter}
+        GROUP BY cycle_id
+    ) inp ON cc.cycle_id = inp.cycle_id
+    LEFT JOIN (
+        SELECT cycle_id,
+               SUM(CASE WHEN transaction_type = 'Revenue' THEN amount_10k ELSE 0 END) AS total_revenue,
+               SUM(CASE WHEN transaction_type = 'Expense' THEN amount_10k ELSE 0 END) AS total_expense
+        FROM FinanceRecord
+        {child_filter}
+        GROUP BY cycle_id
+    ) fin ON cc.cycle_id = fin.cycle_id
+    LEFT JOIN (
+        SELECT cycle_id,
+               SUM(rainfall_sum) / NULLIF(SUM(rainfall_count), 0) AS avg_rainfall,
+               SUM(temperature_sum) / NULLIF(SUM(temperature_count), 0) AS avg_temperature,
+               SUM(humidity_sum) / NULLIF(SUM(humidity_count), 0) AS avg_humidity
+        FROM (
+            SELECT wcc.cycle_id, wr.rainfall_sum, wr.rainfall_count, wr.temperature_sum,
+                   wr.temperature_count, wr.humidity_sum, wr.humidity_count
+            FROM wcc JOIN WeatherRollup wr ON wr.plot_id = wcc.plot_id AND wr.grain = 'month'
+             AND wr.period_start >= wcc.months_from AND wr.period_start < wcc.months_to
+            UNION ALL
+            SELECT wcc.cycle_id, wr.rainfall_sum, wr.rainfall_count, wr.temperature_sum,
+                   wr.temperature_count, wr.humidity_sum, wr.humidity_count
+            FROM wcc JOIN WeatherRollup wr ON wr.plot_id = wcc.plot_id AND wr.grain = 'day'
+             AND wr.period_start >= wcc.planting_date AND wr.period_start < wcc.months_from
+             AND wr.period_start <= wcc.actual_harvest_date
+            UNION ALL
+            SELECT wcc.cycle_id, wr.rainfall_sum, wr.rainfall_count, wr.temperature_sum,
+                   wr.temperature_count, wr.humidity_sum, wr.humidity_count
+            FROM wcc JOIN WeatherRollup wr ON wr.plot_id = wcc.plot_id AND wr.grain = 'day'
+             AND wr.period_start >= wcc.months_to AND wr.period_start >= wcc.months_from
+             AND wr.period_start <= wcc.actual_harvest_date
+        ) cells
+        GROUP BY cycle_id
+    ) wx ON cc.cycle_id = wx.cycle_id
+    {cycle_filter}
+    """
+MASTER_CYCLE_BATCH_SIZE = 500
+
+def _cycle_month_bounds():
+    # [months_from, months_to) spans the calendar months lying wholly inside
+    # a cycle: the first day of the first whole month and the first day of
+    # the month after the last whole one. Date functions differ by dialect.
+    if DB_BACKEND == "sqlite":
+        return ("date(planting_date, '-1 day', 'start of month', '+1 month')",
+                "date(actual_harvest_date, '+1 day', 'start of month')")
+    return ("LAST_DAY(planting_date - INTERVAL 1 DAY) + INTERVAL 1 DAY",
+            "LAST_DAY(actual_harvest_date + INTERVAL 1 DAY - INTERVAL 1 MONTH) + INTERVAL 1 DAY")
+
+def master_query(child_filter: str = "", weather_filter: str = "", cycle_filter: str = ""):
+    """
+    Formats MASTER_QUERY_TEMPLATE. Cycle weather averages come from
+    WeatherRollup: monthly cells for the whole months inside the cycle plus
+    daily cells for the partial months at either end, so the rows read per
+    cycle stay small however long the cycle or the weather history.
+    """
+    months_from, months_to = _cycle_month_bounds()
+    return MASTER_QUERY_TEMPLATE.format(child_filter=child_filter, weather_filter=weather_filter,
+                                        cycle_filter=cycle_filter, months_from=months_from, months_to=months_to)
+
+@timed("data.fetch_master_data")
+def fetch_master_data(cycle_ids=None):
+    # Each child table is aggregated per cycle on its own before joining, so
+    # inputs x finance x weather rows never multiply against each other.
+    # Weather averages come from whatever rollup is current; the maintainer
+    # keeps it up to date off the request path.
+    ensure_weather_rollup()
+    start_weather_rollup_maintainer()
+    if cycle_ids is None:
+        return apply_master_schema(prepare_geometry(run_query("master_data", master_query())))
+
+    # Restricting every derived table to the requested cycles keeps the cost
+    # proportional to the number of cycles asked for.
+    cycle_ids = list(cycle_ids)
+    frames = []
+    for start in range(0, len(cycle_ids), MASTER_CYCLE_BATCH_SIZE):
+        batch = cycle_ids[start:start + MASTER_CYCLE_BATCH_SIZE]
+        in_list = ", ".join(["%s"] * len(batch))
+        query = master_query(
+            child_filter=f"WHERE cycle_id IN ({in_list})",
+            weather_filter=f"WHERE cycle_id IN ({in_list})",
+            cycle_filter=f"WHERE cc.cycle_id IN ({in_list})"
+        )
+        # Placeholders appear in yield, input, finance, weather and outer filters.
+        frames.append(run_query("master_data_cycles", query, batch * 5))
+    if not frames:
+        frames = [run_query("master_data_cycles", master_query() + " LIMIT 0")]
+    return apply_master_schema(prepare_geometry(pd.concat(frames, ignore_index=True)))
 
 # -------------------------------
-# Real-Time Weather Enrichment
+# Streamed Master Query (batch exports)
 # -------------------------------
-def extract_lat_lon_from_wkt(geom_str: str):
-    try:
-        point = wkt.loads(geom_str)
-        return point.y, point.x
-    except Exception:
-        return None, None
+MASTER_STREAM_CHUNK_ROWS = int(os.getenv("MASTER_STREAM_CHUNK_ROWS", "50000"))
+
+def master_filter_clause(owners=None, seasons=None, locations=None):
+    """
+    Builds the outer WHERE clause and its params for the sidebar filters;
+    an empty or missing list leaves that column unfiltered.
+    """
+    conditions, params = [], []
+    for column, values in (("fp.owner", owners), ("cc.season", seasons), ("fp.farm_location", locations)):
+        if values:
+            conditions.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    return where, params
 
-def fetch_realtime_weather(lat: float, lon: float):
+def stream_master_data(owners=None, seasons=None, locations=None, chunk_rows: int = MASTER_STREAM_CHUNK_ROWS):
+    """
+    Yields the master frame in chunks of roughly `chunk_rows` rows with the
+    filters applied in SQL. Rows are ordered by plot_id and the last plot of
+    each chunk is carried into the next one, so every plot's cycles arrive
+    together and per-plot alerts match the dashboard's.
+    """
+    # Batch exports run as scheduled jobs, so they bring the rollup fully up
+    # to date before reading it.
+    update_weather_rollup()
+    where, params = master_filter_clause(owners, seasons, locations)
+    query = master_query(cycle_filter=where + " ORDER BY fp.plot_id, cc.cycle_id")
+
+    def finish(frame):
+        frame = frame.reset_index(drop=True)
+        return apply_master_schema(prepare_geometry(frame))
+
+    carry = None
+    for chunk in stream_query("master_data_stream", query, params, chunk_rows):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        trailing = chunk["plot_id"].eq(chunk["plot_id"].iloc[-1]).to_numpy()
+        carry = chunk[trailing]
+        if not trailing.all():
+            yield finish(chunk[~trailing])
+    if carry is not None:
+        yield finish(carry)
+
+# -------------------------------
+# Master Frame Schema
+# -------------------------------
+MASTER_SCHEMA = {
+    "category": ["plot_id", "farm_location", "owner", "season", "crop_name", "location_geometry"],
+    "date": ["planting_date", "actual_harvest_date"],
+    "id": ["location_id", "cycle_id"],
+    "float": [
+        "size_ha", "expected_yield", "actual_yield", "yield_gap",
+        "vines_used", "fertilizer_used", "pesticide_used", "traction_used", "irrigation_used",
+        "other_inputs_used", "profit_margin", "avg_rainfall", "avg_temperature", "avg_humidity",
+        "rt_temperature", "rt_humidity", "rt_rainfall"
+    ],
+    # Money sums stay float64: float32 keeps only ~7 significant digits.
+    "money": ["total_input_cost", "total_revenue", "total_expense", "profit"],
+}
+# A float column is stored as float32 only if every value, rounded to this
+# many decimals, comes back unchanged.
+FLOAT32_DECIMALS = 4
+
+_memory_report = None
+
+def _downcast_float(values: pd.Series):
+    numeric = pd.to_numeric(values, errors="coerce").astype("float64")
+    small = numeric.astype("float32")
+    with np.errstate(over="ignore", invalid="ignore"):
+        safe = np.array_equal(np.round(small.to_numpy(dtype="float64"), FLOAT32_DECIMALS),
+                              np.round(numeric.to_numpy(), FLOAT32_DECIMALS), equal_nan=True)
+    return small if safe else numeric
+
+def _downcast_id(values: pd.Series):
+    numeric = pd.to_numeric(values, errors="coerce")
+    if numeric.isna().sum() > values.isna().sum():
+        return values.astype("category")
+    if numeric.notna().all() and numeric.abs().max() < 2 ** 31 and (numeric % 1 == 0).all():
+        return numeric.astype("int32")
+    return numeric.astype("float64")
+
+def apply_master_schema(df: pd.DataFrame):
+    """
+    Casts the master frame to compact types once after loading: dimensions to
+    categoricals, measures to float32 where they round-trip exactly at
+    FLOAT32_DECIMALS decimals, money columns to float64, ids to int32 and
+    cycle dates to datetime64. The per-column memory before and
+    after is kept for get_memory_report().
+    """
+    global _memory_report
+    before = df.memory_usage(deep=True, index=False)
+    out = df.copy()
+    for col in MASTER_SCHEMA["category"]:
+        if col in out.columns and not isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype("category")
+    for col in MASTER_SCHEMA["date"]:
+        if col in out.columns:
+            out[col] = pd.to_datetime(out[col], errors="coerce").dt.normalize()
+    for col in MASTER_SCHEMA["id"]:
+        if col in out.columns:
+            out[col] = _downcast_id(out[col])
+    for col in MASTER_SCHEMA["float"]:
+        if col in out.columns:
+            out[col] = _downcast_float(out[col])
+    for col in MASTER_SCHEMA["money"]:
+        if col in out.columns:
+            out[col] = pd.to_numeric(out[col], errors="coerce").astype("float64")
+    after = out.memory_usage(deep=True, index=False)
+    _memory_report = pd.DataFrame({
+        "dtype_before": df.dtypes.astype(str),
+        "bytes_before": before,
+        "dtype_after": out.dtypes.astype(str),
+        "bytes_after": after,
+    })
+    return out
+
+def get_memory_report():
+    """
+    Per-column memory of the last frame passed through apply_master_schema,
+    with a TOTAL row. Returns None before the first load.
+    """
+    if _memory_report is None:
+        return None
+    report = _memory_report.copy()
+    report.loc["TOTAL"] = ["", report["bytes_before"].sum(), "", report["bytes_after"].sum()]
+    report["reduction"] = report["bytes_before"] / report["bytes_after"].where(report["bytes_after"] > 0)
+    return report
+
+# -------------------------------
+# Incremental Master Refresh
+# -------------------------------
+# Monotonic key per table used as a high-water mark. New rows are found with
+# `key > previous max` and mapped to the cycles they affect.
+CHANGE_KEYS = {
+    "CropCycle": "cycle_id",
+    "Crop": "crop_id",
+    "YieldRecord": "yield_id",
+    "InputRecord": "input_id",
+    "FinanceRecord": "finance_id",
+    "WeatherRecord": "weather_id",
+}
+# Plot-level tables: any change here triggers a full reload.
+FULL_RELOAD_TABLES = ["FarmPlot", "Bearings"]
+# More new rows than this in one table are cheaper to pick up with a full
+# reload than by mapping each row to its cycle.
+MASTER_INCREMENTAL_MAX_ROWS = int(os.getenv("MASTER_INCREMENTAL_MAX_ROWS", "100000"))
+
+_AFFECTED_CYCLES_QUERIES = {
+    "CropCycle": "SELECT cycle_id FROM CropCycle WHERE cycle_id > %s",
+    "WeatherRecord": """
+        SELECT wr.weather_id, cc.cycle_id
+        FROM WeatherRecord wr
+        LEFT JOIN CropCycle cc ON cc.plot_id = wr.plot_id
+         AND wr.record_date BETWEEN cc.planting_date AND cc.actual_harvest_date
+        WHERE wr.weather_id > %s AND wr.weather_id <= %s
+    """,
+}
+
+def fetch_high_water_marks():
+    """
+    Returns {table: (row_count, max_key)} for every tracked table. The
+    WeatherRecord entry is the rollup's folded mark rather than the raw
+    table, since cycle weather averages only change once rows are folded.
+    """
+    ensure_weather_rollup()
+    parts = [f"SELECT '{table}' AS table_name, COUNT(*) AS row_count, MAX({key}) AS max_key FROM {table}"
+             for table, key in CHANGE_KEYS.items() if table != "WeatherRecord"]
+    parts.append("SELECT 'WeatherRecord' AS table_name, row_count, last_weather_id AS max_key "
+                 "FROM WeatherRollupState WHERE source = 'WeatherRecord'")
+    parts += [f"SELECT '{table}' AS table_name, COUNT(*) AS row_count, NULL AS max_key FROM {table}"
+              for table in FULL_RELOAD_TABLES]
+    marks = run_query("high_water_marks", " UNION ALL ".join(parts))
+    return {
+        table: (int(count), None if pd.isna(max_key) else max_key)
+        for table, count, max_key in marks.itertuples(index=False, name=None)
+    }
+
+def fetch_changed_cycle_ids(old_marks: dict, new_marks: dict):
+    """
+    Returns the set of cycle_ids touched by rows added since `old_marks`, or
+    None when the change cannot be attributed to new rows (deletes, in-place
+    inserts below the high-water mark, plot-level edits) and a full reload is
+    needed.
+    """
+    for table in FULL_RELOAD_TABLES:
+        if old_marks.get(table) != new_marks.get(table):
+            return None
+
+    changed = set()
+    for table, key in CHANGE_KEYS.items():
+        old_count, old_max = old_marks.get(table, (0, None))
+        new_count, new_max = new_marks[table]
+        if (new_count, new_max) == (old_count, old_max):
+            continue
+        if new_count < old_count or new_count - old_count > MASTER_INCREMENTAL_MAX_ROWS:
+            return None
+        query = _AFFECTED_CYCLES_QUERIES.get(table, f"SELECT {key}, cycle_id FROM {table} WHERE {key} > %s")
+        params = (old_max if old_max is not None else -1,) + ((new_max,) if table == "WeatherRecord" else ())
+        rows = run_query(f"changed_cycles_{table}", query, params)
+        # Every new row must sit above the old high-water mark; otherwise the
+        # table changed in a way the keys cannot see.
+        if rows.iloc[:, 0].nunique() != new_count - old_count:
+            return None
+        changed.update(rows["cycle_id"].dropna().tolist())
+    return changed
+
+def refresh_master_data(df: pd.DataFrame, marks: dict, expect_change: bool = False):
+    """
+    Brings a previously loaded master frame up to date. Only cycles touched by
+    new rows are re-queried and spliced in; a full reload happens when there is
+    no previous frame or the change cannot be attributed to specific cycles.
+    With expect_change=True (the change watermark moved) finding no new rows
+    means rows were edited in place, which also forces a full reload.
+    Returns (df, marks) to pass to the next refresh.
+    """
+    new_marks = fetch_high_water_marks()
+    if df is None or marks is None:
+        return fetch_master_data(), new_marks
+
+    changed = fetch_changed_cycle_ids(marks, new_marks)
+    if changed is None:
+        return fetch_master_data(), new_marks
+    if not changed:
+        edited = expect_change and new_marks == marks
+        return (fetch_master_data(), new_marks) if edited else (df, new_marks)
+
+    fresh = fetch_master_data(cycle_ids=sorted(changed))
+    # A plot without cycles was loaded as one row with a NULL cycle_id; once
+    # it gets its first cycle that placeholder row has to go as well.
+    placeholder = df["cycle_id"].isna() & df["plot_id"].isin(fresh["plot_id"].unique())
+    kept = df[~(df["cycle_id"].isin(changed) | placeholder)]
+    # Concatenating categoricals with different categories falls back to
+    # object, so the schema is re-applied to the merged frame.
+    return apply_master_schema(pd.concat([kept, fresh], ignore_index=True)), new_marks
+
+_master_state = {"df": None, "marks": None, "watermark": None, "full_load_at": 0.0}
+_master_lock = threading.Lock()
+
+@timed("data.sync_master_data")
+def sync_master_data(watermark=None):
+    """
+    Returns the in-memory master frame after an incremental refresh. Pass the
+    current fetch_change_watermark() so that a moved watermark with no new
+    rows (an in-place update) triggers a full reload. A full reload is also
+    forced every MASTER_FULL_RELOAD_S seconds, for updates the watermark
+    misses (see fetch_change_watermark) or that arrive together with inserts.
+    """
+    with _master_lock:
+        state = _master_state
+        if time.monotonic() - state["full_load_at"] > MASTER_FULL_RELOAD_S:
+            state["df"], state["marks"] = None, None
+        if state["df"] is None:
+            state["full_load_at"] = time.monotonic()
+        expect_change = watermark is not None and state["watermark"] not in (None, watermark)
+        state["df"], state["marks"] = refresh_master_data(state["df"], state["marks"], expect_change)
+        state["watermark"] = watermark
+        return state["df"]
+
+# -------------------------------
+# Change Watermark
+# -------------------------------
+# WeatherRecord is tracked through the rollup's folded mark instead: new
+# weather rows only reach the dashboard once the maintainer folds them in.
+SOURCE_TABLES = [
+    "FarmPlot", "Bearings", "CropCycle", "Crop",
+    "YieldRecord", "InputRecord", "FinanceRecord"
+]
+
+@timed("data.fetch_change_watermark")
+def fetch_change_watermark():
+    """
+    Cheap fingerprint of the source tables: row count plus, on MySQL, the
+    server's last update time per table. Inserts and deletes always change
+    the returned tuple. In-place updates change it on MySQL only: the
+    statistics cache is switched off for the query
+    (information_schema_stats_expiry = 0) so UPDATE_TIME is current, but it
+    has one-second resolution, so an update in the same second as the
+    previous read can go unseen until the next change. After a server
+    restart UPDATE_TIME is NULL until the table is written again. On SQLite
+    only row counts are compared. Updates the tuple misses are picked up by
+    sync_master_data's forced reload after MASTER_FULL_RELOAD_S. Weather
+    rows count once folded into WeatherRollup (the last entry).
+    """
+    ensure_weather_rollup()
+    counts = run_query("change_watermark_counts", " UNION ALL ".join(
+        f"SELECT '{table}' AS table_name, COUNT(*) AS row_count FROM {table}" for table in SOURCE_TABLES
+    ))
+    folded = run_query("change_watermark_rollup", "SELECT row_count, last_weather_id FROM WeatherRollupState "
+                                                  "WHERE source = 'WeatherRecord'")
+    rollup_mark = ("WeatherRollupState", int(folded["row_count"].iloc[0]), str(folded["last_weather_id"].iloc[0]))
+    if DB_BACKEND == "sqlite":
+        return tuple((table, int(count), None)
+                     for table, count in zip(counts["table_name"], counts["row_count"])) + (rollup_mark,)
+    placeholders = ", ".join(["%s"] * len(SOURCE_TABLES))
+    updated = run_query("change_watermark_updates", f"""
+        SELECT TABLE_NAME AS table_name, UPDATE_TIME AS update_time
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME IN ({placeholders})
+    """, [DB_NAME] + SOURCE_TABLES, session_statements=["SET SESSION information_schema_stats_expiry = 0"])
+    update_times = dict(zip(updated["table_name"], updated["update_time"]))
+    return tuple(
+        (table, int(count), str(update_times.get(table)))
+        for table, count in zip(counts["table_name"], counts["row_count"])
+    ) + (rollup_mark,)
+
+# -------------------------------
+# Real-Time Weather Enrichment
+# -------------------------------
+def fetch_realtime_weather(lat: float, lon: float, session=None):
+    """
+    Returns current temperature, humidity and rainfall for one coordinate.
+    Raises on a missing API key, a failed request or a non-200 response, so
+    the weather store can back off.
+    """
     if not WEATHER_API_KEY:
-        return {"temperature": None, "humidity": None, "rainfall": None}
-    url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric"
-    try:
-        resp = requests.get(url, timeout=8)
-        if resp.status_code == 200:
-            data = resp.json()
-            return {
-                "temperature": data.get("main", {}).get("temp"),
-                "humidity": data.get("main", {}).get("humidity"),
-                "rainfall": data.get("rain", {}).get("1h", 0)
-            }
-    except Exception:
-        pass
-    return {"temperature": None, "humidity": None, "rainfall": None}
-
-def enrich_df_with_realtime_weather(df: pd.DataFrame):
-    df["rt_temperature"] = None
-    df["rt_humidity"] = None
-    df["rt_rainfall"] = None
-    for idx, row in df.iterrows():
-        lat, lon = extract_lat_lon_from_wkt(str(row.get("location_geometry", "")))
-        if lat is not None and lon is not None:
-            w = fetch_realtime_weather(lat, lon)
-            df.at[idx, "rt_temperature"] = w["temperature"]
-            df.at[idx, "rt_humidity"] = w["humidity"]
-            df.at[idx, "rt_rainfall"] = w["rainfall"]
+        raise RuntimeError("WEATHER_API_KEY is not set")
+    params = {"lat": lat, "lon": lon, "appid": WEATHER_API_KEY, "units": "metric"}
+    resp = (session or requests).get(WEATHER_API_URL, params=params, timeout=8)
+    resp.raise_for_status()
+    data = resp.json()
+    return {
+        "temperature": data.get("main", {}).get("temp"),
+        "humidity": data.get("main", {}).get("humidity"),
+        "rainfall": data.get("rain", {}).get("1h", 0)
+    }
+
+@timed("data.enrich_df_with_realtime_weather")
+def enrich_df_with_realtime_weather(df: pd.DataFrame, grid_decimals: int = WEATHER_GRID_DECIMALS,
+                                    fetch_missing: bool = False):
+    """
+    Adds rt_temperature, rt_humidity and rt_rainfall columns from the local
+    weather store (see weather_store.py). Plot coordinates are rounded to
+    `grid_decimals` and registered with the store; the background refresher
+    fetches them within the API quota, and until then the columns are NaN
+    (or the last stored values, if stale). With fetch_missing=True,
+    coordinates that were never fetched are fetched first, waiting for quota.
+    """
+    if "lat" not in df.columns or "lon" not in df.columns:
+        df = prepare_geometry(df)
+    keys = df[["lat", "lon"]].astype("float64").round(grid_decimals)
+
+    coords = list(keys.dropna().drop_duplicates().itertuples(index=False, name=None))
+    register_coordinates(coords)
+    if fetch_missing:
+        refresh_due(fetch_realtime_weather, missing_only=True, coords=coords)
+    elif WEATHER_API_KEY:
+        start_weather_refresher(fetch_realtime_weather)
+    weather = read_current_weather().drop(columns="fetched_at")
+
+    merged = keys.merge(weather, on=["lat", "lon"], how="left")
+    for col in ["rt_temperature", "rt_humidity", "rt_rainfall"]:
+        df[col] = pd.to_numeric(merged[col], errors="coerce").to_numpy(dtype="float32")
     return df
 
 # -------------------------------
 # Historical Weather Query
 # -------------------------------
+# Charts read WeatherRollup cells: `rainfall_mm` is the period total and
+# `temperature_c` / `humidity` are period means. For daily data at the day
+# grain these are the recorded values.
+WEATHER_HISTORY_COLUMNS = """
+    plot_id, period_start AS record_date,
+    CASE WHEN rainfall_count > 0 THEN rainfall_sum END AS rainfall_mm,
+    temperature_sum / NULLIF(temperature_count, 0) AS temperature_c,
+    humidity_sum / NULLIF(humidity_count, 0) AS humidity
+"""
+
+def weather_history_grain(days: int, max_points: int = None):
+    """The finest rollup grain that shows a window of `days` days in at most `max_points` periods."""
+    if not max_points or days <= max_points:
+        return "day"
+    return "week" if days / 7 <= max_points else "month"
+
 def fetch_weather_history(plot_id, planting_date, harvest_date):
-    conn = get_connection()
     query = f"""
-        SELECT record_date, rainfall_mm, temperature_c, humidity
-        FROM WeatherRecord
-        WHERE plot_id = '{plot_id}'
-          AND record_date BETWEEN '{planting_date}' AND '{harvest_date}'
-        ORDER BY record_date ASC
-    """
-    weather_df = pd.read_sql(query, conn)
-    conn.close()
-    return weather_df
\ No newline at end of file
+        SELECT {WEATHER_HISTORY_COLUMNS}
+        FROM WeatherRollup
+        WHERE plot_id = %s AND grain = 'day'
+          AND period_start BETWEEN %s AND %s
+        ORDER BY period_start ASC
+    """
+    return run_query("weather_history", query, (plot_id, planting_date, harvest_date)).drop(columns="plot_id")
+
+@timed("data.fetch_weather_history_batch")
+def fetch_weather_history_batch(windows: pd.DataFrame, batch_size: int = WEATHER_HISTORY_BATCH_SIZE,
+                                max_points: int = None):
+    """
+    Loads the weather windows for many plots at once. `windows` needs plot_id,
+    planting_date and actual_harvest_date columns; plots are sent `batch_size`
+    at a time, so N plots cost ceil(N / batch_size) round trips. With
+    `max_points`, windows too long to chart day by day are read as weekly or
+    monthly cells (those starting inside the window). Returns one long-format
+    frame with a plot_id column, ordered by plot and date.
+    """
+    columns = ["plot_id", "record_date", "rainfall_mm", "temperature_c", "humidity"]
+    windows = windows.dropna(subset=["plot_id", "planting_date", "actual_harvest_date"])
+    windows = windows.drop_duplicates(subset=["plot_id", "planting_date", "actual_harvest_date"])
+    days = (pd.to_datetime(windows["actual_harvest_date"]) - pd.to_datetime(windows["planting_date"])).dt.days + 1
+    windows = windows.assign(grain=[weather_history_grain(d, max_points) for d in days])
+    frames = []
+    for start in range(0, len(windows), batch_size):
+        chunk = windows.iloc[start:start + batch_size]
+        conditions = " OR ".join(["(plot_id = %s AND grain = %s AND period_start BETWEEN %s AND %s)"] * len(chunk))
+        params = [
+            value
+            for row in chunk[["plot_id", "grain", "planting_date", "actual_harvest_date"]].itertuples(index=False)
+            for value in row
+        ]
+        query = f"""
+            SELECT {WEATHER_HISTORY_COLUMNS}
+            FROM WeatherRollup
+            WHERE {conditions}
+            ORDER BY plot_id, period_start ASC
+        """
+        frames.append(run_query("weather_history_batch", query, params))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
\ No newline at end of file
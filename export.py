@@ -0,0 +1,110 @@
+# export.py
+
+import os
+import tempfile
+import threading
+import time
+import weakref
+from batch import ChunkWriter
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+# Prepared files are kept on disk until their total size passes this, then
+# the least recently used ones are deleted.
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_MB", "512")) * 2 ** 20
+EXPORT_DIR = os.getenv("EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "farm_dashboard_exports")
+
+# Label -> (file extension, MIME type). The extension picks the ChunkWriter format.
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "CSV (gzip)": (".csv.gz", "application/gzip"),
+    "CSV (zip)": (".zip", "application/zip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+# -------------------------------
+# Write Export Files
+# -------------------------------
+def write_export(frame, path: str, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """
+    Writes `frame` to `path` `chunk_rows` rows at a time, so only one chunk
+    is serialized in memory. An empty frame still gets a header (or a
+    Parquet schema). Returns the number of rows written.
+    """
+    writer = ChunkWriter(path)
+    try:
+        for start in range(0, max(len(frame), 1), chunk_rows):
+            writer.write(frame.iloc[start:start + chunk_rows])
+    finally:
+        writer.close()
+    return writer.rows
+
+# -------------------------------
+# Prepared Export Cache
+# -------------------------------
+# One file per (name, filter key, format), shared by every session. An
+# entry only matches while the frame it was built from is still the loaded
+# one, so a data reload never serves an old file.
+_exports = {}
+_exports_lock = threading.Lock()
+
+def _matches(entry, source):
+    return entry is not None and entry["source"]() is source and os.path.exists(entry["path"])
+
+def get_export(name: str, source, key, fmt: str):
+    """Returns the prepared export entry (path, size, rows, built_at) or None."""
+    with _exports_lock:
+        entry = _exports.get((name, key, fmt))
+        if not _matches(entry, source):
+            return None
+        entry["last_used"] = time.time()
+        return entry
+
+def prepare_export(name: str, frame, source, key, fmt: str):
+    """
+    Writes `frame` in format `fmt` (an EXPORT_FORMATS label) unless a
+    matching file exists, and caches it under (name, key, fmt) for as long
+    as `source` (the loaded frame `frame` was filtered from) stays current.
+    """
+    entry = get_export(name, source, key, fmt)
+    if entry is not None:
+        return entry
+    extension, _ = EXPORT_FORMATS[fmt]
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    handle, path = tempfile.mkstemp(prefix=f"{name}_", suffix=extension, dir=EXPORT_DIR)
+    os.close(handle)
+    try:
+        rows = write_export(frame, path)
+    except Exception:
+        os.remove(path)
+        raise
+    entry = {"source": weakref.ref(source), "path": path, "size": os.path.getsize(path), "rows": rows,
+             "built_at": time.time(), "last_used": time.time()}
+    with _exports_lock:
+        previous = _exports.get((name, key, fmt))
+        _exports[(name, key, fmt)] = entry
+        stale = [previous] if previous is not None else []
+        stale += _evict_locked(keep=(name, key, fmt))
+    for old in stale:
+        if os.path.exists(old["path"]):
+            os.remove(old["path"])
+    return entry
+
+def _evict_locked(keep):
+    # Drops entries whose source frame is gone, then the least recently used
+    # ones until the cache fits EXPORT_CACHE_MAX_BYTES.
+    removed = []
+    for k in [k for k, e in _exports.items() if k != keep and e["source"]() is None]:
+        removed.append(_exports.pop(k))
+    total = sum(e["size"] for e in _exports.values())
+    for k, e in sorted(_exports.items(), key=lambda item: item[1]["last_used"]):
+        if total <= EXPORT_CACHE_MAX_BYTES:
+            break
+        if k != keep:
+            removed.append(_exports.pop(k))
+            total -= e["size"]
+    return removed
+
+def read_export(entry: dict):
+    """The prepared file's bytes, read only when the download is requested."""
+    with open(entry["path"], "rb") as f:
+        return f.read()
@@ -0,0 +1,171 @@
+# filters.py
+
+import threading
+import numpy as np
+import pandas as pd
+from alerts import evaluate_risks
+from profiling import timed
+
+# -------------------------------
+# Filter Index Definition
+# -------------------------------
+# Built once per loaded frame. Each dimension is factorized into integer
+# codes, and the row positions are grouped by code, so every value's rows
+# are one contiguous, sorted slice. Values covering at least 1 /
+# FILTER_DENSE_FRACTION of the rows also get a packed row bitmap (so at
+# most that many per dimension). Alert rules are evaluated once over the
+# whole frame and kept as row positions per issue.
+FILTER_DIMENSIONS = ["owner", "season", "farm_location"]
+FILTER_DENSE_FRACTION = 64
+
+def _group_positions(codes: np.ndarray, groups: int):
+    # Returns (positions sorted by code, offsets) so group g is
+    # positions[offsets[g]:offsets[g + 1]]; rows with code -1 are left out.
+    order = np.argsort(codes, kind="stable").astype(np.int32)
+    counts = np.bincount(codes[codes >= 0], minlength=groups)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return order[len(codes) - offsets[-1]:], offsets
+
+@timed("filters.build_filter_index")
+def build_filter_index(df: pd.DataFrame, rules: list = None):
+    """
+    Indexes `df` for the sidebar filters: per FILTER_DIMENSIONS column the
+    distinct values (the option lists, in order of first appearance) and
+    the row positions of each, plus the row positions flagged by each alert
+    rule and each plot's rows.
+    """
+    dense_rows = max(1, len(df) // FILTER_DENSE_FRACTION)
+    index = {"rows": len(df), "dense_rows": dense_rows, "dimensions": {}, "alerts": {}}
+    for dim in FILTER_DIMENSIONS:
+        codes, values = pd.factorize(df[dim])
+        codes = codes.astype(np.int32)
+        positions, offsets = _group_positions(codes, len(values))
+        counts = np.diff(offsets)
+        index["dimensions"][dim] = {
+            "codes": codes, "values": list(values), "counts": counts,
+            "lookup": {value: code for code, value in enumerate(values)},
+            "positions": positions, "offsets": offsets,
+            "bitmaps": {int(code): np.packbits(codes == code) for code in np.flatnonzero(counts >= dense_rows)},
+        }
+
+    risks = evaluate_risks(df, rules)
+    flagged = np.zeros(len(df), dtype=bool)
+    for issue in risks.columns:
+        index["alerts"][issue] = np.flatnonzero(risks[issue].to_numpy(dtype=bool))
+        flagged[index["alerts"][issue]] = True
+    index["risks"] = risks
+    index["flagged"] = flagged
+
+    plot_codes, plots = pd.factorize(df["plot_id"])
+    plot_codes = plot_codes.astype(np.int32)
+    alert_plots = np.zeros(len(plots) + 1, dtype=bool)
+    alert_plots[plot_codes[index["flagged"]]] = True
+    index["plot_codes"] = plot_codes
+    index["plot_count"] = len(plots)
+    index["alert_rows"] = np.flatnonzero(alert_plots[plot_codes])
+    return index
+
+# The index for the most recently loaded frame, shared by every session.
+_index = {"source": None, "index": None}
+_index_lock = threading.Lock()
+
+def get_filter_index(df: pd.DataFrame):
+    """Returns the filter index for `df`, building it only when a new frame is loaded."""
+    with _index_lock:
+        if _index["source"] is df:
+            return _index["index"]
+    index = build_filter_index(df)
+    with _index_lock:
+        _index.update(source=df, index=index)
+    return index
+
+def filter_options(index: dict, dim: str):
+    """The non-missing values of `dim`, for a multiselect's options."""
+    return index["dimensions"][dim]["values"]
+
+# -------------------------------
+# Resolve Filters
+# -------------------------------
+def _selected_codes(entry: dict, selected):
+    # Codes of the selected values; unknown values match nothing, as with isin.
+    lookup = entry["lookup"]
+    return np.unique(np.array([lookup[v] for v in selected if v in lookup], dtype=np.int64))
+
+def _value_rows(entry: dict, codes: np.ndarray):
+    # Sorted row positions holding any of the value codes.
+    offsets, positions = entry["offsets"], entry["positions"]
+    if len(codes) == 1:
+        return positions[offsets[codes[0]]:offsets[codes[0] + 1]]
+    return np.sort(np.concatenate([positions[offsets[c]:offsets[c + 1]] for c in codes] or [positions[:0]]))
+
+def _keep_values(entry: dict, rows: np.ndarray, codes: np.ndarray):
+    # Narrows `rows` to those holding any of the value codes.
+    wanted = np.zeros(len(entry["values"]) + 1, dtype=bool)
+    wanted[codes] = True
+    return rows[wanted[entry["codes"][rows]]]
+
+def _value_bits(entry: dict, codes: np.ndarray, rows: int):
+    # Packed bitmap of the rows holding any of the value codes: the dense
+    # values' bitmaps OR'd together, plus the sparse values' positions.
+    dense = [entry["bitmaps"][c] for c in codes.tolist() if c in entry["bitmaps"]]
+    bits = np.bitwise_or.reduce(dense) if dense else np.zeros((rows + 7) // 8, dtype=np.uint8)
+    sparse = [c for c in codes.tolist() if c not in entry["bitmaps"]]
+    if sparse:
+        mask = np.unpackbits(bits, count=rows).view(bool)
+        offsets, positions = entry["offsets"], entry["positions"]
+        for c in sparse:
+            mask[positions[offsets[c]:offsets[c + 1]]] = True
+        bits = np.packbits(mask)
+    return bits
+
+def _alert_plot_rows(index: dict, rows: np.ndarray):
+    # Keeps the rows of plots that have at least one flagged row among `rows`.
+    plot_codes = index["plot_codes"][rows]
+    has_alert = np.zeros(index["plot_count"] + 1, dtype=bool)
+    has_alert[plot_codes[index["flagged"][rows]]] = True
+    return rows[has_alert[plot_codes]]
+
+def filter_positions(index: dict, selections: dict, alerts_only: bool = False):
+    """
+    Returns the sorted row positions matching `selections` ({dimension:
+    selected values}; an empty selection keeps every row), or None when
+    nothing is filtered. With alerts_only=True only rows of plots with an
+    alert among the matching rows are kept.
+
+    When the most selective dimension matches few rows, its positions are
+    the candidates and the other dimensions only test those. Otherwise each
+    dimension's selection becomes a packed bitmap and the bitmaps are
+    intersected with one AND per dimension.
+    """
+    entries = index["dimensions"]
+    active = [(entries[dim], _selected_codes(entries[dim], values))
+              for dim, values in selections.items() if values]
+    if not active:
+        return index["alert_rows"] if alerts_only else None
+    active.sort(key=lambda item: int(item[0]["counts"][item[1]].sum()))
+    entry, codes = active[0]
+    if entry["counts"][codes].sum() < index["dense_rows"] or (len(active) == 1 and len(codes) == 1):
+        rows = _value_rows(entry, codes)
+        for entry, codes in active[1:]:
+            rows = _keep_values(entry, rows, codes)
+    else:
+        bits = _value_bits(entry, codes, index["rows"])
+        for entry, codes in active[1:]:
+            bits &= _value_bits(entry, codes, index["rows"])
+        rows = np.flatnonzero(np.unpackbits(bits, count=index["rows"]).view(bool))
+    return _alert_plot_rows(index, rows) if alerts_only else rows
+
+def apply_filters(df: pd.DataFrame, index: dict, selections: dict, alerts_only: bool = False):
+    """Returns the rows of `df` matching the filters with one take, or `df` itself when nothing is filtered."""
+    rows = filter_positions(index, selections, alerts_only)
+    return df if rows is None else df.take(rows)
+
+def flagged_rows(df: pd.DataFrame, index: dict, selections: dict):
+    """
+    Returns (frame, risk flags) for only the rows among the filtered ones
+    that break at least one alert rule, which is all the alert detectors
+    need.
+    """
+    rows = filter_positions(index, selections)
+    flagged = np.flatnonzero(index["flagged"]) if rows is None else rows[index["flagged"][rows]]
+    return df.take(flagged), index["risks"].take(flagged)
@@ -1,11 +1,23 @@
 # main.py
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
-from data import fetch_master_data, enrich_df_with_realtime_weather
+import plotly.express as px
+from streamlit_folium import st_folium
+from data import sync_master_data, fetch_change_watermark, enrich_df_with_realtime_weather, get_memory_report
+from cache import cached, has_entry, get_cache_stats, DATA_CACHE_TTL, WEATHER_CACHE_TTL, WATERMARK_TTL
 from alerts import detect_risks_alert, detect_risks_map, generate_alert_export
 from weather import render_weather_overlay
-from map import render_farm_map
+from map import (render_farm_map, aggregate_grid, default_viewport, update_viewport,
+                 MAP_WIDTH, MAP_HEIGHT, MAP_GRID_MAX_ZOOM)
+from filters import get_filter_index, filter_options, apply_filters, flagged_rows
+from rollup import get_rollup, build_rollup, filter_rollup, rollup_by, rollup_totals
+from snapshot import (save_snapshot_in_background, load_snapshot, snapshot_exists, describe_age,
+                      refresh_in_background, refresh_status)
+from weather_store import store_version, refresher_status, WEATHER_MAX_AGE_S
+from export import EXPORT_FORMATS, get_export, prepare_export, read_export
+from profiling import start_run, span, finish_run, start_profiler, profile_report
 
 # -------------------------------
 # Page Setup
@@ -15,208 +27,425 @@ st.title("🌍 Farm Management Dashboard")
 st.markdown("Visualizing farm plots with **profitability and real-time weather** using GIS points/polygons.")
 
 # -------------------------------
-# Load and Enrich Data
+# Pipeline Instrumentation
 # -------------------------------
-df = fetch_master_data()
-df = enrich_df_with_realtime_weather(df)
-
-# -------------------------------
-# Sidebar Filters
-# -------------------------------
-st.sidebar.markdown("### 🔎 Filters")
-owners = st.sidebar.multiselect("Owner", options=df["owner"].dropna().unique())
-seasons = st.sidebar.multiselect("Season", options=df["season"].dropna().unique())
-locations = st.sidebar.multiselect("Farm Location", options=df["farm_location"].dropna().unique())
-
-if owners:
-    df = df[df["owner"].isin(owners)]
-if seasons:
-    df = df[df["season"].isin(seasons)]
-if locations:
-    df = df[df["farm_location"].isin(locations)]
-
-# -------------------------------
-# Sidebar Risk Controls
-# -------------------------------
-st.sidebar.markdown("### ⚠️ Risk Controls")
-color_metric = st.sidebar.radio(
-    "Color plots by:",
-    options=["Profit Margin", "Temperature", "Rainfall", "Humidity"],
-    index=0
-)
-show_only_alerts = st.sidebar.checkbox("Show only plots with alerts", value=False)
-
-# -------------------------------
-# Sidebar Weather Overlay
-# -------------------------------
-st.sidebar.markdown("### 📅 Weather Overlay")
-selected_plots = st.sidebar.multiselect(
-    "Select Plots for Weather Comparison",
-    options=df["plot_id"].unique(),
-    default=[df["plot_id"].iloc[0]]
-)
-
-# -------------------------------
-# Risk Detection
-# -------------------------------
-risk_alerts = detect_risks_alert(df)
-plot_alerts = detect_risks_map(df)
-
-if show_only_alerts:
-    df = df[df["plot_id"].isin(plot_alerts.keys())]
-
-# -------------------------------
-# Tabbed Layout
-# -------------------------------
-tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
-    "📊 Overview", "📈 Charts", "🚨 Alerts", "🌦️ Weather", "🗺️ Map", "📋 Data"
-])
-
-# -------------------------------
-# Tab 1: Overview
-# -------------------------------
-with tab1:
-    st.markdown("### 📊 Key Performance Indicators")
-    kpi1, kpi2, kpi3 = st.columns(3)
-    kpi4, kpi5, kpi6 = st.columns(3)
-
-    with kpi1:
-        st.metric("Total Cultivated Area (ha)", round(df["size_ha"].sum(), 2))
-    with kpi2:
-        st.metric("Crop Diversity", f"{len(df['crop_name'].dropna().unique())} crops")
-    with kpi3:
-        st.metric("Total Yield (tons)", round(df["actual_yield"].sum(), 2))
-    with kpi4:
-        st.metric("Profit Margin (%)", f"{round(df['profit_margin'].mean(), 2)}%")
-    with kpi5:
-        st.metric("Total Revenue (₵)", f"{df['total_revenue'].sum():,.2f}")
-    with kpi6:
-        st.metric("Total Expense (₵)", f"{df['total_expense'].sum():,.2f}")
-
-    st.markdown("---")
-    st.markdown("### 🌦️ Real-time Weather Averages")
-    w1, w2, w3 = st.columns(3)
-    with w1:
-        st.metric("Avg Temp (°C)", round(pd.to_numeric(df["rt_temperature"], errors="coerce").mean(), 1))
-    with w2:
-        st.metric("Avg Humidity (%)", round(pd.to_numeric(df["rt_humidity"], errors="coerce").mean(), 1))
-    with w3:
-        st.metric("Avg Rainfall (mm)", round(pd.to_numeric(df["rt_rainfall"], errors="coerce").mean(), 2))
-
-# -------------------------------
-# Tab 2: Charts
-# -------------------------------
-with tab2:
-    st.markdown("### 📈 Performance Charts")
-
-    st.markdown("#### 📊 Yield by Owner")
-    st.bar_chart(df.groupby("owner")["actual_yield"].sum())
-
-    st.markdown("#### 💰 Input Costs per Owner")
-    st.bar_chart(df.groupby("owner")["total_input_cost"].sum())
-
-    st.markdown("#### ⚖️ Revenue vs Expense by Crop")
-    rev_exp = df.groupby("crop_name")[["total_revenue", "total_expense"]].sum()
-    st.bar_chart(rev_exp)
-
-    st.markdown("#### 📉 Profit Margin by Owner")
-    fig_profit = px.bar(df, x="owner", y="profit_margin", title="Profit Margin by Owner")
-    st.plotly_chart(fig_profit, use_container_width=True)
-
-    st.markdown("#### 🧪 Crop vs Revenue (Bubble by Yield)")
-    fig_roi = px.scatter(
-        df,
-        x="crop_name",
-        y="total_revenue",
-        size="actual_yield",
-        color="owner",
-        title="Crop vs Revenue (Bubble by Yield)"
+# Widget values from the previous rerun decide whether memory is traced and
+# whether this rerun is profiled.
+debug_timings = st.session_state.get("debug_timings", False)
+profiler = start_profiler() if st.session_state.pop("profile_next_rerun", False) else None
+start_run("rerun", trace_memory=debug_timings)
+try:
+    # -------------------------------
+    # Load and Enrich Data (cached across reruns and sessions)
+    # -------------------------------
+    @cached("change_watermark", ttl=WATERMARK_TTL)
+    def load_watermark():
+        return fetch_change_watermark()
+
+    @cached("master_data", ttl=DATA_CACHE_TTL)
+    def load_master_data(watermark):
+        # Re-queries only the cycles touched since the previous load.
+        return sync_master_data(watermark)
+
+    @cached("enriched_data", ttl=WEATHER_CACHE_TTL)
+    def load_enriched_data(watermark, weather_version):
+        # Real-time weather is a join against the local weather store, which the
+        # background refresher keeps warm; weather_version changes when it has
+        # stored newer conditions.
+        # A shallow copy is enough: the weather columns are added to the copy
+        # only, and the shared master frame's data is never written through it.
+        df = enrich_df_with_realtime_weather(load_master_data(watermark).copy(deep=False))
+        # Weather-only reloads happen every minute or so; the snapshot is only
+        # rewritten when the watermark moved or SNAPSHOT_MIN_INTERVAL_S passed.
+        save_snapshot_in_background(df, watermark)
+        return df
+
+    def load_live_data():
+        return load_enriched_data(load_watermark(), store_version())
+
+    # The first session in a process is served from the on-disk snapshot while
+    # live data loads in the background. Later reruns use live data, and fall
+    # back to the snapshot (read-only) if the database cannot be reached.
+    with span("main.load_data") as load_span:
+        df, snapshot_info, live_error = None, None, None
+        if has_entry("enriched_data") or not snapshot_exists():
+            try:
+                df = load_live_data()
+            except Exception as e:
+                live_error = e
+                print(f"Live data load error: {e}")
+        if df is None:
+            df, snapshot_info = load_snapshot()
+            if df is None:
+                st.error(f"Could not load farm data and no snapshot is available: {live_error}")
+                st.stop()
+            if live_error is None:
+                refresh_in_background(load_live_data)
+                live_error = refresh_status()["error"]
+        load_span["rows"] = len(df)
+
+    if live_error is not None and snapshot_info is not None:
+        st.warning(f"⚠️ Database unreachable. Showing a read-only snapshot from {describe_age(snapshot_info)}.")
+    elif snapshot_info is not None:
+        st.info(f"Showing the snapshot from {describe_age(snapshot_info)} while live data loads.")
+
+        @st.fragment(run_every=2)
+        def wait_for_live_data():
+            # Reload the page once the background refresh has filled the cache,
+            # or has failed, so the snapshot is shown with the outage warning.
+            status = refresh_status()
+            if not status["running"] and (has_entry("enriched_data") or status["error"] is not None):
+                st.rerun()
+
+        wait_for_live_data()
+
+    # -------------------------------
+    # Per-Section Results (memoized per session)
+    # -------------------------------
+    base_df = df
+
+    def memo(name: str, key, compute):
+        """
+        Returns compute() for this session, recomputing only when `key` or the
+        loaded frame changes. One result is kept per name, so returning to a
+        section after an unrelated rerun costs nothing.
+        """
+        store = st.session_state.setdefault("section_memo", {})
+        entry = store.get(name)
+        if entry is None or entry["base"] is not base_df or entry["key"] != key:
+            entry = {"base": base_df, "key": key, "value": compute()}
+            store[name] = entry
+        return entry["value"]
+
+    # -------------------------------
+    # Sidebar Filters
+    # -------------------------------
+    # Option lists, row positions per value and alert flags come from the
+    # filter index, built once per loaded frame.
+    filter_index = get_filter_index(base_df)
+
+    st.sidebar.markdown("### 🔎 Filters")
+    owners = st.sidebar.multiselect("Owner", options=filter_options(filter_index, "owner"))
+    seasons = st.sidebar.multiselect("Season", options=filter_options(filter_index, "season"))
+    locations = st.sidebar.multiselect("Farm Location", options=filter_options(filter_index, "farm_location"))
+    selections = {"owner": owners, "season": seasons, "farm_location": locations}
+
+    # -------------------------------
+    # Sidebar Risk Controls
+    # -------------------------------
+    st.sidebar.markdown("### ⚠️ Risk Controls")
+    color_metric = st.sidebar.radio(
+        "Color plots by:",
+        options=["Profit Margin", "Temperature", "Rainfall", "Humidity"],
+        index=0
     )
-    st.plotly_chart(fig_roi, use_container_width=True)
-
-# -------------------------------
-# Tab 3: Alerts
-# -------------------------------
-with tab3:
-    st.markdown("### 🚨 Risk Alerts")
-
-    if risk_alerts:
-        for alert in risk_alerts:
-            st.error(f"Plot {alert['plot_id']} ({alert['owner']}, {alert['location']}): " +
-                     ", ".join(alert["issues"]))
-    else:
-        st.success("No critical alerts detected across filtered plots.")
-
-    st.markdown("---")
-    st.markdown("### 📥 Export Alert List")
-
-    if risk_alerts:
-        alert_df = generate_alert_export(df, plot_alerts)
-        with st.expander("📋 View Alert Table"):
-            st.dataframe(alert_df)
-
-        st.download_button(
-            label="Download Alert List as CSV",
-            data=alert_df.to_csv(index=False),
-            file_name=f"farm_alerts_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv"
+    show_only_alerts = st.sidebar.checkbox("Show only plots with alerts", value=False)
+
+    # -------------------------------
+    # Sidebar Cache Status
+    # -------------------------------
+    with st.sidebar.expander("🗄️ Data Cache"):
+        cache_stats = pd.DataFrame.from_dict(get_cache_stats(), orient="index")
+        if not cache_stats.empty:
+            st.dataframe(cache_stats.rename(columns={
+                "hits": "Hits", "misses": "Misses", "joined": "Shared Loads", "saved_s": "Time Saved (s)",
+                "last_load_s": "Last Load (s)"
+            }))
+        weather_status = refresher_status()
+        if weather_status["known"]:
+            st.caption(
+                f"Real-time weather: {weather_status['fresh']}/{weather_status['known']} locations "
+                f"fetched in the last {WEATHER_MAX_AGE_S // 60} min, {weather_status['missing']} not yet fetched, "
+                f"{weather_status['failing']} failing"
+                + (f" (API backoff {weather_status['backoff_s']}s)" if weather_status["backoff_s"] else "")
+            )
+        memory_report = get_memory_report()
+        if memory_report is not None:
+            st.caption("Master frame memory per column (bytes)")
+            st.dataframe(memory_report)
+
+    # -------------------------------
+    # Risk Detection
+    # -------------------------------
+    filter_key = (tuple(owners), tuple(seasons), tuple(locations))
+
+    def detect_all():
+        # The detectors only look at flagged rows, so they get just those.
+        frame, risks = flagged_rows(base_df, filter_index, selections)
+        return detect_risks_alert(frame, risks), detect_risks_map(frame, risks)
+
+    with span("main.risk_detection"):
+        risk_alerts, plot_alerts = memo("risks", filter_key, detect_all)
+
+    # The filtered view is a single take from the loaded frame.
+    view_key = filter_key + (show_only_alerts,)
+    with span("main.apply_filters") as filter_span:
+        df = memo("view", view_key, lambda: apply_filters(base_df, filter_index, selections, show_only_alerts))
+        filter_span["rows"] = len(df)
+
+    # -------------------------------
+    # Section Navigation
+    # -------------------------------
+    # Only the selected section is built on each rerun; st.tabs would run the
+    # body of every tab even though one is visible.
+    SECTIONS = ["📊 Overview", "📈 Charts", "🚨 Alerts", "🌦️ Weather", "🗺️ Map", "📋 Data"]
+    section = st.radio("Section", SECTIONS, horizontal=True, key="active_section", label_visibility="collapsed")
+
+    # -------------------------------
+    # Rollup Cube
+    # -------------------------------
+    # KPIs and charts read the per-load rollup cube, so their cost depends on
+    # the number of owner/season/location/crop cells rather than rows.
+    def view_cube(df):
+        # The alerts-only filter keeps whole plots, which the cube cannot
+        # express; that view is rolled up from its rows instead.
+        if show_only_alerts:
+            return memo("alert_cube", view_key, lambda: build_rollup(df))
+        return filter_rollup(get_rollup(base_df), owners, seasons, locations)
+
+    # -------------------------------
+    # Overview
+    # -------------------------------
+    def render_overview(df):
+        totals = rollup_totals(view_cube(df))
+        st.markdown("### 📊 Key Performance Indicators")
+        kpi1, kpi2, kpi3 = st.columns(3)
+        kpi4, kpi5, kpi6 = st.columns(3)
+
+        with kpi1:
+            st.metric("Total Cultivated Area (ha)", round(totals["size_ha"], 2))
+        with kpi2:
+            st.metric("Crop Diversity", f"{totals['crops']} crops")
+        with kpi3:
+            st.metric("Total Yield (tons)", round(totals["actual_yield"], 2))
+        with kpi4:
+            st.metric("Profit Margin (%)", f"{round(totals['profit_margin'], 2)}%")
+        with kpi5:
+            st.metric("Total Revenue (₵)", f"{totals['total_revenue']:,.2f}")
+        with kpi6:
+            st.metric("Total Expense (₵)", f"{totals['total_expense']:,.2f}")
+
+        st.markdown("---")
+        st.markdown("### 🌦️ Real-time Weather Averages")
+        w1, w2, w3 = st.columns(3)
+        with w1:
+            st.metric("Avg Temp (°C)", round(totals["rt_temperature"], 1))
+        with w2:
+            st.metric("Avg Humidity (%)", round(totals["rt_humidity"], 1))
+        with w3:
+            st.metric("Avg Rainfall (mm)", round(totals["rt_rainfall"], 2))
+
+    # -------------------------------
+    # Charts
+    # -------------------------------
+    def build_charts(cube):
+        by_owner = rollup_by(cube, "owner")
+        rev_exp = rollup_by(cube, "crop_name")[["total_revenue", "total_expense"]]
+        # Bar height is the sum of the cycles' margins, as when every row was
+        # stacked into the owner's bar.
+        fig_profit = px.bar(
+            by_owner.reset_index(), x="owner", y="profit_margin_sum",
+            labels={"profit_margin_sum": "profit_margin"}, title="Profit Margin by Owner"
         )
-
-    st.markdown("---")
-    st.markdown("### 📊 Alert Type Frequency")
-
-    from collections import Counter
-    all_issues = [issue for issues in plot_alerts.values() for issue in issues]
-    issue_counts = Counter(all_issues)
-
-    if issue_counts:
-        alert_summary_df = pd.DataFrame({
-            "Alert Type": list(issue_counts.keys()),
-            "Count": list(issue_counts.values())
-        })
-
-        fig_alerts = px.bar(
-            alert_summary_df,
-            x="Alert Type",
-            y="Count",
-            color="Alert Type",
-            title="Number of Plots Triggering Each Alert Type",
-            text="Count"
+        # One bubble per crop and owner.
+        fig_roi = px.scatter(
+            rollup_by(cube, ["crop_name", "owner"]).reset_index(),
+            x="crop_name",
+            y="total_revenue",
+            size="actual_yield",
+            color="owner",
+            title="Crop vs Revenue (Bubble by Yield)"
         )
-        st.plotly_chart(fig_alerts, use_container_width=True)
-    else:
-        st.info("No alert types to summarize.")
-
-# -------------------------------
-# Tab 4: Weather
-# -------------------------------
-with tab4:
-    st.markdown("### 🌦️ Historical Weather Overlay")
-    fig = render_weather_overlay(df, selected_plots)
-    if fig:
-        st.plotly_chart(fig, use_container_width=True)
-    else:
-        st.info("No weather data available for selected plots.")
-
-# -------------------------------
-# Tab 5: Map
-# -------------------------------
-with tab5:
-    st.markdown("### 🗺️ Farm Plots Map")
-    farm_map = render_farm_map(df, plot_alerts, color_metric)
-    st_folium(farm_map, width=900, height=600)
+        return by_owner["actual_yield"], by_owner["total_input_cost"], rev_exp, fig_profit, fig_roi
+
+    def render_charts(df):
+        yield_by_owner, input_by_owner, rev_exp, fig_profit, fig_roi = memo("charts", view_key, lambda: build_charts(view_cube(df)))
+        st.markdown("### 📈 Performance Charts")
+
+        st.markdown("#### 📊 Yield by Owner")
+        st.bar_chart(yield_by_owner)
+
+        st.markdown("#### 💰 Input Costs per Owner")
+        st.bar_chart(input_by_owner)
+
+        st.markdown("#### ⚖️ Revenue vs Expense by Crop")
+        st.bar_chart(rev_exp)
+
+        st.markdown("#### 📉 Profit Margin by Owner")
+        st.plotly_chart(fig_profit, use_container_width=True)
+
+        st.markdown("#### 🧪 Crop vs Revenue (Bubble by Yield)")
+        st.plotly_chart(fig_roi, use_container_width=True)
+
+    # -------------------------------
+    # On-Demand Exports
+    # -------------------------------
+    def render_export(name: str, label: str, file_stem: str, build_frame):
+        """
+        Format picker plus a prepare button. The file is written in chunks only
+        when asked for, then cached per filter set and format for every session.
+        """
+        fmt_col, action_col = st.columns([1, 2])
+        fmt = fmt_col.selectbox("Format", list(EXPORT_FORMATS), key=f"{name}_export_format")
+        entry = get_export(name, base_df, view_key, fmt)
+        if entry is None and action_col.button(f"Prepare {label}", key=f"{name}_export_prepare"):
+            with st.spinner(f"Writing {label.lower()}..."):
+                entry = prepare_export(name, build_frame(), base_df, view_key, fmt)
+        if entry is not None:
+            extension, mime = EXPORT_FORMATS[fmt]
+            action_col.download_button(
+                label=f"Download {label} ({entry['rows']:,} rows, {entry['size'] / 1e6:.1f} MB)",
+                data=lambda: read_export(entry),
+                file_name=f"{file_stem}{extension}",
+                mime=mime,
+                key=f"{name}_export_download",
+                on_click="ignore"
+            )
+
+    # -------------------------------
+    # Alerts
+    # -------------------------------
+    def render_alerts(df):
+        st.markdown("### 🚨 Risk Alerts")
+
+        if risk_alerts:
+            for alert in risk_alerts:
+                st.error(f"Plot {alert['plot_id']} ({alert['owner']}, {alert['location']}): " +
+                         ", ".join(alert["issues"]))
+        else:
+            st.success("No critical alerts detected across filtered plots.")
+
+        st.markdown("---")
+        st.markdown("### 📥 Export Alert List")
+
+        if risk_alerts:
+            alert_df = memo("alert_export", view_key, lambda: generate_alert_export(df, plot_alerts))
+            with st.expander("📋 View Alert Table"):
+                st.dataframe(alert_df)
+
+            render_export("alerts", "Alert List", f"farm_alerts_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}",
+                          lambda: alert_df)
+
+        st.markdown("---")
+        st.markdown("### 📊 Alert Type Frequency")
+
+        from collections import Counter
+        all_issues = [issue for issues in plot_alerts.values() for issue in issues]
+        issue_counts = Counter(all_issues)
+
+        if issue_counts:
+            alert_summary_df = pd.DataFrame({
+                "Alert Type": list(issue_counts.keys()),
+                "Count": list(issue_counts.values())
+            })
+
+            fig_alerts = px.bar(
+                alert_summary_df,
+                x="Alert Type",
+                y="Count",
+                color="Alert Type",
+                title="Number of Plots Triggering Each Alert Type",
+                text="Count"
+            )
+            st.plotly_chart(fig_alerts, use_container_width=True)
+        else:
+            st.info("No alert types to summarize.")
+
+    # -------------------------------
+    # Weather
+    # -------------------------------
+    # Fragments rerun on their own when a widget inside them changes, so picking
+    # plots or panning the map does not re-execute the rest of the page.
+    @st.fragment
+    def render_weather(df):
+        st.markdown("### 🌦️ Historical Weather Overlay")
+        plot_ids = df["plot_id"].unique()
+        selected_plots = st.multiselect(
+            "Select Plots for Weather Comparison",
+            options=plot_ids,
+            default=plot_ids[:1]
+        )
+        with span("main.weather_overlay", rows=len(selected_plots)):
+            fig = memo("weather", view_key + (tuple(selected_plots),),
+                       lambda: render_weather_overlay(df, selected_plots))
+        if fig:
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No weather data available for selected plots.")
+
+    # -------------------------------
+    # Map
+    # -------------------------------
+    @st.fragment
+    def render_map(df, color_metric):
+        st.markdown("### 🗺️ Farm Plots Map")
+        # Only plots inside the last reported viewport (plus padding) are drawn;
+        # the map is rebuilt when the user pans outside it or changes zoom.
+        # Zoomed out, plots are binned into grid cells once per zoom level, so
+        # panning reuses the cells.
+        viewport = st.session_state.get("map_viewport") or default_viewport()
+        zoom = viewport[4]
+        grid = None
+        if zoom < MAP_GRID_MAX_ZOOM:
+            grid = memo(f"map_grid_{zoom}", view_key, lambda: aggregate_grid(df, plot_alerts, zoom))
+        farm_map = memo("map", view_key + (color_metric, viewport),
+                        lambda: render_farm_map(df, plot_alerts, color_metric, viewport=viewport, grid=grid))
+        with span("main.st_folium", rows=len(df)):
+            map_state = st_folium(farm_map, key="farm_map", width=MAP_WIDTH, height=MAP_HEIGHT,
+                                  returned_objects=["bounds", "zoom"])
+        new_viewport = update_viewport(map_state, viewport)
+        if new_viewport != viewport:
+            st.session_state["map_viewport"] = new_viewport
+            # Redraw only the map. A fragment-scoped rerun is refused while the
+            # fragment runs as part of a full page run, which reruns the page.
+            try:
+                st.rerun(scope="fragment")
+            except StreamlitAPIException:
+                st.rerun()
+
+    # -------------------------------
+    # Data Table
+    # -------------------------------
+    def render_data(df):
+        st.markdown("### 📋 Farm Plot Data")
+        with st.expander("🔍 View Filtered Farm Data"):
+            st.dataframe(df)
+
+        render_export("farm_data", "Filtered Data", "filtered_farm_data", lambda: df)
+
+    # -------------------------------
+    # Render Selected Section
+    # -------------------------------
+    SECTION_RENDERERS = {
+        "📊 Overview": ("main.tab_overview", render_overview),
+        "📈 Charts": ("main.tab_charts", render_charts),
+        "🚨 Alerts": ("main.tab_alerts", render_alerts),
+        "🌦️ Weather": ("main.tab_weather", render_weather),
+        "🗺️ Map": ("main.tab_map", lambda df: render_map(df, color_metric)),
+        "📋 Data": ("main.tab_data", render_data),
+    }
+    span_name, render_section = SECTION_RENDERERS[section]
+    with span(span_name, rows=len(df)):
+        render_section(df)
+finally:
+    # Runs even when the rerun ends early (st.stop, st.rerun), so the run's
+    # memory tracing is released and the profiler is switched off.
+    run = finish_run()
+    if profiler is not None:
+        st.session_state["last_profile"] = profile_report(profiler)
 
 # -------------------------------
-# Tab 6: Data Table
+# Sidebar Debug Panel
 # -------------------------------
-with tab6:
-    st.markdown("### 📋 Farm Plot Data")
-    with st.expander("🔍 View Filtered Farm Data"):
-        st.dataframe(df)
-
-    st.download_button(
-        label="Download Filtered Data as CSV",
-        data=df.to_csv(index=False),
-        file_name="filtered_farm_data.csv",
-        mime="text/csv"
-    )
\ No newline at end of file
+with st.sidebar.expander("🛠️ Debug"):
+    st.checkbox("Show pipeline timings (traces memory)", key="debug_timings")
+    st.button("Profile next rerun (cProfile)",
+              on_click=lambda: st.session_state.update(profile_next_rerun=True))
+    if debug_timings and run is not None:
+        timings = pd.DataFrame(run["spans"])
+        timings["name"] = ["  " * depth + name for depth, name in zip(timings["depth"], timings["name"])]
+        st.caption(f"Rerun {run['run_id']}: {run['total_s']:.3f}s total")
+        st.dataframe(timings.drop(columns=["depth", "start_s"]), hide_index=True)
+    if st.session_state.get("last_profile"):
+        st.caption("Last cProfile capture")
+        st.code(st.session_state["last_profile"], language=None)
@@ -1,16 +1,79 @@
 # map.py
 
+import math
 import folium
-import json
+import numpy as np
 import pandas as pd
+import shapely
 import branca.colormap as cm
 from streamlit_folium import st_folium
-from data import extract_lat_lon_from_wkt
+from utils import prepare_geometry, get_geometry, geometry_keys, query_viewport
+from profiling import timed
+
+MAP_CENTER = (5.55, -0.2)
+MAP_ZOOM = 7
+MAP_WIDTH, MAP_HEIGHT = 900, 600
+# Below this zoom level polygon outlines are simplified to the pixel grid.
+MAP_DETAIL_ZOOM = 13
+# Below this zoom level plots are aggregated into square grid cells about
+# MAP_GRID_CELL_PX pixels wide instead of being drawn one by one.
+MAP_GRID_MAX_ZOOM = 11
+MAP_GRID_CELL_PX = 48
+# Fraction of the visible width/height added on each side of the viewport,
+# so small pans stay inside the area already drawn.
+MAP_VIEWPORT_PADDING = 0.25
 
 # -------------------------------
-# Render Farm Map
+# Viewport
+# -------------------------------
+# A viewport is (south, west, north, east, zoom): the padded area drawn on
+# the map and the zoom level it was drawn for.
+def degrees_per_pixel(zoom: float):
+    return 360.0 / (256 * 2 ** zoom)
+
+def _padded_viewport(south, west, north, east, zoom):
+    pad_lat = (north - south) * MAP_VIEWPORT_PADDING
+    pad_lon = (east - west) * MAP_VIEWPORT_PADDING
+    return (round(south - pad_lat, 4), round(west - pad_lon, 4),
+            round(north + pad_lat, 4), round(east + pad_lon, 4), zoom)
+
+def default_viewport(center=MAP_CENTER, zoom=MAP_ZOOM, width=MAP_WIDTH, height=MAP_HEIGHT):
+    """Viewport of the initial map view, before st_folium has reported bounds."""
+    lon_span = degrees_per_pixel(zoom) * width
+    lat_span = degrees_per_pixel(zoom) * height * math.cos(math.radians(center[0]))
+    return _padded_viewport(center[0] - lat_span / 2, center[1] - lon_span / 2,
+                            center[0] + lat_span / 2, center[1] + lon_span / 2, zoom)
+
+def update_viewport(map_state, viewport):
+    """
+    Returns the viewport to draw for the bounds and zoom st_folium reported.
+    The current viewport is kept while the visible area stays inside it at
+    the same zoom, so panning within the padding does not trigger a redraw.
+    """
+    bounds = (map_state or {}).get("bounds") or {}
+    south_west, north_east = bounds.get("_southWest"), bounds.get("_northEast")
+    zoom = (map_state or {}).get("zoom")
+    if not south_west or not north_east or zoom is None:
+        return viewport
+    south, west = south_west.get("lat"), south_west.get("lng")
+    north, east = north_east.get("lat"), north_east.get("lng")
+    if None in (south, west, north, east):
+        return viewport
+    if viewport is not None and viewport[4] == zoom and (
+            south >= viewport[0] and west >= viewport[1] and north <= viewport[2] and east <= viewport[3]):
+        return viewport
+    return _padded_viewport(south, west, north, east, zoom)
+
+def cull_to_viewport(df: pd.DataFrame, viewport):
+    """Keeps the rows whose plot geometry intersects the viewport."""
+    south, west, north, east, _ = viewport
+    visible = query_viewport(south, west, north, east)
+    return df[geometry_keys(df).isin(visible)]
+
+# -------------------------------
+# Metric Color Scale
 # -------------------------------
-def render_farm_map(df: pd.DataFrame, plot_alerts: dict, metric: str):
+def _metric_colormap(df: pd.DataFrame, metric: str):
     # Determine metric and color scale
     if metric == "Profit Margin":
         metric_col = "profit_margin"
@@ -19,30 +82,312 @@ def render_farm_map(df: pd.DataFrame, plot_alerts: dict, metric: str):
         caption = "Profit Margin (%)"
     elif metric == "Temperature":
         metric_col = "rt_temperature"
-        series = pd.to_numeric(df[metric_col], errors="coerce").dropna()
+        series = df[metric_col].dropna()
         vmin, vmax = (series.min(), series.max()) if not series.empty else (0, 40)
         if vmin == vmax: vmin, vmax = vmin - 1, vmax + 1
         colors = ["blue", "lightblue", "orange", "red"]
         caption = "Temperature (°C)"
     elif metric == "Rainfall":
         metric_col = "rt_rainfall"
-        series = pd.to_numeric(df[metric_col], errors="coerce").dropna()
+        series = df[metric_col].dropna()
         vmin, vmax = 0, float(series.max()) if not series.empty else 10
         if vmin == vmax: vmax = vmin + 1
         colors = ["white", "lightblue", "blue", "darkblue"]
         caption = "Rainfall (mm)"
     else:  # Humidity
         metric_col = "rt_humidity"
-        series = pd.to_numeric(df[metric_col], errors="coerce").dropna()
+        series = df[metric_col].dropna()
         vmin, vmax = (series.min(), series.max()) if not series.empty else (0, 100)
         if vmin == vmax: vmin, vmax = vmin - 1, vmax + 1
         colors = ["#f7fbff", "#6baed6", "#08306b"]
         caption = "Humidity (%)"
 
     colormap = cm.LinearColormap(colors=colors, vmin=vmin, vmax=vmax, caption=caption)
-    farm_map = folium.Map(location=[5.55, -0.2], zoom_start=7, tiles="CartoDB positron")
+    return metric_col, vmin, colormap
+
+def _vectorized_colors(values: pd.Series, colormap, fill_value):
+    """
+    Interpolates the colormap over a whole column at once and returns a list of
+    "#rrggbb" strings, matching what colormap(value) gives for each row.
+    """
+    x = pd.to_numeric(values, errors="coerce").fillna(fill_value).to_numpy(dtype="float64")
+    index = np.asarray(colormap.index, dtype="float64")
+    rgba = np.asarray(colormap.colors, dtype="float64")
+    channels = [(np.interp(x, index, rgba[:, i]) * 255.9999999).astype(np.int64) for i in range(3)]
+    codes = (channels[0] << 16) | (channels[1] << 8) | channels[2]
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    palette = np.array(["#%06x" % code for code in unique_codes.tolist()], dtype=object)
+    return palette[inverse.ravel()].tolist()
+
+# -------------------------------
+# Render Farm Map
+# -------------------------------
+@timed("map.render_farm_map")
+def render_farm_map(df: pd.DataFrame, plot_alerts: dict, metric: str, mode: str = "geojson", viewport=None,
+                    grid: pd.DataFrame = None):
+    """
+    Builds the folium map. mode="geojson" (default) emits one GeoJSON layer with
+    templated popups; mode="features" adds one folium object per plot. With a
+    viewport, only plots inside it are drawn (see build_plot_layer), and below
+    MAP_GRID_MAX_ZOOM plots are shown as grid cells instead; pass the cells
+    from aggregate_grid() as `grid` to reuse them across pans.
+    """
+    if "lat" not in df.columns or "lon" not in df.columns:
+        df = prepare_geometry(df)
+    farm_map = render_base_map(df, metric, viewport)
+    if viewport is not None and viewport[4] < MAP_GRID_MAX_ZOOM:
+        if grid is None:
+            grid = aggregate_grid(df, plot_alerts, viewport[4])
+        build_grid_layer(df, grid, metric, viewport).add_to(farm_map)
+    else:
+        build_plot_layer(df, plot_alerts, metric, mode, viewport).add_to(farm_map)
+    return farm_map
+
+def render_base_map(df: pd.DataFrame, metric: str, viewport=None):
+    """
+    Tiles and the metric legend, without any plots. With a viewport the map
+    opens centered on it at its zoom, so redrawing keeps the user's view.
+    """
+    _, _, colormap = _metric_colormap(df, metric)
+    location, zoom = list(MAP_CENTER), MAP_ZOOM
+    if viewport is not None:
+        location = [(viewport[0] + viewport[2]) / 2, (viewport[1] + viewport[3]) / 2]
+        zoom = viewport[4]
+    farm_map = folium.Map(location=location, zoom_start=zoom, tiles="CartoDB positron")
+    colormap.add_to(farm_map)
+    return farm_map
+
+@timed("map.build_plot_layer")
+def build_plot_layer(df: pd.DataFrame, plot_alerts: dict, metric: str, mode: str = "geojson", viewport=None):
+    """
+    Returns a FeatureGroup with the plots. With a viewport, plots outside it
+    are skipped using the spatial index, and below MAP_DETAIL_ZOOM outlines
+    are simplified to the map's pixel size (plots under two pixels across
+    are drawn as points). Colors are scaled over the whole frame, so they
+    do not shift while panning.
+    """
+    if "lat" not in df.columns or "lon" not in df.columns:
+        df = prepare_geometry(df)
+    metric_col, vmin, colormap = _metric_colormap(df, metric)
+    tolerance = 0.0
+    if viewport is not None:
+        df = cull_to_viewport(df, viewport)
+        if viewport[4] < MAP_DETAIL_ZOOM:
+            tolerance = degrees_per_pixel(viewport[4])
+
+    layer = folium.FeatureGroup(name="Farm Plots")
+    if mode == "geojson":
+        _add_geojson_layer(layer, df, plot_alerts, metric_col, vmin, colormap, tolerance)
+    else:
+        _add_feature_layers(layer, df, plot_alerts, metric_col, vmin, colormap)
+    return layer
+
+# -------------------------------
+# Single GeoJSON Layer
+# -------------------------------
+POPUP_FIELDS = [
+    ("owner", "Owner"),
+    ("size_ha", "Area (ha)"),
+    ("crop_name", "Crop"),
+    ("expected_yield", "Expected Yield (tons)"),
+    ("actual_yield", "Actual Yield (tons)"),
+    ("total_revenue", "Revenue (₵)"),
+    ("total_expense", "Expense (₵)"),
+    ("profit", "Profit (₵)"),
+    ("profit_margin", "Profit Margin (%)"),
+    ("rt_temperature", "🌡️ Temp (°C)"),
+    ("rt_humidity", "💧 Humidity (%)"),
+    ("rt_rainfall", "🌧️ Rainfall (mm)"),
+    ("alerts", "⚠️ Alerts"),
+]
+
+def _geojson_geometry(entry, tolerance: float = 0.0):
+    if entry is None:
+        return None
+    if entry["kind"] == "polygon":
+        outline = entry["coords"][:, ::-1]
+        if tolerance:
+            # Too small to see as a shape at this zoom.
+            if np.ptp(outline, axis=0).max() < 2 * tolerance:
+                return {"type": "Point", "coordinates": [entry["lon"], entry["lat"]]}
+            if len(outline) >= 3:
+                ring = shapely.simplify(shapely.linearrings(outline), tolerance)
+                outline = shapely.get_coordinates(ring)
+            # Finer precision than a pixel only adds payload.
+            outline = outline.round(max(0, math.ceil(-math.log10(tolerance))))
+        ring = outline.tolist()
+        if ring and ring[0] != ring[-1]:
+            ring.append(ring[0])
+        return {"type": "Polygon", "coordinates": [ring]}
+    return {"type": "Point", "coordinates": [entry["lon"], entry["lat"]]}
+
+def _popup_column(values: pd.Series):
+    numeric = pd.to_numeric(values, errors="coerce")
+    if numeric.notna().sum() < values.notna().sum():
+        text = values.astype(object).where(values.notna(), "N/A")
+    else:
+        text = numeric.map("{:,.2f}".format, na_action="ignore").astype(object).fillna("N/A")
+    return text.astype(str)
+
+def build_feature_collection(df: pd.DataFrame, plot_alerts: dict, metric_col: str, vmin, colormap,
+                             tolerance: float = 0.0):
+    alert_text = df["plot_id"].map({pid: ", ".join(issues) for pid, issues in plot_alerts.items()})
+    has_alert = alert_text.notna().to_numpy()
+    fill_colors = _vectorized_colors(df[metric_col], colormap, vmin)
 
-    for _, plot in df.iterrows():
+    props = pd.DataFrame({
+        field: _popup_column(df[field]) if field in df.columns else "N/A"
+        for field, _ in POPUP_FIELDS if field != "alerts"
+    }, index=df.index)
+    props["alerts"] = alert_text.astype(object).fillna("").to_numpy()
+    props["fill"] = fill_colors
+    props["stroke"] = np.where(has_alert, "red", props["fill"].to_numpy())
+    props["weight"] = np.where(has_alert, 3, 1).tolist()
+
+    location_ids = geometry_keys(df)
+    parsed = {lid: _geojson_geometry(get_geometry(lid), tolerance) for lid in location_ids.dropna().unique().tolist()}
+
+    features = [
+        {"type": "Feature", "geometry": parsed[lid], "properties": record}
+        for lid, record in zip(location_ids.tolist(), props.to_dict("records"))
+        if parsed.get(lid) is not None
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+def _feature_style(feature):
+    props = feature["properties"]
+    is_point = feature["geometry"]["type"] == "Point"
+    return {
+        "color": props["stroke"],
+        "weight": props["weight"],
+        "fillColor": props["fill"],
+        "fillOpacity": 0.7 if is_point else 0.6,
+    }
+
+def _add_geojson_layer(farm_map, df, plot_alerts, metric_col, vmin, colormap, tolerance: float = 0.0):
+    collection = build_feature_collection(df, plot_alerts, metric_col, vmin, colormap, tolerance)
+    if not collection["features"]:
+        return
+    fields = [field for field, _ in POPUP_FIELDS]
+    aliases = [alias for _, alias in POPUP_FIELDS]
+    folium.GeoJson(
+        collection,
+        name="Farm Plots",
+        style_function=_feature_style,
+        marker=folium.CircleMarker(radius=6, fill=True),
+        popup=folium.GeoJsonPopup(fields=fields, aliases=aliases, localize=False),
+        tooltip=folium.GeoJsonTooltip(fields=["owner", "crop_name"], aliases=["Owner", "Crop"])
+    ).add_to(farm_map)
+
+# -------------------------------
+# Grid Aggregation Layer
+# -------------------------------
+GRID_METRICS = ["profit_margin", "rt_temperature", "rt_rainfall", "rt_humidity"]
+
+def grid_cell_size(zoom: float):
+    """Cell width in degrees for a zoom level."""
+    return degrees_per_pixel(zoom) * MAP_GRID_CELL_PX
+
+@timed("map.aggregate_grid")
+def aggregate_grid(df: pd.DataFrame, plot_alerts: dict, zoom: float):
+    """
+    Bins plot centroids into square cells sized for `zoom` over the whole
+    frame. Returns one row per non-empty cell with its bounds, plot count,
+    area (each plot counted once), summed profit, the mean of every map
+    metric, the number of plots with alerts and the most frequent alert.
+    """
+    cell = grid_cell_size(zoom)
+    located = df[df["lat"].notna() & df["lon"].notna()]
+    rows = pd.DataFrame({
+        "ix": np.floor(located["lon"].to_numpy(dtype="float64") / cell).astype(np.int64),
+        "iy": np.floor(located["lat"].to_numpy(dtype="float64") / cell).astype(np.int64),
+        "plot_id": located["plot_id"].to_numpy(dtype=object),
+        "size_ha": pd.to_numeric(located["size_ha"], errors="coerce").to_numpy(dtype="float64"),
+        "profit": pd.to_numeric(located["profit"], errors="coerce").to_numpy(dtype="float64"),
+        **{col: pd.to_numeric(located[col], errors="coerce").to_numpy(dtype="float64")
+           for col in GRID_METRICS if col in located.columns},
+    })
+    plots = rows.drop_duplicates("plot_id")
+    plots = plots.assign(has_alert=plots["plot_id"].isin(plot_alerts.keys()))
+    cells = plots.groupby(["ix", "iy"]).agg(
+        plots=("plot_id", "size"), area_ha=("size_ha", "sum"), alert_plots=("has_alert", "sum")
+    )
+    metrics = [col for col in GRID_METRICS if col in rows.columns]
+    cells = cells.join(rows.groupby(["ix", "iy"])[["profit"] + metrics].agg(
+        {"profit": "sum", **{col: "mean" for col in metrics}}
+    ))
+
+    # Most frequent issue among the cell's flagged plots (ties by name).
+    issues = pd.DataFrame(
+        [(plot_id, issue) for plot_id, plot_issues in plot_alerts.items() for issue in plot_issues],
+        columns=["plot_id", "issue"]
+    )
+    counts = plots[["plot_id", "ix", "iy"]].merge(issues, on="plot_id").groupby(["ix", "iy", "issue"]).size()
+    if len(counts):
+        dominant = (counts.rename("n").reset_index()
+                    .sort_values(["n", "issue"], ascending=[False, True])
+                    .drop_duplicates(["ix", "iy"]).set_index(["ix", "iy"])["issue"])
+        cells["dominant_alert"] = dominant.reindex(cells.index)
+    else:
+        cells["dominant_alert"] = None
+
+    cells = cells.reset_index()
+    cells["south"], cells["north"] = cells["iy"] * cell, (cells["iy"] + 1) * cell
+    cells["west"], cells["east"] = cells["ix"] * cell, (cells["ix"] + 1) * cell
+    return cells
+
+def build_grid_layer(df: pd.DataFrame, cells: pd.DataFrame, metric: str, viewport=None):
+    """
+    Returns a FeatureGroup with one square per grid cell inside the
+    viewport, filled by the cell's mean of the selected metric and outlined
+    in red when any of its plots has an alert.
+    """
+    metric_col, vmin, colormap = _metric_colormap(df, metric)
+    if viewport is not None:
+        south, west, north, east, _ = viewport
+        cells = cells[(cells["north"] >= south) & (cells["south"] <= north) &
+                      (cells["east"] >= west) & (cells["west"] <= east)]
+    layer = folium.FeatureGroup(name="Farm Plots (grid)")
+    if cells.empty:
+        return layer
+
+    values = cells[metric_col] if metric_col in cells.columns else pd.Series(np.nan, index=cells.index)
+    fill_colors = _vectorized_colors(values, colormap, vmin)
+    has_alert = (cells["alert_plots"] > 0).to_numpy()
+    props = pd.DataFrame({
+        "plots": cells["plots"].astype(str),
+        "area_ha": _popup_column(cells["area_ha"]),
+        "profit": _popup_column(cells["profit"]),
+        "metric": _popup_column(values),
+        "alert_plots": cells["alert_plots"].astype(str),
+        "dominant_alert": cells["dominant_alert"].fillna("None").astype(str),
+        "fill": fill_colors,
+        "stroke": np.where(has_alert, "red", fill_colors),
+        "weight": np.where(has_alert, 2, 1).tolist(),
+    }, index=cells.index)
+    features = [
+        {"type": "Feature",
+         "geometry": {"type": "Polygon", "coordinates": [[[w, s], [e, s], [e, n], [w, n], [w, s]]]},
+         "properties": record}
+        for s, w, n, e, record in zip(cells["south"].tolist(), cells["west"].tolist(), cells["north"].tolist(),
+                                      cells["east"].tolist(), props.to_dict("records"))
+    ]
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        name="Farm Plots (grid)",
+        style_function=_feature_style,
+        tooltip=folium.GeoJsonTooltip(
+            fields=["plots", "area_ha", "profit", "metric", "alert_plots", "dominant_alert"],
+            aliases=["Plots", "Area (ha)", "Profit (₵)", colormap.caption, "Plots with alerts", "Main alert"]
+        )
+    ).add_to(layer)
+    return layer
+
+# -------------------------------
+# Per-Feature Layers
+# -------------------------------
+def _add_feature_layers(farm_map, df, plot_alerts, metric_col, vmin, colormap):
+    for key, (_, plot) in zip(geometry_keys(df), df.iterrows()):
         value = plot.get(metric_col)
         color = colormap(value if pd.notna(value) else vmin)
         plot_id = plot["plot_id"]
@@ -67,11 +412,10 @@ def render_farm_map(df: pd.DataFrame, plot_alerts: dict, metric: str):
         """
 
         try:
-            geom = str(plot.get("location_geometry", ""))
-            if geom.startswith("["):
-                coords = json.loads(geom)
+            geometry = get_geometry(key)
+            if geometry is not None and geometry["kind"] == "polygon":
                 folium.Polygon(
-                    locations=coords,
+                    locations=geometry["coords"].tolist(),
                     color="red" if plot_id in plot_alerts else color,
                     weight=3 if plot_id in plot_alerts else 1,
                     fill=True,
@@ -79,20 +423,15 @@ def render_farm_map(df: pd.DataFrame, plot_alerts: dict, metric: str):
                     fill_opacity=0.6,
                     popup=popup_html
                 ).add_to(farm_map)
-            else:
-                lat, lon = extract_lat_lon_from_wkt(geom)
-                if lat is not None and lon is not None:
-                    folium.CircleMarker(
-                        location=[lat, lon],
-                        radius=6,
-                        color="red" if plot_id in plot_alerts else color,
-                        fill=True,
-                        fill_color=color,
-                        fill_opacity=0.7,
-                        popup=popup_html
-                    ).add_to(farm_map)
+            elif pd.notna(plot.get("lat")) and pd.notna(plot.get("lon")):
+                folium.CircleMarker(
+                    location=[plot["lat"], plot["lon"]],
+                    radius=6,
+                    color="red" if plot_id in plot_alerts else color,
+                    fill=True,
+                    fill_color=color,
+                    fill_opacity=0.7,
+                    popup=popup_html
+                ).add_to(farm_map)
         except Exception as e:
             print(f"Error rendering geometry for owner {plot.get('owner','')}: {e}")
-
-    colormap.add_to(farm_map)
-    return farm_map
\ No newline at end of file
@@ -0,0 +1,157 @@
+# profiling.py
+
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_LOG_PATH = os.getenv("PROFILE_LOG_PATH")
+
+# The active run lives in a context variable: every Streamlit session reruns
+# the script in its own thread, so spans from different sessions never mix.
+_current_run = contextvars.ContextVar("profile_run", default=None)
+
+# tracemalloc is process-wide, so it is reference-counted: it is started by
+# the first run that asks for memory tracing and stopped only when no run
+# that asked for it is still open.
+_tracing = {"runs": 0, "started": False}
+_tracing_lock = threading.Lock()
+
+def _acquire_tracing():
+    with _tracing_lock:
+        _tracing["runs"] += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing["started"] = True
+
+def _release_tracing():
+    with _tracing_lock:
+        _tracing["runs"] -= 1
+        if _tracing["runs"] == 0 and _tracing["started"]:
+            tracemalloc.stop()
+            _tracing["started"] = False
+
+# -------------------------------
+# Runs and Spans
+# -------------------------------
+def start_run(label: str = "rerun", trace_memory: bool = False):
+    """
+    Starts collecting spans for the current thread. With trace_memory=True,
+    tracemalloc is kept on until this run finishes, so each span also records
+    allocated memory. A run left open by the previous rerun is finished first.
+    """
+    if _current_run.get() is not None:
+        finish_run(log_path=None)
+    if trace_memory:
+        _acquire_tracing()
+    run = {
+        "run_id": uuid.uuid4().hex[:12],
+        "label": label,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "spans": [],
+        "_start": time.perf_counter(),
+        "_depth": 0,
+        "_traced": trace_memory,
+    }
+    _current_run.set(run)
+    return run
+
+@contextmanager
+def span(name: str, rows: int = None):
+    """
+    Records wall time, row count and traced memory for the enclosed block.
+    The yielded dict can be updated with "rows" once the count is known. Does
+    nothing when no run is active.
+    """
+    run = _current_run.get()
+    record = {"name": name, "rows": rows}
+    if run is None:
+        yield record
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        mem_before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    record["start_s"] = start - run["_start"]
+    record["depth"] = run["_depth"]
+    run["_depth"] += 1
+    try:
+        yield record
+    finally:
+        run["_depth"] -= 1
+        record["seconds"] = time.perf_counter() - start
+        if tracing:
+            mem_after, mem_peak = tracemalloc.get_traced_memory()
+            record["alloc_mb"] = (mem_after - mem_before) / 1e6
+            record["peak_mb"] = mem_peak / 1e6
+        run["spans"].append(record)
+
+def timed(name: str):
+    """
+    Decorator form of span(). The row count is taken from the result when it
+    has a length, otherwise from the first argument.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name) as record:
+                result = fn(*args, **kwargs)
+                for candidate in (result, args[0] if args else None):
+                    try:
+                        record["rows"] = len(candidate)
+                        break
+                    except TypeError:
+                        continue
+                return result
+        return wrapper
+    return decorator
+
+def finish_run(log_path: str = PROFILE_LOG_PATH):
+    """
+    Ends the current run and returns it. When log_path is set, every span is
+    appended to it as one JSON line tagged with the run id.
+    """
+    run = _current_run.get()
+    if run is None:
+        return None
+    _current_run.set(None)
+    if run.pop("_traced"):
+        _release_tracing()
+    run["total_s"] = time.perf_counter() - run.pop("_start")
+    run.pop("_depth")
+    run["spans"].sort(key=lambda record: record["start_s"])
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            for record in run["spans"]:
+                f.write(json.dumps({
+                    "run_id": run["run_id"],
+                    "label": run["label"],
+                    "started_at": run["started_at"],
+                    **record
+                }, default=str) + "\n")
+    return run
+
+# -------------------------------
+# On-Demand cProfile Capture
+# -------------------------------
+def start_profiler():
+    """Starts a cProfile capture; pass the result to profile_report()."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def profile_report(profiler, limit: int = 40):
+    """Stops the profiler and returns its top functions by cumulative time."""
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,85 @@
+# rollup.py
+
+import threading
+import numpy as np
+import pandas as pd
+from profiling import timed
+
+# -------------------------------
+# Rollup Cube Definition
+# -------------------------------
+# One cell per combination of the sidebar filter dimensions and crop. Every
+# measure is additive (sums and counts), so any filter on the dimensions is
+# answered by summing cells; means are rebuilt as sum / count.
+ROLLUP_DIMENSIONS = ["owner", "season", "farm_location", "crop_name"]
+SUM_MEASURES = ["size_ha", "expected_yield", "actual_yield", "total_revenue", "total_expense", "total_input_cost"]
+MEAN_MEASURES = ["profit_margin", "rt_temperature", "rt_humidity", "rt_rainfall"]
+
+@timed("rollup.build_rollup")
+def build_rollup(df: pd.DataFrame):
+    """
+    Aggregates the master frame into the rollup cube: `rows` per cell, a
+    `<col>` sum for each SUM_MEASURES column and `<col>_sum`/`<col>_count`
+    for each MEAN_MEASURES column. Rows with a missing dimension keep their
+    own cell.
+    """
+    measures = {"rows": np.ones(len(df), dtype="int64")}
+    for col in SUM_MEASURES:
+        if col in df.columns:
+            measures[col] = pd.to_numeric(df[col], errors="coerce").astype("float64").fillna(0).to_numpy()
+    for col in MEAN_MEASURES:
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors="coerce").astype("float64")
+            measures[f"{col}_sum"] = values.fillna(0).to_numpy()
+            measures[f"{col}_count"] = values.notna().to_numpy(dtype="int64")
+    frame = pd.DataFrame(measures, index=df.index)
+    keys = [df[dim] for dim in ROLLUP_DIMENSIONS]
+    return frame.groupby(keys, observed=True, dropna=False).sum().reset_index()
+
+# The cube for the most recently loaded frame, shared by every session.
+_rollup = {"source": None, "cube": None}
+_rollup_lock = threading.Lock()
+
+def get_rollup(df: pd.DataFrame):
+    """Returns the cube for `df`, building it only when a new frame is loaded."""
+    with _rollup_lock:
+        if _rollup["source"] is df:
+            return _rollup["cube"]
+    cube = build_rollup(df)
+    with _rollup_lock:
+        _rollup.update(source=df, cube=cube)
+    return cube
+
+# -------------------------------
+# Query the Cube
+# -------------------------------
+def filter_rollup(cube: pd.DataFrame, owners=None, seasons=None, locations=None):
+    """Applies the sidebar filters to the cube cells (same semantics as on rows)."""
+    mask = np.ones(len(cube), dtype=bool)
+    for column, values in (("owner", owners), ("season", seasons), ("farm_location", locations)):
+        if values:
+            mask &= cube[column].isin(values).to_numpy()
+    return cube[mask]
+
+def rollup_by(cube: pd.DataFrame, dimensions):
+    """Sums cells up to `dimensions` and adds a `<col>` mean for each MEAN_MEASURES column."""
+    out = cube.groupby(dimensions, observed=True).sum(numeric_only=True)
+    for col in MEAN_MEASURES:
+        if f"{col}_sum" in out.columns:
+            out[col] = out[f"{col}_sum"] / out[f"{col}_count"].where(out[f"{col}_count"] > 0)
+    return out
+
+def rollup_totals(cube: pd.DataFrame):
+    """
+    Returns a dict of totals over the given cells: each sum measure, the
+    mean of each mean measure, `rows` and `crops` (distinct crop names).
+    """
+    sums = cube.sum(numeric_only=True)
+    totals = {col: float(sums[col]) for col in SUM_MEASURES if col in sums}
+    for col in MEAN_MEASURES:
+        if f"{col}_sum" in sums:
+            count = sums[f"{col}_count"]
+            totals[col] = float(sums[f"{col}_sum"] / count) if count else np.nan
+    totals["rows"] = int(sums.get("rows", 0))
+    totals["crops"] = int(cube.loc[cube["rows"] > 0, "crop_name"].dropna().nunique())
+    return totals
@@ -0,0 +1,177 @@
+# snapshot.py
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+from utils import export_geometry_cache, restore_geometry_cache
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshot")
+# After a failed background refresh, wait this long before trying again.
+SNAPSHOT_RETRY_S = int(os.getenv("SNAPSHOT_RETRY_S", "30"))
+# A frame whose DB watermark was already saved (e.g. one reloaded only for
+# newer real-time weather) is written again at most this often.
+SNAPSHOT_MIN_INTERVAL_S = int(os.getenv("SNAPSHOT_MIN_INTERVAL_S", "900"))
+
+# -------------------------------
+# Write Snapshot
+# -------------------------------
+# The enriched master frame and the parsed geometry cache are stored as
+# uncompressed Arrow IPC files, which can be memory-mapped on load instead
+# of being parsed. Files are written to a temporary name and swapped in, so
+# a reader never sees a half-written snapshot.
+_write_lock = threading.Lock()
+
+def _write_table(table: pa.Table, path: str):
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def save_snapshot(df, watermark=None, snapshot_dir: str = None):
+    """
+    Persists the enriched master frame, its load metadata and the geometry
+    cache. Errors are printed rather than raised: a missing snapshot only
+    costs the next cold start.
+    """
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    try:
+        with _write_lock:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            _write_table(pa.Table.from_pandas(export_geometry_cache(), preserve_index=False),
+                         os.path.join(snapshot_dir, "geometry.arrow"))
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            info = {"saved_at": time.time(), "rows": len(df), "watermark": watermark}
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}),
+                b"snapshot": json.dumps(info, default=str).encode()
+            })
+            _write_table(table, os.path.join(snapshot_dir, "master.arrow"))
+    except Exception as e:
+        print(f"Snapshot write error: {e}")
+
+_background = {"thread": None, "watermark": None, "started_at": None}
+_background_lock = threading.Lock()
+
+def save_snapshot_in_background(df, watermark=None, snapshot_dir: str = None):
+    """
+    Saves the snapshot on a daemon thread when the DB watermark changed or
+    the last save is older than SNAPSHOT_MIN_INTERVAL_S, and no save is
+    already running. Returns True if a save started.
+    """
+    with _background_lock:
+        running = _background["thread"] is not None and _background["thread"].is_alive()
+        recent = (_background["started_at"] is not None and _background["watermark"] == watermark
+                  and time.time() - _background["started_at"] < SNAPSHOT_MIN_INTERVAL_S)
+        if running or recent:
+            return False
+        thread = threading.Thread(target=save_snapshot, args=(df, watermark, snapshot_dir), daemon=True)
+        _background.update(thread=thread, watermark=watermark, started_at=time.time())
+        thread.start()
+        return True
+
+# -------------------------------
+# Load Snapshot
+# -------------------------------
+# The last loaded snapshot is reused until the file changes, so every rerun
+# sees the same frame object.
+_loaded = {"key": None, "df": None, "info": None}
+_load_lock = threading.Lock()
+
+def _read_table(path: str):
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+def _restore_geometry(table: pa.Table):
+    coords = table.column("coords").combine_chunks()
+    points = coords.flatten().to_numpy(zero_copy_only=False).astype("float64").reshape(-1, 2)
+    offsets = coords.offsets.to_numpy() // 2
+    restore_geometry_cache(
+        table.column("location_id").to_pylist(), table.column("source").to_pylist(),
+        table.column("kind").to_pylist(), table.column("lat").to_pylist(), table.column("lon").to_pylist(),
+        np.split(points, offsets[1:-1])
+    )
+
+def load_snapshot(snapshot_dir: str = None):
+    """
+    Returns (df, info) from the snapshot on disk, where info holds saved_at
+    (epoch seconds), rows and the DB watermark it was taken at. Returns
+    (None, None) when no readable snapshot exists.
+    """
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    path = os.path.join(snapshot_dir, "master.arrow")
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _load_lock:
+        if _loaded["key"] == key:
+            return _loaded["df"], _loaded["info"]
+        try:
+            table = _read_table(path)
+            info = json.loads(table.schema.metadata.get(b"snapshot", b"{}"))
+            geometry_path = os.path.join(snapshot_dir, "geometry.arrow")
+            if os.path.exists(geometry_path):
+                _restore_geometry(_read_table(geometry_path))
+            df = table.to_pandas()
+        except Exception as e:
+            print(f"Snapshot read error: {e}")
+            return None, None
+        _loaded.update(key=key, df=df, info=info)
+        return df, info
+
+def snapshot_exists(snapshot_dir: str = None):
+    return os.path.exists(os.path.join(snapshot_dir or SNAPSHOT_DIR, "master.arrow"))
+
+def describe_age(info: dict):
+    """Human-readable snapshot time and age, e.g. '2025-06-01 08:30 (2h 5m old)'."""
+    saved_at = info.get("saved_at", 0)
+    minutes = int((time.time() - saved_at) // 60)
+    age = f"{minutes // 60}h {minutes % 60}m" if minutes >= 60 else f"{minutes}m"
+    return f"{datetime.fromtimestamp(saved_at).strftime('%Y-%m-%d %H:%M')} ({age} old)"
+
+# -------------------------------
+# Background Refresh
+# -------------------------------
+# One refresh runs at a time per process, no matter how many sessions ask.
+_refresh = {"thread": None, "started_at": None, "finished_at": None, "error": None}
+_refresh_lock = threading.Lock()
+
+def _run_refresh(loader):
+    error = None
+    try:
+        loader()
+    except Exception as e:
+        error = e
+        print(f"Background refresh error: {e}")
+    with _refresh_lock:
+        _refresh.update(finished_at=time.time(), error=error)
+
+def refresh_in_background(loader):
+    """
+    Runs loader() (which should load live data and save a snapshot) on a
+    daemon thread unless one is already running or the last attempt failed
+    less than SNAPSHOT_RETRY_S seconds ago. Returns True if it started.
+    """
+    with _refresh_lock:
+        running = _refresh["thread"] is not None and _refresh["thread"].is_alive()
+        recent_failure = (_refresh["error"] is not None
+                          and time.time() - _refresh["finished_at"] < SNAPSHOT_RETRY_S)
+        if running or recent_failure:
+            return False
+        thread = threading.Thread(target=_run_refresh, args=(loader,), daemon=True)
+        _refresh.update(thread=thread, started_at=time.time(), finished_at=None, error=None)
+        thread.start()
+        return True
+
+def refresh_status():
+    """Returns running, started_at, finished_at and the last error (or None)."""
+    with _refresh_lock:
+        running = _refresh["thread"] is not None and _refresh["thread"].is_alive()
+        return {"running": running, "started_at": _refresh["started_at"],
+                "finished_at": _refresh["finished_at"], "error": _refresh["error"]}
@@ -0,0 +1,79 @@
+# tests/test_cache.py
+
+import threading
+import pytest
+import cache
+from cache import cached, has_entry
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache.clear_cache()
+    yield
+    cache.clear_cache()
+
+class _WatchedEvent(threading.Event):
+    # Reports when a caller starts waiting on it.
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Event()
+
+    def wait(self, timeout=None):
+        self.waiting.set()
+        return super().wait(timeout)
+
+def _leader_and_waiter(loader):
+    # Runs the loader on one thread and, while it is running, a second call
+    # with the same key that joins it. Returns the loader and what each call
+    # returned or raised.
+    started, release = threading.Event(), threading.Event()
+    outcomes = {}
+
+    @cached("test_loader", ttl=60)
+    def load(key):
+        started.set()
+        release.wait(5)
+        return loader()
+
+    def call(role):
+        try:
+            outcomes[role] = ("value", load("k"))
+        except BaseException as e:
+            outcomes[role] = ("error", e)
+
+    leader = threading.Thread(target=call, args=("leader",))
+    leader.start()
+    assert started.wait(5)
+    done = cache._inflight["test_loader"]["done"] = _WatchedEvent()
+    waiter = threading.Thread(target=call, args=("waiter",))
+    waiter.start()
+    assert done.waiting.wait(5)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+    return load, outcomes
+
+def test_loads_are_shared_and_cached():
+    calls = []
+    load, outcomes = _leader_and_waiter(lambda: calls.append(1) or "value")
+    assert outcomes == {"leader": ("value", "value"), "waiter": ("value", "value")}
+    assert load("k") == "value"
+    assert len(calls) == 1
+    assert has_entry("test_loader")
+
+def test_failed_load_is_not_cached():
+    def fail():
+        raise ValueError("db down")
+    load, outcomes = _leader_and_waiter(fail)
+    assert outcomes["leader"][0] == "error" and isinstance(outcomes["leader"][1], ValueError)
+    assert outcomes["waiter"][1] is outcomes["leader"][1]
+    assert not has_entry("test_loader")
+
+def test_interrupted_load_is_not_cached():
+    def interrupt():
+        raise KeyboardInterrupt
+    load, outcomes = _leader_and_waiter(interrupt)
+    assert isinstance(outcomes["leader"][1], KeyboardInterrupt)
+    # The waiting session gets a failure instead of a None value.
+    assert outcomes["waiter"][0] == "error" and isinstance(outcomes["waiter"][1], RuntimeError)
+    assert isinstance(outcomes["waiter"][1].__cause__, KeyboardInterrupt)
+    assert not has_entry("test_loader")
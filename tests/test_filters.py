@@ -0,0 +1,101 @@
+# tests/test_filters.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from alerts import evaluate_risks, detect_risks_map
+from filters import FILTER_DIMENSIONS, build_filter_index, filter_positions, apply_filters, flagged_rows
+
+# -------------------------------
+# Random Frames
+# -------------------------------
+# A few values are common enough to get bitmaps and a long tail is not, so
+# both resolve paths run; some dimension values are missing.
+def random_frame(rng, rows=5000):
+    def dimension(prefix, values):
+        weights = 1.0 / np.arange(1, values + 1) ** 1.5
+        picked = rng.choice(values, size=rows, p=weights / weights.sum())
+        column = pd.Series([f"{prefix} {v}" for v in picked], dtype=object)
+        column[rng.random(rows) < 0.03] = np.nan
+        return column
+
+    plots = rng.integers(0, rows // 3, size=rows)
+    return pd.DataFrame({
+        "plot_id": [f"P{p}" for p in plots],
+        "owner": dimension("Owner", 300),
+        "season": dimension("Season", 3),
+        "farm_location": dimension("Location", 40),
+        "profit_margin": rng.normal(20, 15, rows),
+        "yield_gap": rng.normal(0, 6, rows),
+        "rt_rainfall": np.where(rng.random(rows) < 0.1, np.nan, rng.exponential(15, rows)),
+    })
+
+def random_selections(rng, df):
+    selections = {}
+    for dim in FILTER_DIMENSIONS:
+        values = df[dim].dropna().unique()
+        roll = rng.random()
+        if roll < 0.3:
+            selections[dim] = []
+        elif roll < 0.9:
+            count = int(rng.integers(1, min(len(values), 8) + 1))
+            selections[dim] = list(rng.choice(values, size=count, replace=False))
+        else:
+            # Unknown values match nothing, as with isin.
+            selections[dim] = [f"{dim} missing"] + list(values[:1])
+    return selections
+
+def reference_view(df, selections, alerts_only):
+    # The dashboard's original filtering: one isin per dimension, then the
+    # plots detect_risks_map flags among the remaining rows.
+    for dim, values in selections.items():
+        if values:
+            df = df[df[dim].isin(values)]
+    if alerts_only:
+        df = df[df["plot_id"].isin(detect_risks_map(df).keys())]
+    return df
+
+# -------------------------------
+# Tests
+# -------------------------------
+@pytest.mark.parametrize("seed", range(5))
+def test_filters_match_isin(seed):
+    rng = np.random.default_rng(seed)
+    df = random_frame(rng)
+    index = build_filter_index(df)
+    for _ in range(40):
+        selections = random_selections(rng, df)
+        for alerts_only in (False, True):
+            expected = reference_view(df, selections, alerts_only)
+            pd.testing.assert_frame_equal(apply_filters(df, index, selections, alerts_only), expected)
+
+def test_both_resolve_paths_are_covered():
+    df = random_frame(np.random.default_rng(0))
+    index = build_filter_index(df)
+    # Owners and locations have both dense (bitmap) and sparse values.
+    for dim in ("owner", "farm_location"):
+        entry = index["dimensions"][dim]
+        assert 0 < len(entry["bitmaps"]) < len(entry["values"]), dim
+
+def test_nothing_selected():
+    df = random_frame(np.random.default_rng(1))
+    index = build_filter_index(df)
+    empty = {dim: [] for dim in FILTER_DIMENSIONS}
+    assert filter_positions(index, empty) is None
+    assert apply_filters(df, index, empty) is df
+    pd.testing.assert_frame_equal(apply_filters(df, index, empty, alerts_only=True),
+                                  reference_view(df, empty, alerts_only=True))
+
+def test_flagged_rows_match_risks():
+    rng = np.random.default_rng(2)
+    df = random_frame(rng)
+    index = build_filter_index(df)
+    for _ in range(20):
+        selections = random_selections(rng, df)
+        view = reference_view(df, selections, alerts_only=False)
+        risks = evaluate_risks(view)
+        frame, flags = flagged_rows(df, index, selections)
+        expected = risks.any(axis=1)
+        pd.testing.assert_frame_equal(frame, view[expected])
+        pd.testing.assert_frame_equal(flags, risks[expected])
+        assert detect_risks_map(frame, flags) == detect_risks_map(view)
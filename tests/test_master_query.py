@@ -0,0 +1,261 @@
+# tests/test_master_query.py
+
+import csv
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import date, timedelta
+import pandas as pd
+import pytest
+import benchmark
+import data
+from export import write_export
+
+# -------------------------------
+# Fan-Out Fixture
+# -------------------------------
+# Every cycle has several input, finance and weather rows, so a single
+# join of the child tables would multiply them against each other. The
+# expected values below are computed from these lists, not from SQL.
+PLOTS = [("P1", "Volta", "Owner 1", 2.5), ("P2", "Ashanti", "Owner 2", 4.0), ("P3", "Oti", "Owner 1", 1.0)]
+CYCLES = [
+    # cycle_id, plot_id, planting, harvest, season, crop
+    (1, "P1", "2024-01-20", "2024-04-10", "Major", "Maize"),
+    (2, "P1", "2024-06-01", "2024-08-31", "Minor", "Yam"),
+    (3, "P2", "2024-02-10", "2024-03-05", "Major", "Rice"),
+]
+YIELDS = [(1, 10.0, 8.0), (1, 5.0, 6.0), (2, 12.0, 9.5), (3, 7.0, 7.0)]
+INPUTS = [
+    (1, "Fertilizer", 10.0, 100.0), (1, "Fertilizer", 5.0, 50.0), (1, "Vines", 20.0, 30.0),
+    (1, "Pesticide", 2.0, 12.5), (2, "Traction", 1.0, 40.0),
+]
+FINANCE = [
+    (1, "Revenue", 500.0), (1, "Revenue", 250.0), (1, "Expense", 100.0), (1, "Expense", 80.0),
+    (1, "Expense", 20.0), (2, "Expense", 60.0), (3, "Revenue", 90.0), (3, "Expense", 30.0),
+]
+
+def _weather_rows():
+    rows, day, i = [], date(2023, 12, 15), 0
+    while day <= date(2024, 9, 15):
+        for plot_id in ("P1", "P2"):
+            humidity = None if i % 11 == 0 else 50.0 + i % 30
+            rows.append((plot_id, day.isoformat(), float(i % 7), 20.0 + i % 10, humidity))
+            i += 1
+        day += timedelta(days=1)
+    return rows
+
+WEATHER = _weather_rows()
+
+@pytest.fixture
+def fixture_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "fixture.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript(benchmark.SCHEMA_SQL)
+    conn.executemany("INSERT INTO FarmPlot VALUES (?, ?, ?, ?)", PLOTS)
+    conn.executemany("INSERT INTO Bearings (plot_id, location_geometry) VALUES (?, ?)",
+                     [(plot_id, f"POINT (0.{n} 6.{n})") for n, (plot_id, *_) in enumerate(PLOTS)])
+    conn.executemany("INSERT INTO CropCycle VALUES (?, ?, ?, ?, ?)", [c[:5] for c in CYCLES])
+    conn.executemany("INSERT INTO Crop (cycle_id, crop_name) VALUES (?, ?)", [(c[0], c[5]) for c in CYCLES])
+    conn.executemany("INSERT INTO YieldRecord (cycle_id, expected_yield, actual_yield) VALUES (?, ?, ?)", YIELDS)
+    conn.executemany("INSERT INTO InputRecord (cycle_id, input_type, quantity_used, cost) VALUES (?, ?, ?, ?)",
+                     INPUTS)
+    conn.executemany("INSERT INTO FinanceRecord (cycle_id, transaction_type, amount_10k) VALUES (?, ?, ?)", FINANCE)
+    conn.executemany("INSERT INTO WeatherRecord (plot_id, record_date, rainfall_mm, temperature_c, humidity) "
+                     "VALUES (?, ?, ?, ?, ?)", WEATHER)
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(data, "DB_BACKEND", "sqlite")
+    monkeypatch.setattr(data, "DB_SQLITE_PATH", path)
+    # No background maintainer; the rollup is brought up to date here, as a
+    # scheduled job would.
+    monkeypatch.setattr(data, "WEATHER_ROLLUP_INTERVAL_S", 0)
+    data.update_weather_rollup()
+    data.reset_query_stats()
+    return path
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+def expected_cycle(cycle_id, weather_rows=WEATHER):
+    _, plot_id, planting, harvest, _, _ = next(c for c in CYCLES if c[0] == cycle_id)
+    weather = [w for w in weather_rows if w[0] == plot_id and planting <= w[1] <= harvest]
+    inputs = [i for i in INPUTS if i[0] == cycle_id]
+    revenue = sum(f[2] for f in FINANCE if f[0] == cycle_id and f[1] == "Revenue")
+    expense = sum(f[2] for f in FINANCE if f[0] == cycle_id and f[1] == "Expense")
+    return {
+        "expected_yield": sum(y[1] for y in YIELDS if y[0] == cycle_id),
+        "actual_yield": sum(y[2] for y in YIELDS if y[0] == cycle_id),
+        "fertilizer_used": sum(i[2] for i in inputs if i[1] == "Fertilizer"),
+        "vines_used": sum(i[2] for i in inputs if i[1] == "Vines"),
+        "total_input_cost": sum(i[3] for i in inputs) if inputs else None,
+        "total_revenue": revenue,
+        "total_expense": expense,
+        "profit": revenue - expense,
+        "profit_margin": round((revenue - expense) * 100 / revenue, 2) if revenue > 0 else None,
+        "avg_rainfall": _mean([w[2] for w in weather]),
+        "avg_temperature": _mean([w[3] for w in weather]),
+        "avg_humidity": _mean([w[4] for w in weather]),
+    }
+
+def _by_cycle(df):
+    return {int(row["cycle_id"]): row for _, row in df.dropna(subset=["cycle_id"]).iterrows()}
+
+def _assert_matches(row, expected):
+    for column, value in expected.items():
+        if value is None:
+            assert row[column] != row[column], column  # NaN
+        else:
+            assert row[column] == pytest.approx(value, rel=1e-6), column
+
+# -------------------------------
+# Tests
+# -------------------------------
+def test_totals_and_averages_match_source_rows(fixture_db):
+    rows = _by_cycle(data.fetch_master_data())
+    assert sorted(rows) == [c[0] for c in CYCLES]
+    for cycle_id in rows:
+        _assert_matches(rows[cycle_id], expected_cycle(cycle_id))
+
+def test_one_row_per_cycle_without_fan_out(fixture_db):
+    # A single join of the child tables would produce this many rows for
+    # the fixture before grouping; the master query reads each child table
+    # once and returns one row per cycle plus one for the cycle-less plot.
+    with sqlite3.connect(fixture_db) as conn:
+        fanned = conn.execute("""
+            SELECT COUNT(*) FROM CropCycle cc
+            LEFT JOIN InputRecord i ON i.cycle_id = cc.cycle_id
+            LEFT JOIN FinanceRecord f ON f.cycle_id = cc.cycle_id
+            LEFT JOIN WeatherRecord w ON w.plot_id = cc.plot_id
+             AND w.record_date BETWEEN cc.planting_date AND cc.actual_harvest_date
+        """).fetchone()[0]
+    df = data.fetch_master_data()
+    assert fanned > 1000
+    assert len(df) == len(CYCLES) + 1
+    assert data.get_query_stats()["master_data"]["rows"] == len(CYCLES) + 1
+    assert df.loc[df["plot_id"] == "P3", "cycle_id"].isna().all()
+
+def test_cycle_subset_matches_full_load(fixture_db):
+    full = _by_cycle(data.fetch_master_data())
+    subset = _by_cycle(data.fetch_master_data(cycle_ids=[1, 3]))
+    assert sorted(subset) == [1, 3]
+    for cycle_id, row in subset.items():
+        _assert_matches(row, expected_cycle(cycle_id))
+        assert row["size_ha"] == full[cycle_id]["size_ha"]
+
+def test_rollup_rebuilds_after_deleted_weather_rows(fixture_db):
+    with sqlite3.connect(fixture_db) as conn:
+        conn.execute("DELETE FROM WeatherRecord WHERE plot_id = 'P1' AND record_date < '2024-03-01'")
+    # The page query keeps reading the previous rollup until it is updated.
+    before = _by_cycle(data.fetch_master_data())
+    assert before[1]["avg_rainfall"] == pytest.approx(expected_cycle(1)["avg_rainfall"], rel=1e-6)
+
+    data.update_weather_rollup()
+    remaining = [w for w in WEATHER if not (w[0] == "P1" and w[1] < "2024-03-01")]
+    rows = _by_cycle(data.fetch_master_data())
+    for cycle_id in rows:
+        _assert_matches(rows[cycle_id], expected_cycle(cycle_id, remaining))
+
+def test_page_load_does_not_build_the_rollup(fixture_db):
+    with sqlite3.connect(fixture_db) as conn:
+        conn.execute("DELETE FROM WeatherRollup")
+        conn.execute("UPDATE WeatherRollupState SET last_weather_id = -1, row_count = 0")
+    data.fetch_master_data()
+    assert "weather_rollup_update" not in data.get_query_stats()
+
+def test_large_money_values_stay_exact(fixture_db, tmp_path):
+    # Neither value survives float32: 1234567.89 becomes 1234567.875 and
+    # 16777217 becomes 16777216.
+    with sqlite3.connect(fixture_db) as conn:
+        conn.execute("INSERT INTO FinanceRecord (cycle_id, transaction_type, amount_10k) VALUES (3, 'Revenue', 1234477.89)")
+        conn.execute("INSERT INTO FinanceRecord (cycle_id, transaction_type, amount_10k) VALUES (2, 'Revenue', 16777277)")
+    df = data.fetch_master_data()
+    rows = _by_cycle(df)
+    assert rows[3]["total_revenue"] == 1234567.89
+    assert rows[2]["profit"] == 16777217
+    for column in data.MASTER_SCHEMA["money"]:
+        assert df[column].dtype == "float64", column
+
+    path = str(tmp_path / "farm.csv")
+    write_export(df, path)
+    with open(path, newline="") as handle:
+        exported = {float(row["cycle_id"]): row for row in csv.DictReader(handle) if row["cycle_id"]}
+    assert exported[3]["total_revenue"] == "1234567.89"
+    assert exported[2]["profit"] == "16777217.0"
+
+def test_concurrent_rebuilds_from_two_processes(fixture_db):
+    # Two processes (e.g. a dashboard replica and batch.py) rebuilding at
+    # once must not fold into each other's side table.
+    script = ("import data; data.DB_BACKEND = 'sqlite'; data.DB_SQLITE_PATH = %r; "
+              "data.update_weather_rollup(rebuild=True, batch_rows=25)" % fixture_db)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workers = [subprocess.Popen([sys.executable, "-c", script], cwd=root) for _ in range(3)]
+    assert [worker.wait(timeout=120) for worker in workers] == [0, 0, 0]
+    rows = _by_cycle(data.fetch_master_data())
+    for cycle_id in rows:
+        _assert_matches(rows[cycle_id], expected_cycle(cycle_id))
+
+# -------------------------------
+# Incremental Refresh
+# -------------------------------
+@pytest.fixture
+def synced(fixture_db, monkeypatch):
+    # A fresh in-memory master frame, loaded in full, for the fixture DB.
+    monkeypatch.setattr(data, "_master_state",
+                        {"df": None, "marks": None, "watermark": None, "full_load_at": 0.0})
+    data.sync_master_data(data.fetch_change_watermark())
+    data.reset_query_stats()
+    return fixture_db
+
+def _sync_and_compare(incremental=True):
+    # Refreshes the in-memory frame and checks it against a full load.
+    refreshed = data.sync_master_data(data.fetch_change_watermark())
+    stats = data.get_query_stats()
+    assert ("master_data_cycles" in stats and "master_data" not in stats) == incremental, sorted(stats)
+    full = data.fetch_master_data()
+
+    def ordered(df):
+        df = df.sort_values(["plot_id", "cycle_id"], na_position="last").reset_index(drop=True)
+        return df.astype({col: "object" for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+    pd.testing.assert_frame_equal(ordered(refreshed), ordered(full), check_dtype=False)
+    return refreshed
+
+def test_refresh_after_finance_insert(synced):
+    with sqlite3.connect(synced) as conn:
+        conn.execute("INSERT INTO FinanceRecord (cycle_id, transaction_type, amount_10k) VALUES (3, 'Revenue', 40)")
+    df = _sync_and_compare()
+    assert df.loc[df["cycle_id"] == 3, "total_revenue"].item() == 130
+
+def test_refresh_after_first_cycle_of_a_plot(synced):
+    with sqlite3.connect(synced) as conn:
+        conn.execute("INSERT INTO CropCycle VALUES (4, 'P3', '2024-05-01', '2024-07-01', 'Minor')")
+        conn.execute("INSERT INTO Crop (cycle_id, crop_name) VALUES (4, 'Cassava')")
+    df = _sync_and_compare()
+    # The plot's cycle-less placeholder row is replaced, not kept alongside.
+    assert df.loc[df["plot_id"] == "P3", "cycle_id"].tolist() == [4]
+
+def test_refresh_after_folded_weather_insert(synced):
+    with sqlite3.connect(synced) as conn:
+        conn.execute("INSERT INTO WeatherRecord (plot_id, record_date, rainfall_mm, temperature_c, humidity) "
+                     "VALUES ('P2', '2024-02-20', 500, 30, 90)")
+    # Not visible until the maintainer folds it into the rollup.
+    unfolded = data.sync_master_data(data.fetch_change_watermark())
+    assert unfolded.loc[unfolded["cycle_id"] == 3, "avg_rainfall"].item() == pytest.approx(
+        expected_cycle(3)["avg_rainfall"], rel=1e-6)
+    data.update_weather_rollup()
+    data.reset_query_stats()
+    df = _sync_and_compare()
+    weather = WEATHER + [("P2", "2024-02-20", 500.0, 30.0, 90.0)]
+    assert df.loc[df["cycle_id"] == 3, "avg_rainfall"].item() == pytest.approx(
+        expected_cycle(3, weather)["avg_rainfall"], rel=1e-6)
+
+def test_refresh_after_delete(synced):
+    with sqlite3.connect(synced) as conn:
+        conn.execute("DELETE FROM FinanceRecord WHERE cycle_id = 1 AND transaction_type = 'Revenue' "
+                     "AND amount_10k = 250")
+    # A delete cannot be attributed to cycles through the high-water marks,
+    # so it reloads in full.
+    df = _sync_and_compare(incremental=False)
+    assert df.loc[df["cycle_id"] == 1, "total_revenue"].item() == 500
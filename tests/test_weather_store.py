@@ -0,0 +1,119 @@
+# tests/test_weather_store.py
+
+import sqlite3
+import time
+from collections import deque
+import numpy as np
+import pytest
+import benchmark
+import data
+import weather_store
+
+# -------------------------------
+# Quota Window
+# -------------------------------
+class FakeClock:
+    # Stands in for the time module inside weather_store: sleeping advances
+    # the clock instead of waiting.
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(weather_store, "time", clock)
+    monkeypatch.setattr(weather_store, "_quota_calls", deque())
+    return clock
+
+@pytest.mark.parametrize("quota", [1, 7, 60])
+def test_no_minute_exceeds_the_quota(clock, monkeypatch, quota):
+    monkeypatch.setattr(weather_store, "WEATHER_QUOTA_PER_MIN", quota)
+    rng = np.random.default_rng(quota)
+    granted, paused = [], 0.0
+    for _ in range(10 * quota):
+        # Bursts with pauses of up to half a minute in between.
+        if rng.random() < 0.1:
+            pause = rng.uniform(0, 30)
+            clock.sleep(pause)
+            paused += pause
+        assert weather_store._take_call_slot()
+        granted.append(clock.now)
+    granted = np.array(granted)
+    # The busiest 60-second window starts at one of the calls.
+    in_window = np.searchsorted(granted, granted + 60, side="left") - np.arange(len(granted))
+    assert in_window.max() == quota
+    # The quota is used, not just respected: ten minutes' worth of calls
+    # take no more than ten minutes beyond the pauses.
+    assert granted[-1] - granted[0] <= 10 * 60 + paused
+
+# -------------------------------
+# Refresh Against the Stub API
+# -------------------------------
+@pytest.fixture
+def stub_api(tmp_path, monkeypatch):
+    server, url = benchmark.start_stub_weather_server()
+    monkeypatch.setattr(data, "WEATHER_API_URL", url)
+    monkeypatch.setattr(data, "WEATHER_API_KEY", "test")
+    monkeypatch.setattr(weather_store, "WEATHER_QUOTA_PER_MIN", 100000)
+    monkeypatch.setattr(weather_store, "_quota_calls", deque())
+    monkeypatch.setattr(weather_store, "WEATHER_BACKOFF_S", 30)
+    monkeypatch.setattr(weather_store, "WEATHER_STORE_WORKERS", 2)
+    yield server.RequestHandlerClass, str(tmp_path / "weather.sqlite")
+    server.shutdown()
+
+def _rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT lat, lon, failures, next_attempt, last_error, temperature "
+                            "FROM current_weather ORDER BY lat, lon").fetchall()
+
+def _make_due(path):
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE current_weather SET next_attempt = 0")
+
+def test_refresh_backs_off_after_failures(stub_api):
+    handler, path = stub_api
+    coords = [(5.0 + i / 100, -1.0) for i in range(20)]
+    assert weather_store.register_coordinates(coords, path) == 20
+
+    # Every call of the first batch (two per worker) fails: the pass stops
+    # there and those coordinates are not due again for WEATHER_BACKOFF_S.
+    handler.status = 429
+    result = weather_store.refresh_due(data.fetch_realtime_weather, path=path)
+    assert result == {"fetched": 0, "failed": 4, "throttled": True}
+    assert handler.calls == 4
+    failed = [row for row in _rows(path) if row[2]]
+    assert len(failed) == 4
+    for _, _, failures, next_attempt, last_error, temperature in failed:
+        assert failures == 1 and temperature is None and "429" in last_error
+        assert next_attempt - time.time() == pytest.approx(30, abs=5)
+
+    # The next pass only tries coordinates that are due.
+    weather_store.refresh_due(data.fetch_realtime_weather, path=path)
+    assert handler.calls == 8
+    assert sum(row[2] == 1 for row in _rows(path)) == 8
+
+    # A second failure doubles the backoff.
+    _make_due(path)
+    weather_store.refresh_due(data.fetch_realtime_weather, limit=4, path=path)
+    twice = [row for row in _rows(path) if row[2] == 2]
+    assert len(twice) == 4
+    for row in twice:
+        assert row[3] - time.time() == pytest.approx(60, abs=5)
+
+    # Once the API recovers, everything is fetched and the failures cleared.
+    handler.status = 200
+    _make_due(path)
+    result = weather_store.refresh_due(data.fetch_realtime_weather, path=path)
+    assert result == {"fetched": 20, "failed": 0, "throttled": False}
+    rows = _rows(path)
+    assert all(row[2] == 0 and row[4] is None and row[5] is not None for row in rows)
+    assert weather_store.refresher_status(path)["failing"] == 0
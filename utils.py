@@ -1,5 +1,10 @@
 # utils.py
 
+import json
+import threading
+import numpy as np
+import pandas as pd
+import shapely
 from shapely import wkt
 
 # -------------------------------
@@ -14,4 +19,217 @@ def extract_lat_lon_from_wkt(geom_str: str):
         point = wkt.loads(geom_str)
         return point.y, point.x
     except Exception:
-        return None, None
\ No newline at end of file
+        return None, None
+
+# -------------------------------
+# Geometry Cache
+# -------------------------------
+# location_id -> {"source": raw geometry string, "kind": "point" | "polygon",
+#                 "lat": centroid lat, "lon": centroid lon,
+#                 "coords": float64 array of (lat, lon) rows}
+_geometry_cache = {}
+_geometry_lock = threading.Lock()
+# Bumped on every cache change so the spatial index knows to rebuild.
+_geometry_version = 0
+
+def _decode_json(source: str):
+    try:
+        return json.loads(source)
+    except ValueError:
+        return None
+
+def _parse_json_polygons(sources: pd.Series):
+    values = sources.tolist()
+    try:
+        decoded = json.loads("[" + ",".join(values) + "]")
+    except ValueError:
+        decoded = [_decode_json(value) for value in values]
+
+    coords = {}
+    for location_id, value in zip(sources.index, decoded):
+        try:
+            array = np.asarray(value, dtype="float64").reshape(-1, 2)
+        except (ValueError, TypeError):
+            continue
+        if len(array):
+            coords[location_id] = array
+    if not coords:
+        return {}
+
+    # Centroids for every polygon with a usable ring in one vectorized pass.
+    ids = list(coords)
+    lengths = np.array([len(coords[lid]) for lid in ids])
+    rings_ok = lengths >= 3
+    centroids = {lid: coords[lid].mean(axis=0) for lid, ok in zip(ids, rings_ok) if not ok}
+    if rings_ok.any():
+        ring_ids = [lid for lid, ok in zip(ids, rings_ok) if ok]
+        flat = np.concatenate([coords[lid] for lid in ring_ids])[:, ::-1]
+        indices = np.repeat(np.arange(len(ring_ids)), lengths[rings_ok])
+        polygons = shapely.polygons(shapely.linearrings(flat, indices=indices))
+        points = shapely.centroid(polygons)
+        centroids.update(zip(ring_ids, np.column_stack([shapely.get_y(points), shapely.get_x(points)])))
+
+    sources_by_id = dict(zip(sources.index, values))
+    return {
+        lid: {"source": sources_by_id[lid], "kind": "polygon",
+              "lat": float(centroids[lid][0]), "lon": float(centroids[lid][1]), "coords": coords[lid]}
+        for lid in ids
+    }
+
+def _parse_wkt_geometries(sources: pd.Series):
+    values = sources.to_numpy(dtype=object)
+    geoms = shapely.from_wkt(values, on_invalid="ignore")
+    valid = ~shapely.is_missing(geoms) & ~shapely.is_empty(geoms)
+    ids, values, geoms = sources.index[valid], values[valid], geoms[valid]
+
+    centroids = shapely.centroid(geoms)
+    lats, lons = shapely.get_y(centroids), shapely.get_x(centroids)
+    is_point = shapely.get_type_id(geoms) == shapely.GeometryType.POINT
+    is_polygon = shapely.get_type_id(geoms) == shapely.GeometryType.POLYGON
+
+    # Exterior ring vertices for polygons (all vertices for other shapes),
+    # fetched in one call and split per geometry.
+    outlines = np.where(is_polygon, shapely.get_exterior_ring(np.where(is_polygon, geoms, None)), geoms)
+    coords, owner = shapely.get_coordinates(outlines[~is_point], return_index=True)
+    splits = np.split(coords[:, ::-1], np.flatnonzero(np.diff(owner)) + 1) if len(coords) else []
+    shape_coords = iter(splits)
+
+    parsed = {}
+    for location_id, source, lat, lon, point in zip(ids, values, lats.tolist(), lons.tolist(), is_point.tolist()):
+        if point:
+            entry = {"source": source, "kind": "point", "lat": lat, "lon": lon, "coords": np.array([[lat, lon]])}
+        else:
+            entry = {"source": source, "kind": "polygon", "lat": lat, "lon": lon, "coords": next(shape_coords)}
+        parsed[location_id] = entry
+    return parsed
+
+def geometry_keys(df: pd.DataFrame):
+    """Returns the per-row key into the geometry cache."""
+    return df["location_id"] if "location_id" in df.columns else df["location_geometry"]
+
+def _bump_geometry_version():
+    # Callers hold _geometry_lock.
+    global _geometry_version
+    _geometry_version += 1
+
+def prepare_geometry(df: pd.DataFrame):
+    """
+    Parses location_geometry once per location_id and adds centroid `lat` and
+    `lon` columns. WKT strings go through shapely's vectorized parser and JSON
+    polygon lists are decoded once; results are kept in a process-wide cache,
+    so later loads only parse locations that are new or whose geometry changed.
+    Frames without location_id are keyed by the geometry string itself.
+    """
+    if "location_geometry" not in df.columns:
+        return df.assign(lat=np.nan, lon=np.nan)
+    keys = geometry_keys(df)
+
+    sources = pd.Series(df["location_geometry"].to_numpy(), index=keys.to_numpy()).dropna()
+    sources = sources[sources.index.notna() & ~sources.index.duplicated()].astype(str)
+    with _geometry_lock:
+        cached = pd.Series({lid: entry["source"] for lid, entry in _geometry_cache.items()}, dtype=object)
+    stale = sources[sources.ne(cached.reindex(sources.index))]
+
+    if not stale.empty:
+        is_json = stale.str.startswith("[")
+        parsed = _parse_json_polygons(stale[is_json])
+        parsed.update(_parse_wkt_geometries(stale[~is_json]))
+        with _geometry_lock:
+            for location_id in stale.index:
+                _geometry_cache.pop(location_id, None)
+            _geometry_cache.update(parsed)
+            _bump_geometry_version()
+
+    with _geometry_lock:
+        centroids = pd.DataFrame.from_dict(
+            {lid: (_geometry_cache[lid]["lat"], _geometry_cache[lid]["lon"])
+             for lid in sources.index if lid in _geometry_cache},
+            orient="index", columns=["lat", "lon"], dtype="float64"
+        )
+    return df.assign(
+        lat=keys.map(centroids["lat"]).astype("float64"),
+        lon=keys.map(centroids["lon"]).astype("float64")
+    )
+
+def get_geometry(location_id):
+    """
+    Returns the cached geometry entry for a location, or None if it has not
+    been parsed (or could not be).
+    """
+    with _geometry_lock:
+        return _geometry_cache.get(location_id)
+
+def clear_geometry_cache():
+    """Drops every cached geometry, e.g. between chunks of a batch export."""
+    with _geometry_lock:
+        _geometry_cache.clear()
+        _bump_geometry_version()
+
+def export_geometry_cache():
+    """
+    Returns the geometry cache as a flat DataFrame (one row per location,
+    vertices flattened to [lat, lon, lat, lon, ...]) for persisting.
+    """
+    with _geometry_lock:
+        entries = list(_geometry_cache.items())
+    return pd.DataFrame({
+        "location_id": [lid for lid, _ in entries],
+        "source": [entry["source"] for _, entry in entries],
+        "kind": [entry["kind"] for _, entry in entries],
+        "lat": [entry["lat"] for _, entry in entries],
+        "lon": [entry["lon"] for _, entry in entries],
+        "coords": [entry["coords"].ravel().tolist() for _, entry in entries],
+    })
+
+def restore_geometry_cache(location_ids, sources, kinds, lats, lons, coords):
+    """
+    Loads entries written by export_geometry_cache(); `coords` holds one
+    (n, 2) array per location. Locations already in the cache are left
+    alone, since they may have been parsed more recently.
+    """
+    entries = {
+        lid: {"source": source, "kind": kind, "lat": lat, "lon": lon, "coords": points}
+        for lid, source, kind, lat, lon, points in zip(location_ids, sources, kinds, lats, lons, coords)
+    }
+    with _geometry_lock:
+        for lid in _geometry_cache.keys() & entries.keys():
+            del entries[lid]
+        _geometry_cache.update(entries)
+        _bump_geometry_version()
+
+# -------------------------------
+# Spatial Index
+# -------------------------------
+# STRtree over the bounding box of every cached geometry, rebuilt lazily
+# after the cache changes. Boxes use (lon, lat) axis order.
+_spatial_index = {"version": None, "tree": None, "keys": None}
+_spatial_lock = threading.Lock()
+
+def _build_spatial_index():
+    with _geometry_lock:
+        version = _geometry_version
+        keys = list(_geometry_cache)
+        coords = [_geometry_cache[lid]["coords"] for lid in keys]
+    if keys:
+        lengths = np.array([len(points) for points in coords])
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        flat = np.concatenate(coords)
+        lo = np.minimum.reduceat(flat, starts)
+        hi = np.maximum.reduceat(flat, starts)
+        tree = shapely.STRtree(shapely.box(lo[:, 1], lo[:, 0], hi[:, 1], hi[:, 0]))
+    else:
+        tree = shapely.STRtree([])
+    return {"version": version, "tree": tree, "keys": np.array(keys, dtype=object)}
+
+def query_viewport(south: float, west: float, north: float, east: float):
+    """
+    Returns the geometry cache keys whose extent intersects the given
+    lat/lon bounds, using an STRtree built over the cache.
+    """
+    global _spatial_index
+    with _spatial_lock:
+        if _spatial_index["version"] != _geometry_version:
+            _spatial_index = _build_spatial_index()
+        index = _spatial_index
+    hits = index["tree"].query(shapely.box(west, south, east, north))
+    return index["keys"][hits]
@@ -1,43 +1,78 @@
 # weather.py
 
+import os
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from data import fetch_weather_history
+from data import fetch_weather_history_batch
+from profiling import timed
+
+WEATHER_POINT_BUDGET = int(os.getenv("WEATHER_POINT_BUDGET", "400"))
 
 # -------------------------------
 # Render Historical Weather Overlay
 # -------------------------------
-def render_weather_overlay(df: pd.DataFrame, selected_plots: list):
-    weather_frames = []
-    for pid in selected_plots:
-        row = df[df["plot_id"] == pid].iloc[0]
-        wdf = fetch_weather_history(pid, row["planting_date"], row["actual_harvest_date"])
-        if not wdf.empty:
-            wdf["Plot ID"] = pid
-            wdf["Owner"] = row["owner"]
-            wdf["Crop"] = row["crop_name"]
-            wdf["Yield (tons)"] = row["actual_yield"]
-            wdf["Profit Margin (%)"] = row["profit_margin"]
-            weather_frames.append(wdf)
+@timed("weather.render_weather_overlay")
+def render_weather_overlay(df: pd.DataFrame, selected_plots: list, point_budget: int = WEATHER_POINT_BUDGET,
+                           webgl: bool = True):
+    """
+    Plots temperature and rainfall for the selected plots. Each plot's series
+    is reduced to `point_budget` points with LTTB (None keeps every row) and
+    drawn with WebGL traces unless webgl=False.
+    """
+    plots = df.drop_duplicates(subset="plot_id").set_index("plot_id")
+    selected = plots.reindex(pd.unique(pd.Series(selected_plots))).dropna(how="all")
+    windows = selected[["planting_date", "actual_harvest_date"]].rename_axis("plot_id").reset_index()
 
-    combined_weather = pd.concat(weather_frames) if weather_frames else pd.DataFrame()
+    combined_weather = fetch_weather_history_batch(windows, max_points=point_budget)
+    if not combined_weather.empty:
+        meta = selected[["owner", "crop_name", "actual_yield", "profit_margin"]].rename(columns={
+            "owner": "Owner",
+            "crop_name": "Crop",
+            "actual_yield": "Yield (tons)",
+            "profit_margin": "Profit Margin (%)"
+        })
+        meta["plot_order"] = range(len(meta))
+        combined_weather = combined_weather.join(meta, on="plot_id")
+        combined_weather = combined_weather.sort_values(["plot_order", "record_date"], kind="stable")
+        combined_weather = combined_weather.drop(columns="plot_order").rename(columns={"plot_id": "Plot ID"})
 
     if combined_weather.empty:
         return None
+    return build_weather_figure(combined_weather, point_budget, webgl)
+
+# -------------------------------
+# Build Weather Figure
+# -------------------------------
+@timed("weather.build_weather_figure")
+def build_weather_figure(combined_weather: pd.DataFrame, point_budget: int = WEATHER_POINT_BUDGET,
+                         webgl: bool = True):
+    """
+    Builds the overlay figure from the long-format frame assembled by
+    render_weather_overlay (record_date, temperature_c, rainfall_mm, Plot ID,
+    Owner, Yield (tons), Profit Margin (%)).
+    """
+    combined_weather = combined_weather.assign(record_date=pd.to_datetime(combined_weather["record_date"]))
+    if point_budget:
+        temperature = downsample_by_group(combined_weather, "record_date", "temperature_c", "Plot ID", point_budget)
+        rainfall = downsample_by_group(combined_weather, "record_date", "rainfall_mm", "Plot ID", point_budget)
+    else:
+        temperature = rainfall = combined_weather
 
     fig = px.line(
-        combined_weather,
+        temperature,
         x="record_date",
         y="temperature_c",
         color="Plot ID",
         line_dash="Owner",
-        title="Temperature Trends by Plot"
+        title="Temperature Trends by Plot",
+        render_mode="webgl" if webgl else "svg"
     )
 
     fig.add_bar(
-        x=combined_weather["record_date"],
-        y=combined_weather["rainfall_mm"],
+        x=rainfall["record_date"],
+        y=rainfall["rainfall_mm"],
         name="Rainfall (mm)",
         opacity=0.4
     )
@@ -48,24 +83,74 @@ def render_weather_overlay(df: pd.DataFrame, selected_plots: list):
         legend_title="Plot ID"
     )
 
-    for pid in selected_plots:
-        subset = combined_weather[combined_weather["Plot ID"] == pid]
-        if not subset.empty:
-            fig.add_scatter(
-                x=[subset["record_date"].min()],
-                y=[subset["Yield (tons)"].iloc[0]],
-                mode="markers+text",
-                name=f"Yield ({pid})",
-                yaxis="y2",
-                marker=dict(symbol="circle", size=10)
-            )
-            fig.add_scatter(
-                x=[subset["record_date"].max()],
-                y=[subset["Profit Margin (%)"].iloc[0]],
-                mode="markers+text",
-                name=f"Profit Margin ({pid})",
-                yaxis="y2",
-                marker=dict(symbol="diamond", size=10)
-            )
+    markers = combined_weather.groupby("Plot ID", sort=False, observed=True).agg(
+        first_date=("record_date", "min"),
+        last_date=("record_date", "max"),
+        yield_tons=("Yield (tons)", "first"),
+        profit_margin=("Profit Margin (%)", "first")
+    )
+    for pid, marker in markers.iterrows():
+        fig.add_scatter(
+            x=[marker["first_date"]],
+            y=[marker["yield_tons"]],
+            mode="markers+text",
+            name=f"Yield ({pid})",
+            yaxis="y2",
+            marker=dict(symbol="circle", size=10)
+        )
+        fig.add_scatter(
+            x=[marker["last_date"]],
+            y=[marker["profit_margin"]],
+            mode="markers+text",
+            name=f"Profit Margin ({pid})",
+            yaxis="y2",
+            marker=dict(symbol="diamond", size=10)
+        )
+
+    return fig
+
+# -------------------------------
+# Largest-Triangle-Three-Buckets Downsampling
+# -------------------------------
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int):
+    """
+    Picks `threshold` positions from a series sorted by x that preserve its
+    visual shape (Steinarsson's Largest-Triangle-Three-Buckets). The first and
+    last points are always kept; NaN y values are treated as 0 for selection.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.nan_to_num(np.asarray(y, dtype="float64"))
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    edges[-1] = n - 1
+    # Bucket averages for every bucket at once; the last "bucket" is the final point.
+    starts = np.append(edges[:-1], n - 1)
+    counts = np.diff(np.append(starts, n))
+    avg_x = np.add.reduceat(x, starts) / counts
+    avg_y = np.add.reduceat(y, starts) / counts
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[prev] - avg_x[i + 1]) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y[i + 1] - y[prev])
+        )
+        prev = start + int(area.argmax())
+        selected[i + 1] = prev
+    return selected
 
-    return fig
\ No newline at end of file
+def downsample_by_group(frame: pd.DataFrame, x_col: str, y_col: str, group_col: str, threshold: int):
+    """
+    Applies LTTB to each group's series separately and returns the kept rows.
+    """
+    kept = []
+    for _, group in frame.groupby(group_col, sort=False, observed=True):
+        group = group.sort_values(x_col, kind="stable")
+        x = group[x_col].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        kept.append(group.iloc[lttb_indices(x, group[y_col].to_numpy(), threshold)])
+    return pd.concat(kept) if kept else frame
@@ -0,0 +1,268 @@
+# weather_store.py
+
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import pandas as pd
+import requests
+
+WEATHER_STORE_PATH = os.getenv("WEATHER_STORE_PATH", "weather_store.sqlite")
+# API calls allowed per minute (OpenWeather's free plan allows 60).
+WEATHER_QUOTA_PER_MIN = int(os.getenv("WEATHER_QUOTA_PER_MIN", "60"))
+# Stored conditions older than this are refetched. Until the refetch
+# succeeds, the old values keep being served.
+WEATHER_MAX_AGE_S = int(os.getenv("WEATHER_MAX_AGE_S", "600"))
+# Failed coordinates are retried after WEATHER_BACKOFF_S, doubling on every
+# further failure up to WEATHER_BACKOFF_MAX_S.
+WEATHER_BACKOFF_S = int(os.getenv("WEATHER_BACKOFF_S", "30"))
+WEATHER_BACKOFF_MAX_S = int(os.getenv("WEATHER_BACKOFF_MAX_S", "3600"))
+# store_version() changes at most this often, which bounds how often the
+# dashboard re-joins the stored conditions onto its frame.
+WEATHER_PUBLISH_S = int(os.getenv("WEATHER_PUBLISH_S", "60"))
+WEATHER_STORE_WORKERS = int(os.getenv("WEATHER_STORE_WORKERS", "4"))
+# How long the worker sleeps when nothing is due.
+WEATHER_IDLE_S = 5
+
+# -------------------------------
+# Local Store
+# -------------------------------
+# One row per rounded plot coordinate. next_attempt is when the row is due
+# for a fetch: 0 for new coordinates, fetched_at + WEATHER_MAX_AGE_S after a
+# success and the backoff time after a failure.
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS current_weather (
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        temperature REAL,
+        humidity REAL,
+        rainfall REAL,
+        fetched_at REAL,
+        next_attempt REAL NOT NULL DEFAULT 0,
+        failures INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        PRIMARY KEY (lat, lon)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS current_weather_due ON current_weather (next_attempt)",
+    "CREATE INDEX IF NOT EXISTS current_weather_fetched ON current_weather (fetched_at)",
+]
+_initialized = set()
+_init_lock = threading.Lock()
+
+@contextmanager
+def _connect(path: str = None):
+    # One short-lived connection per call; WAL lets the dashboard read while
+    # the worker writes.
+    path = path or WEATHER_STORE_PATH
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with _init_lock:
+            if path not in _initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                _initialized.add(path)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def register_coordinates(coords, path: str = None):
+    """Adds (lat, lon) pairs the store doesn't know yet; they are due immediately. Returns how many were new."""
+    with _connect(path) as conn:
+        before = conn.total_changes
+        conn.executemany("INSERT OR IGNORE INTO current_weather (lat, lon) VALUES (?, ?)",
+                         [(float(lat), float(lon)) for lat, lon in coords])
+        return conn.total_changes - before
+
+def read_current_weather(path: str = None):
+    """
+    Returns the stored conditions as a DataFrame with lat, lon,
+    rt_temperature, rt_humidity, rt_rainfall and fetched_at (NaN for
+    coordinates that have not been fetched yet).
+    """
+    with _connect(path) as conn:
+        return pd.read_sql_query("""
+            SELECT lat, lon, temperature AS rt_temperature, humidity AS rt_humidity,
+                   rainfall AS rt_rainfall, fetched_at
+            FROM current_weather
+        """, conn)
+
+def store_version(path: str = None):
+    """A value that changes when newer conditions were stored, at most once per WEATHER_PUBLISH_S."""
+    with _connect(path) as conn:
+        latest = conn.execute("SELECT MAX(fetched_at) FROM current_weather").fetchone()[0]
+    return None if latest is None else int(latest // WEATHER_PUBLISH_S)
+
+# -------------------------------
+# Quota-Aware Refresh
+# -------------------------------
+# A sliding window shared by every refresh in the process: a call is allowed
+# only while fewer than WEATHER_QUOTA_PER_MIN calls were made in the last 60
+# seconds, so no 60-second window ever exceeds the quota.
+_quota_calls = deque()
+_quota_lock = threading.Lock()
+
+def _take_call_slot(stop=None):
+    """Blocks until the quota allows one more call. Returns False if `stop` was set while waiting."""
+    while True:
+        with _quota_lock:
+            now = time.monotonic()
+            while _quota_calls and _quota_calls[0] <= now - 60:
+                _quota_calls.popleft()
+            if len(_quota_calls) < max(1, WEATHER_QUOTA_PER_MIN):
+                _quota_calls.append(now)
+                return True
+            wait = _quota_calls[0] + 60 - now
+        if stop is None:
+            time.sleep(wait)
+        elif stop.wait(wait):
+            return False
+
+def _backoff(failures: int):
+    return min(WEATHER_BACKOFF_MAX_S, WEATHER_BACKOFF_S * 2 ** max(0, failures - 1))
+
+def _save_results(results, path: str = None):
+    now = time.time()
+    succeeded = [(w["temperature"], w["humidity"], w["rainfall"], now, now + WEATHER_MAX_AGE_S, lat, lon)
+                 for lat, lon, _, w, error in results if error is None]
+    failed = [(failures + 1, now + _backoff(failures + 1), error, lat, lon)
+              for lat, lon, failures, _, error in results if error is not None]
+    with _connect(path) as conn:
+        conn.executemany("""
+            UPDATE current_weather
+            SET temperature = ?, humidity = ?, rainfall = ?, fetched_at = ?, next_attempt = ?,
+                failures = 0, last_error = NULL
+            WHERE lat = ? AND lon = ?
+        """, succeeded)
+        conn.executemany("""
+            UPDATE current_weather SET failures = ?, next_attempt = ?, last_error = ?
+            WHERE lat = ? AND lon = ?
+        """, failed)
+
+def refresh_due(fetch, limit: int = None, missing_only: bool = False, coords=None, path: str = None, stop=None):
+    """
+    Fetches due coordinates with fetch(lat, lon, session), which returns a
+    dict with temperature, humidity and rainfall or raises. Never-fetched
+    coordinates go first, then the longest-overdue ones; `coords` restricts
+    the pass to the given (lat, lon) pairs. Calls are paced by
+    the quota and fetched in batches of two per worker thread, each written
+    to the store as it completes. A batch in which every call failed ends
+    the pass early (the API is down or throttling). Returns counts of
+    fetched and failed coordinates and whether the pass was cut short.
+    """
+    filter_missing = "AND fetched_at IS NULL" if missing_only else ""
+    with _connect(path) as conn:
+        due = conn.execute(f"""
+            SELECT lat, lon, failures FROM current_weather
+            WHERE next_attempt <= ? {filter_missing}
+            ORDER BY fetched_at IS NOT NULL, next_attempt
+            LIMIT ?
+        """, (time.time(), -1 if limit is None or coords is not None else limit)).fetchall()
+    if coords is not None:
+        wanted = {(float(lat), float(lon)) for lat, lon in coords}
+        due = [row for row in due if (row[0], row[1]) in wanted][:limit]
+
+    totals = {"fetched": 0, "failed": 0, "throttled": False}
+    workers = max(1, WEATHER_STORE_WORKERS)
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        def fetch_one(row):
+            lat, lon, failures = row
+            if not _take_call_slot(stop):
+                return None
+            try:
+                return lat, lon, failures, fetch(lat, lon, session), None
+            except Exception as e:
+                return lat, lon, failures, None, str(e) or type(e).__name__
+
+        batch_size = 2 * workers
+        for start in range(0, len(due), batch_size):
+            results = [r for r in pool.map(fetch_one, due[start:start + batch_size]) if r is not None]
+            if results:
+                _save_results(results, path)
+            failed = sum(r[4] is not None for r in results)
+            totals["fetched"] += len(results) - failed
+            totals["failed"] += failed
+            if (stop is not None and stop.is_set()) or (results and failed == len(results)):
+                totals["throttled"] = failed > 0 and failed == len(results)
+                break
+    return totals
+
+# -------------------------------
+# Background Worker
+# -------------------------------
+# One worker per process keeps every registered coordinate warm. Each pass
+# takes about ten seconds of quota; after a fully failed batch the worker
+# pauses for an exponentially growing backoff.
+_worker = {"thread": None, "stop": None, "passes": 0, "fetched": 0, "failed": 0,
+           "last_pass_at": None, "backoff_s": 0, "error": None}
+_worker_lock = threading.Lock()
+
+def _run_worker(fetch, path, stop):
+    backoff = 0
+    while not stop.is_set():
+        error = None
+        try:
+            result = refresh_due(fetch, limit=max(1, WEATHER_QUOTA_PER_MIN // 6), path=path, stop=stop)
+        except Exception as e:
+            error = e
+            result = {"fetched": 0, "failed": 0, "throttled": True}
+            print(f"Weather refresh error: {e}")
+        backoff = min(WEATHER_BACKOFF_MAX_S, max(WEATHER_BACKOFF_S, backoff * 2)) if result["throttled"] else 0
+        with _worker_lock:
+            _worker.update(passes=_worker["passes"] + 1, last_pass_at=time.time(), backoff_s=backoff,
+                           error=error, fetched=_worker["fetched"] + result["fetched"],
+                           failed=_worker["failed"] + result["failed"])
+        if backoff:
+            stop.wait(backoff)
+        elif not (result["fetched"] or result["failed"]):
+            stop.wait(WEATHER_IDLE_S)
+
+def start_weather_refresher(fetch, path: str = None):
+    """Starts the background worker unless it is already running. Returns True if it started."""
+    with _worker_lock:
+        if _worker["thread"] is not None and _worker["thread"].is_alive():
+            return False
+        stop = threading.Event()
+        thread = threading.Thread(target=_run_worker, args=(fetch, path, stop), daemon=True,
+                                  name="weather-refresher")
+        _worker.update(thread=thread, stop=stop)
+        thread.start()
+        return True
+
+def stop_weather_refresher(timeout: float = None):
+    with _worker_lock:
+        thread, stop = _worker["thread"], _worker["stop"]
+    if thread is not None:
+        stop.set()
+        thread.join(timeout)
+
+def refresher_status(path: str = None):
+    """
+    Returns the worker state (running, passes, fetched, failed, backoff_s,
+    error) and store coverage: coordinates known, fresh, never fetched and
+    currently failing, plus the oldest fetch time.
+    """
+    with _connect(path) as conn:
+        known, fresh, missing, failing, oldest = conn.execute("""
+            SELECT COUNT(*),
+                   COALESCE(SUM(fetched_at >= ?), 0),
+                   COALESCE(SUM(fetched_at IS NULL), 0),
+                   COALESCE(SUM(failures > 0), 0),
+                   MIN(fetched_at)
+            FROM current_weather
+        """, (time.time() - WEATHER_MAX_AGE_S,)).fetchone()
+    with _worker_lock:
+        running = _worker["thread"] is not None and _worker["thread"].is_alive()
+        status = {k: v for k, v in _worker.items() if k not in ("thread", "stop")}
+    return {"running": running, **status, "known": known, "fresh": fresh, "missing": missing,
+            "failing": failing, "oldest_fetched_at": oldest}